@@ -0,0 +1,18 @@
+"""
+Installs the src directory as the landcover package, with the stage
+scripts, the shared helpers in lib and the landcover command.
+
+> pip install .
+"""
+
+from setuptools import setup
+
+setup(name='landcover',
+      version='0.1.0',
+      description='Calibration and land cover classification of WorldView scenes',
+      package_dir={'landcover': 'src'},
+      packages=['landcover', 'landcover.cal', 'landcover.classification', 'landcover.lib'],
+      package_data={'landcover.lib': ['*.json', '*.txt']},
+      python_requires='>=3.6',
+      install_requires=['numpy', 'rasterio', 'fiona', 'shapely'],
+      entry_points={'console_scripts': ['landcover = landcover.cli:main']})
@@ -0,0 +1,15 @@
+"""
+The landcover package.
+
+Installing the repository (pip install .) makes src importable as
+landcover and adds the landcover command, which runs any chain of the
+stages over a directory of scenes in one process:
+
+> landcover run -ip /path/to/raw -op /path/to/out --stages rad,atmcorr,refl,class,shp
+
+landcover.api holds the stages as functions on arrays or open rasterio
+datasets, and landcover.pipeline runs them on files the same way the
+stage scripts in cal and classification do.
+"""
+
+__version__ = '0.1.0'
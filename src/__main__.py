@@ -0,0 +1,7 @@
+"""
+Lets the package be run as python -m landcover.
+"""
+
+from .cli import main
+
+main()
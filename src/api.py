@@ -0,0 +1,215 @@
+"""
+The stages of the workflow as functions on arrays.
+
+Every function takes the data of a scene either as a NumPy block of
+(bands, rows, cols) or as an open rasterio dataset, which is read whole
+and decoded to its real values, and hands back a block. The stages can
+therefore be chained in memory without writing any image in between:
+
+    import rasterio
+    from landcover import api
+
+    scene = api.read_scene('scene.xml')
+    with rasterio.open('scene.tif') as src:
+        valid = api.valid_mask(src)
+        refl = api.reflectance(api.atmcorr(api.radiance(src, scene)), scene)
+        labels = api.classify(refl, mask=valid)
+        polygons = api.polygons(labels, src.transform, simplify=1.5)
+
+The functions use the same kernels as the stage scripts, so they give
+the same values. A block passed as out is written into instead of a new
+one being allocated, and may be the input itself.
+"""
+
+import numpy as np
+
+from .lib.calibration import avgs_finder
+from .lib.calibration import atmcorr as _atmcorr
+from .lib.calibration import radiance as _radiance
+from .lib.calibration import reflectance as _reflectance
+from .lib.classify import NODATA_LABEL, class_labels, sum_bands
+from .lib.coefficients import scene_coefficients
+from .lib.encoding import read_decoded
+from .lib.metadata import read_metadata
+from .lib.nodata import fill_invalid
+from .lib.nodata import valid_mask as _valid_mask
+from .lib.rules import RuleSet
+from .lib.solar import earth_sun_distance, sun_grid as make_sun_grid, upsample
+from .lib.vectorize import polygonize, polygonize_array
+from .pipeline import DEFAULT_ATMCORR
+
+
+def _block(data):
+    # Reads a whole dataset as float32 with its real values. Blocks are
+    # passed through as they are
+    if hasattr(data, 'read'):
+        return read_decoded(data)
+    return data
+
+
+def read_scene(xml_path):
+    """
+    Reads the metadata of a scene.
+
+    Parameters:
+    xml_path - the path of the .xml file of the scene
+
+    Return:
+    The SceneMetadata of the scene
+    """
+
+    return read_metadata(xml_path)
+
+
+def _scene(scene):
+    # Takes either the metadata of a scene or the path of its .xml
+    return read_metadata(scene) if isinstance(scene, str) else scene
+
+
+def valid_mask(raw):
+    """
+    Finds the valid pixels of raw digital numbers, leaving out the collar
+    of 0 around an orthorectified strip.
+
+    Parameters:
+    raw - the raw block or the open raw image
+
+    Return:
+    The uint8 (rows, cols) mask, 255 for valid pixels and 0 for the others
+    """
+
+    return _valid_mask(_block(raw))
+
+
+def radiance(raw, scene, out=None):
+    """
+    Converts raw digital numbers to top-of-atmosphere radiance.
+
+    Parameters:
+    raw   - the raw block or the open raw image
+    scene - the SceneMetadata of the scene or the path of its .xml
+    out   - a float32 block to write into, or None
+
+    Return:
+    The float32 radiance block
+    """
+
+    scene = _scene(scene)
+    dn = _block(raw)
+    # A float32 block read from a dataset is only used here, so it is
+    # converted in place
+    if out is None and dn is not raw:
+        out = dn
+    coefficients = scene_coefficients(scene)
+    return _radiance(dn, coefficients.gain, coefficients.offset, scene.abscalfactor,
+                     scene.effbandwidth, out=out)
+
+
+def atmcorr(rad, averages=None, out=None):
+    """
+    Atmospherically corrects radiance by subtracting the average
+    correction value of bands 1 through 7.
+
+    Parameters:
+    rad      - the radiance block or the open rad.tif image
+    averages - the averages of bands 1 through 7, the path of an
+               atmcorr_regr.py output file, or None for the temporary
+               spectra values in lib
+    out      - a float32 block to write into, or None
+
+    Return:
+    The float32 corrected block
+    """
+
+    if averages is None:
+        averages = avgs_finder(DEFAULT_ATMCORR, True)
+    elif isinstance(averages, str):
+        averages = avgs_finder(averages, False)
+
+    block = _block(rad)
+    if out is None and block is not rad:
+        out = block
+    return _atmcorr(block, averages, out=out)
+
+
+def reflectance(rad, scene, out=None, sun_grid=False):
+    """
+    Converts radiance or corrected radiance to top-of-atmosphere
+    reflectance.
+
+    Parameters:
+    rad      - the radiance block or the open radiance image
+    scene    - the SceneMetadata of the scene or the path of its .xml
+    out      - a float32 block to write into, or None
+    sun_grid - True to use the solar elevation of every pixel instead of
+               MEANSUNEL. The block has to be the whole image, since the
+               grid is laid over its corners
+
+    Return:
+    The float32 reflectance block
+    """
+
+    scene = _scene(scene)
+    block = _block(rad)
+    if out is None and block is not rad:
+        out = block
+    sun_scale = None
+    if sun_grid:
+        height, width = block.shape[1:]
+        sun_scale = upsample(make_sun_grid(scene, width, height), shape=(height, width))
+    return _reflectance(block, earth_sun_distance(scene.tlctime),
+                        scene_coefficients(scene).esun,
+                        np.float32(scene.meansunel), out=out, sun_scale=sun_scale)
+
+
+def classify(refl, rules=None, mask=None):
+    """
+    Classifies reflectance into labels.
+
+    Parameters:
+    refl  - the reflectance block or the open refl.tif image
+    rules - None for the band sum classes, a RuleSet, or the path of a
+            JSON rule file
+    mask  - the valid-data mask made by valid_mask, or None. Pixels
+            without data get NODATA_LABEL
+
+    Return:
+    The uint8 (1, rows, cols) label block
+    """
+
+    block = _block(refl)
+    if rules is None:
+        labels = class_labels(sum_bands(block))
+    else:
+        if isinstance(rules, str):
+            rules = RuleSet.from_file(rules)
+        labels = rules.labels(block)
+    if mask is not None:
+        fill_invalid(labels, mask, NODATA_LABEL)
+    return labels
+
+
+def polygons(classes, transform=None, holes=True, simplify=0, min_area=0, tile_size=0,
+             threads=1):
+    """
+    Traces the polygons of the non-zero pixels of a mask or label image.
+
+    Parameters:
+    classes   - the mask or label block, or the open class image
+    transform - the affine transform of a block, or None to keep its
+                polygons in pixel coordinates. A dataset uses its own
+    holes     - False to keep only the outlines of the polygons
+    simplify  - the simplification tolerance in pixels
+    min_area  - the smallest area of a polygon or hole kept, in pixels
+    tile_size - the tile edge length a dataset is traced in. 0 traces it
+                whole
+    threads   - the number of threads tracing the tiles of a dataset
+
+    Return:
+    A list of (polygon, value) tuples of shapely Polygons and the pixel
+    value they cover
+    """
+
+    if hasattr(classes, 'read'):
+        return list(polygonize(classes, tile_size, threads, holes, simplify, min_area))
+    return list(polygonize_array(classes, transform, holes, simplify, min_area))
@@ -20,12 +20,26 @@ Change(s) from version 1.2 of atmcorr_regr.py:
 Version 1.3
 """
 
-# Imports the stats, argsparse, and os packages
-# The xml package is used to look into .xml files
+# Imports the argsparse, sys and os packages
 import os
 import argparse
-import xml.etree.ElementTree as ET
-from scipy import stats
+import sys
+
+# The metadata reader in lib is used to look into .xml files and the plot
+# file reader to read the collected spectra. Run directly, the script
+# joins its package and imports it relative to itself, just as when the
+# pipeline imports it
+if not __package__:
+    _PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    sys.path.insert(0, os.path.dirname(_PACKAGE_DIR))
+    __package__ = os.path.basename(_PACKAGE_DIR) + '.cal'
+# Times the imports from here on when --profile-startup is given
+from ..lib import startup  # noqa: F401
+import numpy as np
+from ..lib.envi import read_plot
+from ..lib.manifest import code_version, is_current, record
+from ..lib.metadata import read_metadata
+from ..lib.parallel import atomic_output
 
 
 def args_parser():
@@ -46,6 +60,8 @@ def args_parser():
     # inputted directory as a string
     parser.add_argument('-ip', '--input_dir', type=str,
                         help='The directory containing the images.')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help=('Print the time spent importing each package on exit'))
 
     # Returns the passed in directory
     return parser.parse_args().input_dir
@@ -56,47 +72,19 @@ def args_parser():
 
 def reader(file):
     """
-    Reads ONE file passed into it.
+    Reads ONE file passed into it. The ENVI plot file is parsed by read_plot in lib,
+    which keeps the parsed numbers in a .npz next to the file so a rerun doesn't parse
+    the text again.
 
     Parameters:
     file - The file to be read. It's actually the directory of the file
 
     Return:
-    Returns an 2D list containing ALL of the bands and their respective data. Each row represents
-    each band
+    Returns a 2D array containing ALL of the bands and their respective data, without the
+    wavelength column. Each row represents each band
     """
-    
-    # Creates an empty list to hold all of the band values. Each list
-    # inside will correspond to a band
-    band_array = []
-    
-    # Opens the passed in file...
-    with open(file, 'r') as file_read:
-        # ...splits each integer into their own element in a list...
-        lines = [line.strip().replace('\n', '').replace('   ', '  ').split('  ') for line in file_read]
-        # ...and sets a new list to the 8 bands at the bottom of the .txt.
-        band_lines = lines[-8:]
-        
-    # Closes the file. Generally a good practice
-    file_read.close()
-    
-    # Turns all of the elements into floats. Can't really work with them
-    # otherwise
-    for i in range(8):
-        band_lines[i] = [float(element) for element in band_lines[i]]
-        if band_lines[i] == '':
-            pass
-    
-    # Tried to copy only columns 2 and onward of the band data during
-    # the coding phase. Gave up and went for the easier but
-    # admittedly slower option of just removing the first column
-    for i in range(8):
-        del band_lines[i][0]
-  
-    # Sets the band_lines array to the empty band_array to be returned
-    band_array = band_lines
-    
-    return band_array
+
+    return read_plot(file).spectra
 
 
 def writer(file, file_name, output_dir, pass_fail_stat_arr, 
@@ -145,121 +133,107 @@ def writer(file, file_name, output_dir, pass_fail_stat_arr,
 # --------------------------------------------------------------------------
 
 
-def tester_caller(band_array, intercept_arr, slope_arr):
+def stack_spectra(band_arrays):
     """
-    The main function of the testing part of the program. Calls tester and pass_fail_checker.
-    Returns a list of numbers, each corresponding to each band, to compare to 3.
+    Puts the band data of every .txt file into one array so that all of
+    the files can be worked on at once. The files don't need to have the
+    same number of spectra. The shorter ones are padded with zeros, which
+    are left out of every calculation through the returned mask.
 
     Parameters:
-    band_array    - a 2D list containing all of the band data for each band
-    intercept_arr - a list containing the atmospheric correction for each band
-    slope_arr     - a list containing the slope for each band compared to the last band
+    band_arrays - a list of the 2D arrays returned by reader, one per file
 
     Return:
-    Returns two lists. pass_fail_stat_arr contains the numbers compared to 3 to determine the
-    pass/fail statuses of each band while pass_fail_arr contains the pass/fail statuses of each
-    band.
+    Returns the (files, 8, spectra) float array and a boolean array of the
+    same shape that is True where there is real data
     """
-    
-    # Empy lists to be iterated into with the numbers being compared to 3 and the
-    # pass/fail statuses, respectively.
-    pass_fail_stat_arr = []
-    pass_fail_arr = []
-
-    # For each band...
-    for band in range(7):
-        # Append to the appropriate list the number to be compared to 3
-        pass_fail_stat_arr.append(
-            tester(band_array, intercept_arr, slope_arr, band))
-        # Append to the appropriate list pass/fail status of the number above
-        pass_fail_arr.append(
-            pass_fail_checker(pass_fail_stat_arr[band]))
-        
-    return pass_fail_stat_arr, pass_fail_arr
 
+    # The most spectra any file has
+    longest = max(band_array.shape[1] for band_array in band_arrays)
+
+    spectra = np.zeros((len(band_arrays), 8, longest))
+    valid = np.zeros(spectra.shape, dtype=bool)
+
+    for i, band_array in enumerate(band_arrays):
+        spectra[i, :, :band_array.shape[1]] = band_array
+        valid[i, :, :band_array.shape[1]] = True
+
+    return spectra, valid
 
-def inter_slope(band_array):
+
+def inter_slope(spectra, valid):
     """
-    Used to calculate the intercepts and slopes of each band vs the last band. Calls the other
-    functions in this block
+    Used to calculate the intercepts and slopes of each band vs the last band of every file.
+    All of the least squares fits are solved at once from the centered sums of the data, the
+    same way scipy.stats.linregress fits one of them
 
     Parameters:
-    band_array - a 2D list containing all of the data for each band in a .txt file
+    spectra - the (files, 8, spectra) array returned by stack_spectra
+    valid   - the mask returned by stack_spectra
 
     Return:
-    Returns two lists containing the intercepts and slopes of each band vs the last band
+    Returns two (files, 7) arrays containing the intercepts and slopes of each band vs the
+    last band
     """
-    # Initializes empty lists of length 7 for each band. Kinda wish I
-    # could've done this using append. 
-    intercept_arr = [0, 0, 0, 0, 0, 0, 0]
-    slope_arr = [0, 0, 0, 0, 0, 0, 0]
-    
-    # For each band...
-    for band in range(7):
-        # Iterate into the slope and intercept lists using linregress. The other values are
-        # useless for now.
-        (slope_arr[band], intercept_arr[band], r_value, p_value, std_err) = \
-           stats.linregress(band_array[7], band_array[band])
-        
+
+    # Bands 1 through 7 are fit against the last band of the same file
+    y = spectra[:, :7]
+    x = np.broadcast_to(spectra[:, 7:], y.shape)
+    mask = valid[:, :7]
+    count = mask.sum(axis=2)
+
+    # The means and the centered (co)variances of every band of every file
+    x_mean = np.where(mask, x, 0).sum(axis=2) / count
+    y_mean = np.where(mask, y, 0).sum(axis=2) / count
+    x_dev = np.where(mask, x - x_mean[..., np.newaxis], 0)
+    y_dev = np.where(mask, y - y_mean[..., np.newaxis], 0)
+    ssxm = np.einsum('fbn,fbn->fb', x_dev, x_dev) / count
+    ssxym = np.einsum('fbn,fbn->fb', x_dev, y_dev) / count
+
+    slope_arr = ssxym / ssxm
+    intercept_arr = y_mean - slope_arr * x_mean
+
     return intercept_arr, slope_arr
 
 
-def tester(band_array, intercept_arr, slope_arr, n):
+def tester(spectra, valid, intercept_arr, slope_arr):
     """
-    Calculates the number to be compared to 3 in order to determine the pass/fail status of a band
+    Calculates the numbers to be compared to 3 in order to determine the pass/fail status of
+    every band of every file. It's the mean of the squared residuals of the fit of a band,
+    where only the elements above 0.0000001 add to the sum
 
     Parameters: 
-    band_array    - a 2D list containing all of the data for each band in a .txt file
-    intercept_arr - a list containing the intercepts between each band vs the last band
-    slope_arr     - a list containing the slopes between each band vs the last band
-    n             - the n + 1 band to have the value compared to 3 to be calculated for
+    spectra       - the (files, 8, spectra) array returned by stack_spectra
+    valid         - the mask returned by stack_spectra
+    intercept_arr - a (files, 7) array of the intercepts between each band vs the last band
+    slope_arr     - a (files, 7) array of the slopes between each band vs the last band
 
     Return:
-    A single float to be compared to 3
+    A (files, 7) array of the floats to be compared to 3
     """
 
-    # Initializes a variable to hold a total sum
-    calc_sum = 0
-    # For each element within a certain band...
-    for element_n in range(len(band_array[n])):
-        # Let an element be defined as such within the band array.
-        element = band_array[n][element_n]
-        
-        # If the element is greater than 0.0000001...
-        if element > 0.0000001:
-            # Let the variable element_check equal 1.
-            element_check = 1
-        # Else...
-        else:
-            # Let it equal 0.
-            element_check = 0
+    y = spectra[:, :7]
+    fit = slope_arr[..., np.newaxis] * spectra[:, 7:] + intercept_arr[..., np.newaxis]
 
-        # Doing the specified calculation for each element...
-        element_calc = ((element - ((slope_arr[n] * band_array[-1][element_n]) +
-                         (intercept_arr[n])))**2) * element_check
-        # Adds the calculated number to the sum holder
-        calc_sum += element_calc
+    # Elements that are too small, and the padding, don't count towards the sum
+    residuals = np.where(valid[:, :7] & (y > 0.0000001), (y - fit) ** 2, 0)
 
-    # Does the calculation to obtain the number to compare to 3.
-    pass_fail_num = calc_sum / len(band_array[n])
-    
-    return pass_fail_num
+    # but the sum is still divided by the number of elements in the band
+    return residuals.sum(axis=2) / valid[:, :7].sum(axis=2)
 
 
-def pass_fail_checker(pass_fail_num):
+def pass_fail_checker(pass_fail_stat_arr):
     """
-    Compares a number to 3.
+    Compares numbers to 3.
 
     Parameters:
-    pass_fail_num - a float to be compared to 3
+    pass_fail_stat_arr - an array of the floats to be compared to 3
 
     Return:
-    Returns Pass or Fail depending on how the float compares to 3
+    Returns an array of Pass or Fail depending on how each float compares to 3
     """
-    if pass_fail_num < 3:
-        return 'Pass'
-    else:
-        return 'Fail'
+
+    return np.where(pass_fail_stat_arr < 3, 'Pass', 'Fail')
 
 
 def dataset_checker(pass_fail_arr, pass_fail_stat_arr):
@@ -268,74 +242,42 @@ def dataset_checker(pass_fail_arr, pass_fail_stat_arr):
     If any a select number of bands do, then the whole data set fails.
 
     Parameters:
-    pass_fail_arr - a list containing the pass/fail status of each band
-    pass_fail_stat_arr - a list containing the numbers compared to 3
+    pass_fail_arr      - a (files, 7) array containing the pass/fail status of each band
+    pass_fail_stat_arr - a (files, 7) array containing the numbers compared to 3
 
     Return:
-    A string being either Pass or Fail depending on how many Fails there are in
-    pass_fail_arr
+    An array of strings, one per file, being either Pass or Fail depending on how many
+    Fails there are in the row of pass_fail_arr
     """
-    # Variable used to keep track of how many Fails there are
-    fail_n = 0
-    # Finds out how many fails are in the data set. If the 
-    for i in range(len(pass_fail_arr)):
-        # Any band with a comparison number less than five may still be
-        # passable
-        if pass_fail_arr[i] == 'Fail' and pass_fail_stat_arr[i] > 5:
-            fail_n += 1
-            
+
+    # Finds out how many fails are in each data set. Any band with a
+    # comparison number less than five may still be passable
+    fail_n = ((pass_fail_arr == 'Fail') & (pass_fail_stat_arr > 5)).sum(axis=1)
+
     # Change the number here to specify how many fails is the bare minimum
     # for the data set to Fail. 1 is my set default.
-    if fail_n >= 4:
-        return 'Fail'
-    else:
-        return 'Pass'
+    return np.where(fail_n >= 4, 'Fail', 'Pass')
 # --------------------------------------------------------------------------
 
 # This block calculates averages
 # --------------------------------------------------------------------------
 
 
-def avg_intercept(total_intercept_arr, txt_count):
+def avg_intercept(total_intercept_arr):
     """
     Calculates the AVERAGE ATMOSPHERIC CORRECTION for each band in a subfolder
 
     Parameters:
-    total_intercept_arr - a 2D list containing the atmospheric corrections for each band in
-                          each .txt file
-    txt_count           - the number of .txt files in the subfolder
+    total_intercept_arr - a (files, 7) array containing the atmospheric corrections for each
+                          band in each .txt file
 
     Return:
     Returns a list containing the average atmospheric correction for each band in a subfolder
     """
-    # Initializes 7 variables to hold the sum of each of their respective band
-    # intercepts
-    (band1_sum, band2_sum, band3_sum, band4_sum, band5_sum, band6_sum, band7_sum) = \
-      0, 0, 0, 0, 0, 0, 0
-    # For loop does the summing
-    for i in range(len(total_intercept_arr)):
-        band1_sum += total_intercept_arr[i][0]
-        band2_sum += total_intercept_arr[i][1]
-        band3_sum += total_intercept_arr[i][2]
-        band4_sum += total_intercept_arr[i][3]
-        band5_sum += total_intercept_arr[i][4]
-        band6_sum += total_intercept_arr[i][5]
-        band7_sum += total_intercept_arr[i][6]
-
-    # Computes the average intercept.
-    band1_avg = band1_sum / txt_count
-    band2_avg = band2_sum / txt_count
-    band3_avg = band3_sum / txt_count
-    band4_avg = band4_sum / txt_count
-    band5_avg = band5_sum / txt_count
-    band6_avg = band6_sum / txt_count
-    band7_avg = band7_sum / txt_count
-
-    # Puts the avg intercept data into an array.
-    band_avg_arr = [band1_avg, band2_avg, band3_avg, band4_avg,
-                    band5_avg, band6_avg, band7_avg]
-    
-    return band_avg_arr
+
+    # The rows are added one after the other, the same order the files
+    # were written in
+    return (total_intercept_arr.sum(axis=0) / len(total_intercept_arr)).tolist()
 
  
 def avg_writer(file_name, output_dir, band_avg_arr):
@@ -448,10 +390,6 @@ def main():
         # is defined than to rename instance of output_dir and fear that something may break
         output_dir = folder_dir
 
-        # Initializes a list. Holds lists of intercepts, with each nested list corresponding
-        # to each file.
-        total_intercept_arr = []
-
         # A placeholder name for the output file if there aren't any .xml files to
         # look into for the name
         file_name = 'NO_XML_PRESENT'
@@ -459,60 +397,63 @@ def main():
         # If there is an xml file...
         if xml_file != '':
             # Look into the xml file for a branch called SOURCE IMAGE
-            tree = ET.parse(os.path.join(output_dir, xml_file))
-            root = tree.getroot()
-            rt = root[1].find('SOURCE_IMAGE').text
+            rt = read_metadata(os.path.join(output_dir, xml_file)).source_image
 
             # And lop off some stuff for the file name
             file_name = rt[5:19]
 
         # Checks to see if a .txt file of the same name the output file
-        # exists. Outputs True or False
-        txt_file_exists = os.path.isfile(os.path.join(output_dir, file_name + '.txt'))
+        # exists and is up to date with the spectra and the .xml. Outputs
+        # True or False
+        out_path = os.path.join(output_dir, file_name + '.txt')
+        inputs = [os.path.join(folder_dir, f) for f in txt_files]
+        if xml_file != '':
+            inputs.append(os.path.join(output_dir, xml_file))
+        code = code_version(__file__, 'envi', 'metadata')
+        txt_file_exists = is_current([out_path], inputs, {}, code)
 
         # If the output file does NOT exist AND the .txt file count > 0...
         if not txt_file_exists and txt_count > 0:
 
-            # This loop does the heavy lifting. For each .txt file within the folder...
-            for f in txt_files:
-
-                # Makes a temporary directory to a text file in a folder
-                text_dir = os.path.join(folder_dir, f)
-                
-                # Passes the file into the reader function and set the output list to something
-                band_array = reader(text_dir)
-                # Passes the outputted list from above into inter_slope to calculate
-                # the intercepts and slopes
-                (intercept_arr, slope_arr) = inter_slope(band_array)
-                
-                # Appends to the empty initialized list slightly above the intercepts of the
-                # current file
-                total_intercept_arr.append(intercept_arr)
-                
-                # Passes the above the above three outputs into the test_caller() function
-                # to obtain the numbers to compare to 3 and the pass/fail statuses.
-                (pass_fail_stat_arr, pass_fail_arr) = \
-                  tester_caller(band_array, intercept_arr, slope_arr)
-                # Checks the pass/fail statuses of each band. Will return 'Fail' if
-                # at least one 'Fail' exists.
-                set_check = dataset_checker(pass_fail_arr, pass_fail_stat_arr)
-                
-                # Calls the writer() function. Does most of the file writing.
-                writer(f, file_name, output_dir, pass_fail_stat_arr, pass_fail_arr,
-                       intercept_arr, set_check)
-
-            # Outside of the loop. Calculates the avg intercepts
-            # between all of the files
-            band_avg_arr = avg_intercept(total_intercept_arr, txt_count)
-            # Writes the avg intercepts into the document.
-            avg_writer(file_name, output_dir, band_avg_arr)
+            # Reads every .txt file within the folder into one array
+            spectra, valid = stack_spectra([reader(os.path.join(folder_dir, f))
+                                            for f in txt_files])
+
+            # Calculates the intercepts and slopes of every band of every file at once
+            (total_intercept_arr, slope_arr) = inter_slope(spectra, valid)
+
+            # Obtains the numbers to compare to 3 and the pass/fail statuses.
+            pass_fail_stat_arr = tester(spectra, valid, total_intercept_arr, slope_arr)
+            pass_fail_arr = pass_fail_checker(pass_fail_stat_arr)
+            # Checks the pass/fail statuses of each band. Will return 'Fail' if
+            # at least one 'Fail' exists.
+            set_check = dataset_checker(pass_fail_arr, pass_fail_stat_arr)
+
+            # The writers append to the file, so it is written under a
+            # temporary name and only gets its final name once it is
+            # complete. A file left by a killed run is never appended to
+            with atomic_output(out_path) as temp_path:
+                temp_name = os.path.splitext(os.path.basename(temp_path))[0]
+
+                # Calls the writer() function for each file, in the order they were found.
+                # Does most of the file writing.
+                for i, f in enumerate(txt_files):
+                    writer(f, temp_name, output_dir, pass_fail_stat_arr[i].tolist(),
+                           pass_fail_arr[i].tolist(), total_intercept_arr[i].tolist(),
+                           set_check[i])
+
+                # Calculates the avg intercepts between all of the files
+                band_avg_arr = avg_intercept(total_intercept_arr)
+                # Writes the avg intercepts into the document.
+                avg_writer(temp_name, output_dir, band_avg_arr)
+            record('atmcorr_regr', [out_path], inputs, {}, code)
             # Prints a message that the file was successfully created
             print(folder + '.txt was successfully created!')        
 
-        # If the file already exists...
+        # If the file is up to date...
         elif txt_file_exists:
-            # Print that the .txt already exists
-            print(folder + '.txt already exists!')        
+            # Print that the .txt is up to date
+            print(folder + '.txt is up to date!')        
         # If the .txt count is 0...
         elif txt_count == 0:
             # Print that there are no .txt files to analyze
@@ -23,9 +23,26 @@ from glob import glob
 
 import os
 import argparse
-import xml.etree.ElementTree as ET
-import numpy as np
-import rasterio
+import sys
+
+# Imports the reader of the atmospheric correction values shared with the
+# fused calibration engine. Run directly, the script joins its package and
+# imports it relative to itself, just as when the pipeline imports it
+if not __package__:
+    _PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    sys.path.insert(0, os.path.dirname(_PACKAGE_DIR))
+    __package__ = os.path.basename(_PACKAGE_DIR) + '.cal'
+# Times the imports from here on when --profile-startup is given
+from ..lib import startup  # noqa: F401
+from ..lib.calibration import avgs_finder, atmcorr
+from ..lib.coefficients import COEFFICIENTS_TAG
+from ..lib.encoding import ENCODINGS, encoding_meta, set_scaling
+from ..lib.manifest import code_version, is_current, record
+from ..lib.parallel import run_scenes, atomic_output
+from ..lib.profiles import PROFILES, profile_meta, finish_output
+from ..lib.rawstore import (RAW_EXT, RawImage, create_raw, is_raw, store_files, band_math,
+                            latest_images)
+from ..lib.tiling import tile_windows
 
 
 def args_parser():
@@ -49,82 +66,54 @@ def args_parser():
                         help=('The output directory'))
     parser.add_argument('-t', '--atm_temp', type=str, default='',
                         help=('The path to the atmospheric correction lookup table'))
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help=('Kept for older commands. The image is always ' +
+                              'processed tile by tile'))
+    parser.add_argument('-ts', '--tile_size', type=int, default=0,
+                        help=('The tile edge length in pixels. Defaults to the ' +
+                              'internal blocks of the image'))
+    parser.add_argument('-th', '--threads', type=int, default=1,
+                        help=('The number of threads working on the tiles of one ' +
+                              'image'))
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help=('The number of images to process at the same time'))
+    parser.add_argument('-pr', '--profile', choices=sorted(PROFILES), default=None,
+                        help=('The output profile: fast, compact or cog. Defaults to ' +
+                              'keeping the layout of the input'))
+    parser.add_argument('-e', '--encoding', choices=ENCODINGS, default='float32',
+                        help=('How the values are stored: float32, float16, or uint16 ' +
+                              'with a scale and offset. Defaults to float32'))
+    parser.add_argument('-rw', '--raw', action='store_true',
+                        help=('Write the corrected image as a raw memory mapped store for ' +
+                              'refl.py instead of a GeoTIFF'))
+    parser.add_argument('--profile-startup', action='store_true',
+                        help=('Print the time spent importing each package on exit'))
 
     # Returns the passed in directory
     return parser.parse_args()
 
 
-def avgs_finder(atmotxt_dir, missing_txt):
+def atmcorr_name(rad_file, raw=False):
     """
-    Finds the average atmospheric correction values for bands 1 to 7.
-    Returns them as a list. Will return the temporary spectra values
-    if the atmcorr_regr.py output file is missing.
+    Names the corrected image of a rad.tif image or raw store.
 
     Parameters:
-    atmotxt_dir - the directory of the .txt file with the average
-                  atmospheric correction values
-    missing_txt - a boolean. True if the directory is missing the
-                  atmcorr_regr.py output file, False otherwise
+    rad_file - the name of the radiance image
+    raw      - True for the name of a raw store
 
     Return:
-    A list containing the average atmospheric correction values of
-    bands 1 through 7
+    The name of the corrected image
     """
 
-    # Initializes an empty list to store the average correction
-    # values
-    averages = []
-
-    if not missing_txt:
-        # Opens the .txt document 
-        with open(atmotxt_dir, 'r') as atmo_txt:
-            # Stores each line as its own list inside a larger list
-            # Splitting is done due to the formatting in the file
-            text = [line.strip().replace("\n", "").split(": ")
-                    for line in atmo_txt]
-        # Closes the file
-        atmo_txt.close()
-    else:
-        # Opens the .txt document 
-        with open(atmotxt_dir, 'r') as atmo_txt:
-            # Stores each line as its own list inside a larger list
-            # Splitting is done due to the formatting in the file
-            text = [line.strip().replace("\n", "").split()
-                    for line in atmo_txt]
-        # Closes the file
-        atmo_txt.close()
-
-    # Sets a counter variable for reading the last lines.
-    n = -7
-
-    # Variable specifies the last line to be read. The atmcorr_temp.txt
-    # file contains band 8, which is considered to equal 0. The output
-    # of atmcorr_regr.py doesn't have this band.
-    last_line = -1
-    if missing_txt:
-        # Doesn't include the temporary text file's last line
-        last_line = -2
-        # Sets the counter variable to account for the extra line
-        n = -8
-    
-    # while loop goes through the last seven lines of the saved
-    # .txt file
-    while n <= last_line:
-        # Appends the averages to the initialized averages list
-        # Row n, column 1 due to the splitting from earlier
-        averages.append(float(text[n][1]))
-        
-        # Adds 1 to the counter
-        n += 1
-
-    return averages
+    return os.path.splitext(rad_file)[0] + '_atmcorr' + (RAW_EXT if raw else '.tif')
 
 
-def spec_mather(input_dir, output_dir, rad_file, averages):
+def spec_mather(input_dir, output_dir, rad_file, averages, tile_size=0,
+                threads=1, profile=None, encoding='float32', raw=False):
     """
     Does the spectral band math to the image. A new image is created
     as a result, with its name being the name of the rad.tif image but
-    with _specmath after rad. The band math is as follows:
+    with _atmcorr after rad. The band math is as follows:
     s1 - s2.
     s1 is the band data of one of the bands of the original rad.tif image
     while s2 is the corresponding average band atmospheric correction value
@@ -133,30 +122,118 @@ def spec_mather(input_dir, output_dir, rad_file, averages):
     rad_dir    - the directory of the rad.tif image
     averages   - a list holding the average atmospheric correction values of
                  bands 1 through 7
+    tile_size  - the tile edge length in pixels. 0 follows the internal
+                 blocks of the image
+    threads    - the number of threads working on the tiles
+    profile    - the name of the output profile, or None
+    encoding   - how the corrected image is stored, one of ENCODINGS
+    raw        - True to write a raw store instead of the atmcorr.tif
+                 image. It is float32 whatever the encoding
     """
 
-    # Opens the rad.tif image
-    src = rasterio.open(input_dir + rad_file)
-    
-    # Gets the metadata of the image
-    meta = src.meta
-
-    # Creates the specmath.tif image to be written onto
-    with rasterio.open(output_dir + rad_file.replace('.tif', '_atmcorr.tif'),
-                       'w', **meta) as dst:
-        # for bands 1 through 7...
-        for i in range(7):
-            # Calculate the band-mathed value
-            spec = np.float32(src.read(i + 1) - averages[i])
-            # and write it into the new image
-            dst.write_band(i + 1, spec)
-            
-        dst.write_band(8, np.float32(src.read(8)))
+    # Only imported once there is an image to correct
+    import rasterio
+
+    # Opens the rad.tif image, or maps the raw store written by rad.py --raw
+    if is_raw(rad_file):
+        src = RawImage(input_dir + rad_file)
+    else:
+        src = rasterio.open(input_dir + rad_file)
+    if raw:
+        encoding = 'float32'
+
+    # Gets the metadata of the image. The rad.tif image may be encoded,
+    # so the float32 layout is restored before the output encoding
+    meta = dict(src.meta, dtype='float32', nodata=255)
+    meta = profile_meta(encoding_meta(meta, encoding), profile)
+
+    # Creates the atmcorr.tif image to be written onto. It only gets its
+    # final name once it is completely written
+    with atomic_output(os.path.join(output_dir, atmcorr_name(rad_file, raw))) as out_path:
+        if raw:
+            dst = create_raw(out_path, meta)
+        else:
+            dst = rasterio.open(out_path, 'w', **meta)
+            set_scaling(dst, encoding, 'atmcorr')
+        # Keeps the version of the coefficients the radiance was made with
+        tags = src.tags()
+        if COEFFICIENTS_TAG in tags:
+            dst.update_tags(**{COEFFICIENTS_TAG: tags[COEFFICIENTS_TAG]})
+        with dst:
+            # Corrects all of the bands of a tile at once on a pool of
+            # threads, so the memory used depends on the tile size rather
+            # than on the scene. An encoded input is decoded while it is
+            # read, and between two raw stores the windows are never copied
+            band_math(src, dst, tile_windows(src, tile_size),
+                      lambda block, out, window: atmcorr(block, averages, out=out),
+                      threads, encoding, 'atmcorr')
+        if not raw:
+            finish_output(out_path, profile)
 
     # Close the file
     src.close()
 
 
+def specmath_scene(working_dir, output_dir, rad_file, avg_txt, def_atmcorr, tile_size=0,
+                   threads=1, profile=None, encoding='float32', raw=False):
+    """
+    Atmospherically corrects one rad.tif image, unless its atmcorr.tif
+    image is already up to date with the rad.tif image, the averages and
+    the options.
+
+    Parameters:
+    working_dir - the directory with the rad.tif image
+    output_dir  - the directory to write the atmcorr.tif image into
+    rad_file    - the name of the rad.tif image or raw store
+    avg_txt     - the path of the atmcorr_regr.py output. Empty if it
+                  wasn't given
+    def_atmcorr - the path of the temporary spectra values in lib
+    tile_size   - the tile edge length in pixels. 0 follows the internal
+                  blocks of the image
+    threads     - the number of threads working on the tiles
+    profile     - the name of the output profile, or None
+    encoding    - how the corrected image is stored, one of ENCODINGS
+    raw         - True to write a raw store instead of the atmcorr.tif
+                  image
+
+    Return:
+    None
+    """
+
+    # If the output text file from atmcorr_regr.py doesn't exist in the
+    # specified directory, the values in atmcorr_temp.txt in lib are used
+    # instead. Either file is an input, so new averages remake the image
+    avg_path = avg_txt if avg_txt != '' else def_atmcorr
+    out_path = os.path.join(output_dir, atmcorr_name(rad_file, raw))
+    outputs = store_files(out_path) if raw else [out_path]
+    inputs = [os.path.join(working_dir, rad_file), avg_path]
+    if is_raw(rad_file):
+        inputs += store_files(inputs[0])[1:]
+    params = {'profile': profile, 'encoding': encoding}
+    code = code_version(__file__, 'calibration', 'encoding', 'nodata', 'profiles', 'rawstore',
+                        'tiling')
+
+    # Checks to see if the atmcorr.tif image is up to date
+    if is_current(outputs, inputs, params, code):
+        print(atmcorr_name(rad_file, raw) + ' is up to date!')
+        return
+
+    if avg_txt == '':
+        print('atmcorr_regr.py has not been run yet in the directory or ' +
+                'its output file is missing. Using the temporary ' +
+                'spectra values...')
+
+    # Calls avgs_finder to retrieve the averages from the file
+    averages = avgs_finder(avg_path, avg_txt == '')
+    # Calls spec_mather to do the band math and write
+    # it to the new file
+    spec_mather(working_dir, output_dir, rad_file, averages, tile_size, threads,
+                profile, encoding, raw)
+    record('atmcorr', outputs, inputs, params, code)
+
+    print(rad_file + ' has been processed!')
+
+
 def main():
     """
     The main function. Calls the other functions.
@@ -180,57 +257,26 @@ def main():
     # the rad.tif image.
     # xml_file saves the name of the .xml file associated with the raw image
 
-    image_files = glob(os.path.join(working_dir + '*_rad.tif'))
+    image_files = (glob(os.path.join(working_dir + '*_rad.tif')) +
+                   glob(os.path.join(working_dir + '*_rad' + RAW_EXT)))
 
 
-    # For each file in the folder...
-    for image_file in image_files:
-        # if the file is a rad.tif image that doesn't contain
-        # P1BS, save it
-        
-        if ('P1BS') not in image_file:
-            rad_file = image_file.split('/')[-1]
-        else:
-            continue
-    # Checks to see if the specmath.tif image exists
-        specmath_file_exists = os.path.isfile(os.path.join(output_dir,
-                                    rad_file.replace('.tif', '_atmcorr.tif')))
-
-    # If the specmath.tif image doesn't exist, create it
-        if not specmath_file_exists and avg_txt != '':
-            # Saves the directory of the atmcorr_regr.py file
-            # atmotxt_dir = os.path.join(working_dir, file_name + '.txt')
-            # Calls avgs_finder to retrieve the averages from the file
-            averages = avgs_finder(avg_txt, False)
-            # Saves the directory of the rad.tif image
-            rad_dir = os.path.join(output_dir, rad_file)
-            # Calls spec_mather to do the band math and write
-            # it to the new file
-            spec_mather(working_dir, output_dir, rad_file, averages)
-
-            print(rad_file + ' has been processed!')
-
-        elif specmath_file_exists:
-            print(rad_file.replace('.tif', '_atmcorr.tif') + ' already exists!')
-
-        # If the output text file from atmcorr_regr.py doesn't exist in the
-        # specified directory, use the values in atmcorr_temp.txt in lib
-        # instead
-        elif avg_txt == '':
-            print('atmcorr_regr.py has not been run yet in the directory or ' +
-                    'its output file is missing. Using the temporary ' +
-                    'spectra values...')
-            # Uses the file containing the temporary spectra instead
-            # atmotxt_temp = '../lib/atmcorr_temp.txt'
-            # Calls avgs_finder to retrieve the averages from the file
-            averages = avgs_finder(def_atmcorr, True)
-            # Saves the directory of the rad.tif image
-            #rad_dir = os.path.join(input_dir, output_dir, rad_file)
-            # Calls spec_mather to do the band math and write
-            # it to the new file
-            spec_mather(working_dir, output_dir, rad_file, averages)
+    # Collects each rad.tif image that doesn't contain P1BS. Of a rad.tif
+    # image and a raw store of the same scene, the newer one is corrected
+    rad_files = latest_images(working_dir, [image_file.split('/')[-1]
+                                            for image_file in image_files
+                                            if ('P1BS') not in image_file])
+
+    # Corrects every rad.tif image, one per worker
+    failures = run_scenes(specmath_scene,
+                          [(rad_file, (working_dir, output_dir, rad_file, avg_txt, def_atmcorr,
+                                       args.tile_size, args.threads,
+                                       args.profile, args.encoding, args.raw))
+                           for rad_file in rad_files],
+                          args.workers)
+    if failures:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
     main()
-
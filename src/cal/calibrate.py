@@ -0,0 +1,214 @@
+"""
+This script runs rad.py, atmcorr_specmath.py, refl.py and optionally
+class.py in a single pass over each raw image. It searches through the
+console specified directory for raw .tif images and their corresponding
+.xml files, and reads every tile of a raw image only once.
+
+Only the reflectance image (ending with rad_atmcorr_refl.tif) is written
+by default. The radiance, atmospherically corrected and class images are
+only written when they are asked for, and are named the same way as the
+output of the separate scripts.
+"""
+
+import os
+import argparse
+import sys
+from contextlib import ExitStack
+
+# Makes the shared helpers in lib importable no matter where the script is
+# called from. Run directly, the script joins its package and imports it
+# relative to itself, just as when the pipeline imports it
+if not __package__:
+    _PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    sys.path.insert(0, os.path.dirname(_PACKAGE_DIR))
+    __package__ = os.path.basename(_PACKAGE_DIR) + '.cal'
+# Times the imports from here on when --profile-startup is given
+from ..lib import startup  # noqa: F401
+from ..lib.calibration import avgs_finder
+from ..lib.classify import CLASSES
+from ..lib.coefficients import DEFAULT_COEFFICIENTS, coefficients_name, scene_coefficients
+from ..lib.encoding import ENCODINGS
+from ..lib.fused import calibrate, product_names
+from ..lib.manifest import code_version, is_current, record
+from ..lib.metadata import read_metadata
+from ..lib.parallel import run_scenes, atomic_output
+from ..lib.profiles import PROFILES
+
+
+def args_parser():
+    """
+    Reads in the image directory from the console
+
+    Parameters:
+    None
+
+    Return:
+    Returns the parsed console arguments
+    """
+
+    # Creates an object to take in the directory
+    parser = argparse.ArgumentParser(description='Calibrates a console-inputted directory ' +
+                                     'of raw images to reflectance in a single pass')
+
+    parser.add_argument('-ip', '--input_dir', type=str, default='./',
+                        help=('The directory with the set of images'))
+    parser.add_argument('-op', '--output_dir', type=str, default='./',
+                        help=('The output directory'))
+    parser.add_argument('-t', '--atm_temp', type=str, default='',
+                        help=('The path to the atmcorr_regr.py output. Defaults to ' +
+                              'the temporary spectra values in lib'))
+    parser.add_argument('-ts', '--tile_size', type=int, default=0,
+                        help=('The tile edge length in pixels. Defaults to the ' +
+                              'internal blocks of the image'))
+    parser.add_argument('--write_rad', action='store_true',
+                        help=('Also write the radiance image'))
+    parser.add_argument('--write_atmcorr', action='store_true',
+                        help=('Also write the atmospherically corrected image'))
+    parser.add_argument('--classify', action='store_true',
+                        help=('Also write the class masks made by class.py'))
+    parser.add_argument('--labels', action='store_true',
+                        help=('Also write the uint8 label image made by class.py --labels'))
+    parser.add_argument('-sg', '--sun_grid', action='store_true',
+                        help=('Use the solar elevation at the place and time of every ' +
+                              'pixel instead of MEANSUNEL, from a coarse grid over ' +
+                              'the corners of the image'))
+    parser.add_argument('-th', '--threads', type=int, default=1,
+                        help=('The number of threads working on the tiles of one image'))
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help=('The number of images to process at the same time'))
+    parser.add_argument('-pr', '--profile', choices=sorted(PROFILES), default=None,
+                        help=('The output profile: fast, compact or cog. Defaults to ' +
+                              'keeping the layout of the input'))
+    parser.add_argument('-e', '--encoding', choices=ENCODINGS, default='float32',
+                        help=('How the values are stored: float32, float16, or uint16 ' +
+                              'with a scale and offset. Defaults to float32'))
+    parser.add_argument('--profile-startup', action='store_true',
+                        help=('Print the time spent importing each package on exit'))
+
+    # Returns the arguments
+    return parser.parse_args()
+
+
+def calibrate_scene(working_dir, output_dir, f, averages, products, tile_size, threads=1,
+                    profile=None, encoding='float32', sun_grid=False):
+    """
+    Calibrates one raw image, unless its images are already up to date
+    with the raw image, its .xml, the averages and the options.
+
+    Parameters:
+    working_dir - the directory with the raw image and its .xml
+    output_dir  - the directory to write the images into
+    f           - the name of the raw .tif image
+    averages    - a list holding the average atmospheric correction values
+                  of bands 1 through 7
+    products    - a list of the products to write
+    tile_size   - the tile edge length in pixels
+    threads     - the number of threads working on the tiles
+    profile     - the name of the output profile, or None
+    encoding    - how the rad, atmcorr and refl images are stored, one of
+                  ENCODINGS
+    sun_grid    - True to correct the reflectance of every pixel for the
+                  solar elevation at its place and time instead of using
+                  MEANSUNEL
+
+    Return:
+    None
+    """
+
+    names = product_names(f)
+
+    xml_file = f.replace('.tif', '.xml')
+    if not os.path.isfile(os.path.join(working_dir, xml_file)):
+        print('XML: ', xml_file, 'does not exist')
+        return
+
+    # The coefficients of the sensor when the image was taken. An unknown
+    # sensor stops here
+    coefficients = scene_coefficients(read_metadata(os.path.join(working_dir, xml_file)))
+
+    # Sees if the images of the raw image are up to date. The averages and
+    # the version of the coefficients are recorded by value, so new
+    # atmospheric spectra or coefficients remake the images. The
+    # coefficient file is an input too, so an edited value does as well
+    paths = [os.path.join(output_dir, names[product]) for product in products]
+    inputs = [os.path.join(working_dir, f), os.path.join(working_dir, xml_file),
+              DEFAULT_COEFFICIENTS]
+    params = {'averages': [float(average) for average in averages], 'profile': profile,
+              'encoding': encoding, 'sun_grid': sun_grid,
+              'coefficients': coefficients_name(coefficients)}
+    code = code_version(__file__, 'calibration', 'classify', 'coefficients', 'encoding', 'fused',
+                        'metadata', 'profiles', 'solar', 'tiling')
+    if is_current(paths, inputs, params, code):
+        print(names['refl'] + ' is up to date!')
+        return
+
+    # The images only get their final names once they are completely
+    # written. The reflectance image is entered first so it is renamed last
+    with ExitStack() as stack:
+        outputs = {product: stack.enter_context(atomic_output(
+            os.path.join(output_dir, names[product]))) for product in products}
+        calibrate(os.path.join(working_dir, f), os.path.join(working_dir, xml_file),
+                  averages, outputs, tile_size, threads, profile, encoding, sun_grid)
+    record('calibrate', paths, inputs, params, code)
+
+    print(f + ' has been processed.')
+
+
+def main():
+    """
+    Main function. Searches the specified directory for raw .tif images and
+    their associated .xml files and calibrates each of them.
+
+    Parameters:
+    None
+
+    Return:
+    None
+    """
+
+    args = args_parser()
+    working_dir = args.input_dir
+    output_dir = args.output_dir
+
+    # Finds the average atmospheric correction values. If the output of
+    # atmcorr_regr.py wasn't given, use the values in atmcorr_temp.txt in lib
+    if args.atm_temp != '':
+        averages = avgs_finder(args.atm_temp, False)
+    else:
+        print('No atmcorr_regr.py output file was given. Using the temporary ' +
+              'spectra values...')
+        def_atmcorr = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                   '..', 'lib', 'atmcorr_temp.txt')
+        averages = avgs_finder(def_atmcorr, True)
+
+    # The products to write besides the reflectance image
+    products = ['refl']
+    if args.write_rad:
+        products.append('rad')
+    if args.write_atmcorr:
+        products.append('atmcorr')
+    if args.classify:
+        products += ['class_' + name for name in CLASSES]
+    if args.labels:
+        products.append('labels')
+
+    # Collects the raw images inside of the folder
+    raw_files = [f for f in os.listdir(working_dir)
+                 if (f.endswith('.tif') and ('rad' not in f) and
+                     ('atmcorr' not in f) and
+                     ('refl' not in f) and
+                     ('P1BS' not in f))]
+
+    # Calibrates every raw image, one per worker
+    failures = run_scenes(calibrate_scene,
+                          [(f, (working_dir, output_dir, f, averages, products, args.tile_size,
+                                args.threads, args.profile, args.encoding, args.sun_grid))
+                           for f in raw_files],
+                          args.workers)
+    if failures:
+        sys.exit(1)
+
+
+# If the script was directly called, run the script
+if __name__ == '__main__':
+    main()
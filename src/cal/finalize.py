@@ -0,0 +1,172 @@
+"""
+This script converts the raw stores written by rad.py, atmcorr_specmath.py
+and refl.py with --raw into GeoTIFFs. It searches through the console
+specified directory for raw stores (ending with .bip, next to a .bip.json
+sidecar) and only converts those of the products that are kept, by
+default the reflectance.
+
+The GeoTIFFs are named like the images the stages write without --raw,
+and are written with the chosen profile and encoding. With --clean every
+raw store of the directory is removed once the kept ones are converted.
+"""
+
+import os
+import argparse
+import sys
+
+# Makes the shared helpers in lib importable no matter where the script is
+# called from. Run directly, the script joins its package and imports it
+# relative to itself, just as when the pipeline imports it
+if not __package__:
+    _PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    sys.path.insert(0, os.path.dirname(_PACKAGE_DIR))
+    __package__ = os.path.basename(_PACKAGE_DIR) + '.cal'
+# Times the imports from here on when --profile-startup is given
+from ..lib import startup  # noqa: F401
+from ..lib.encoding import ENCODINGS
+from ..lib.manifest import code_version, is_current, record
+from ..lib.parallel import run_scenes, atomic_output
+from ..lib.profiles import PROFILES
+from ..lib.rawstore import RAW_EXT, finalize, remove_raw, sidecar_path, store_files
+
+# The product of a raw store by the end of its name, the most specific
+# first
+SUFFIXES = [('_rad_atmcorr_refl' + RAW_EXT, 'refl'),
+            ('_rad_atmcorr' + RAW_EXT, 'atmcorr'),
+            ('_rad' + RAW_EXT, 'rad')]
+
+
+def args_parser():
+    """
+    Reads in the image directory from the console
+
+    Parameters:
+    None
+
+    Return:
+    Returns the parsed console arguments
+    """
+
+    parser = argparse.ArgumentParser(description='Converts the raw stores of a ' +
+                                     'console-inputted directory into GeoTIFFs')
+
+    parser.add_argument('-ip', '--input_dir', type=str, default='./',
+                        help=('The directory with the raw stores'))
+    parser.add_argument('-op', '--output_dir', type=str, default='./',
+                        help=('The output directory'))
+    parser.add_argument('-k', '--keep', type=str, default='refl',
+                        help=('The comma separated products to convert, from ' +
+                              'rad,atmcorr,refl. Defaults to refl'))
+    parser.add_argument('-c', '--clean', action='store_true',
+                        help=('Remove every raw store once the kept ones are converted'))
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help=('The number of images to convert at the same time'))
+    parser.add_argument('-pr', '--profile', choices=sorted(PROFILES), default=None,
+                        help=('The output profile: fast, compact or cog. Defaults to ' +
+                              'LZW strips'))
+    parser.add_argument('-e', '--encoding', choices=ENCODINGS, default='float32',
+                        help=('How the values are stored: float32, float16, or uint16 ' +
+                              'with a scale and offset. Defaults to float32'))
+    parser.add_argument('--profile-startup', action='store_true',
+                        help=('Print the time spent importing each package on exit'))
+
+    return parser.parse_args()
+
+
+def raw_product(raw_file):
+    """
+    Finds the product held in a raw store from its name.
+
+    Parameters:
+    raw_file - the name of the raw store
+
+    Return:
+    The product, rad, atmcorr or refl, or None for other names
+    """
+
+    for suffix, product in SUFFIXES:
+        if raw_file.endswith(suffix):
+            return product
+
+    return None
+
+
+def finalize_scene(working_dir, output_dir, raw_file, profile=None, encoding='float32'):
+    """
+    Converts one raw store into a GeoTIFF, unless the GeoTIFF is already
+    up to date with the store and the options.
+
+    Parameters:
+    working_dir - the directory with the raw store
+    output_dir  - the directory to write the GeoTIFF into
+    raw_file    - the name of the raw store
+    profile     - the name of the output profile, or None
+    encoding    - how the GeoTIFF is stored, one of ENCODINGS
+
+    Return:
+    None
+    """
+
+    tif_file = raw_file[:-len(RAW_EXT)] + '.tif'
+    tif_path = os.path.join(output_dir, tif_file)
+    raw_path = os.path.join(working_dir, raw_file)
+    inputs = store_files(raw_path)
+    params = {'profile': profile, 'encoding': encoding}
+    code = code_version(__file__, 'encoding', 'nodata', 'profiles', 'rawstore')
+    if is_current([tif_path], inputs, params, code):
+        print(tif_file + ' is up to date!')
+        return
+
+    with atomic_output(tif_path) as temp_path:
+        finalize(raw_path, temp_path, raw_product(raw_file), profile, encoding)
+    record('finalize', [tif_path], inputs, params, code)
+
+    print(raw_file + ' has been converted.')
+
+
+def main():
+    """
+    Main function. Converts the raw stores of the kept products of the
+    specified directory, and removes the raw stores if asked to.
+
+    Parameters:
+    None
+
+    Return:
+    None
+    """
+
+    args = args_parser()
+    working_dir = args.input_dir
+    output_dir = args.output_dir
+
+    keep = [product.strip() for product in args.keep.split(',') if product.strip()]
+    unknown = [product for product in keep if product not in ('rad', 'atmcorr', 'refl')]
+    if unknown:
+        sys.exit('Unknown products: ' + ', '.join(unknown))
+
+    # Collects the raw stores with a sidecar inside of the folder
+    raw_files = sorted(f for f in os.listdir(working_dir)
+                       if (raw_product(f) is not None and not f.startswith('.') and
+                           os.path.isfile(sidecar_path(os.path.join(working_dir, f)))))
+    if not raw_files:
+        print('There are no raw stores in ' + working_dir + '!')
+        return
+
+    # Converts every kept raw store, one per worker
+    failures = run_scenes(finalize_scene,
+                          [(f, (working_dir, output_dir, f, args.profile, args.encoding))
+                           for f in raw_files if raw_product(f) in keep],
+                          args.workers)
+    if failures:
+        sys.exit(1)
+
+    if args.clean:
+        for f in raw_files:
+            remove_raw(os.path.join(working_dir, f))
+        print('Removed {} raw stores.'.format(len(raw_files)))
+
+
+# If the script was directly called, run the script
+if __name__ == '__main__':
+    main()
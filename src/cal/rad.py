@@ -12,14 +12,32 @@ the script will not run.
 The radiance image will be outputted in the same folder as the original raw image.
 """
 
-# Imports the necessary packages. Rasterio is used to access the band data in .tif files
-# ET is used to access the contents of .xml files.
-import xml.etree.ElementTree as ET
-import rasterio
-import numpy as np
-import math
+# Imports the necessary packages. Rasterio, used to access the band data in
+# .tif files, is only imported once there is an image to convert
 import os
 import argparse
+import sys
+
+# Makes the shared helpers in lib importable no matter where the script is
+# called from. Run directly, the script joins its package and imports it
+# relative to itself, just as when the pipeline imports it
+if not __package__:
+    _PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    sys.path.insert(0, os.path.dirname(_PACKAGE_DIR))
+    __package__ = os.path.basename(_PACKAGE_DIR) + '.cal'
+# Times the imports from here on when --profile-startup is given
+from ..lib import startup  # noqa: F401
+from ..lib.calibration import radiance
+from ..lib.coefficients import (DEFAULT_COEFFICIENTS, coefficients_name, scene_coefficients,
+                                tag_coefficients)
+from ..lib.encoding import ENCODINGS, encoding_meta, set_scaling, encode
+from ..lib.manifest import code_version, is_current, record
+from ..lib.metadata import read_metadata
+from ..lib.nodata import valid_mask, write_masked
+from ..lib.parallel import run_scenes, atomic_output
+from ..lib.profiles import PROFILES, profile_meta, finish_output
+from ..lib.rawstore import create_raw, raw_name, store_files
+from ..lib.tiling import tile_windows, map_windows
 
 
 def args_parser():
@@ -42,10 +60,171 @@ def args_parser():
                         help=('The directory with the set of images'))
     parser.add_argument('-op', '--output_dir', type=str, default='./',
                         help=('The output directory'))
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help=('Kept for older commands. The image is always ' +
+                              'processed tile by tile'))
+    parser.add_argument('-ts', '--tile_size', type=int, default=0,
+                        help=('The tile edge length in pixels. Defaults to the ' +
+                              'internal blocks of the image'))
+    parser.add_argument('-th', '--threads', type=int, default=1,
+                        help=('The number of threads working on the tiles of one ' +
+                              'image'))
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help=('The number of images to process at the same time'))
+    parser.add_argument('-pr', '--profile', choices=sorted(PROFILES), default=None,
+                        help=('The output profile: fast, compact or cog. Defaults to ' +
+                              'keeping the layout of the input'))
+    parser.add_argument('-e', '--encoding', choices=ENCODINGS, default='float32',
+                        help=('How the values are stored: float32, float16, or uint16 ' +
+                              'with a scale and offset. Defaults to float32'))
+    parser.add_argument('-rw', '--raw', action='store_true',
+                        help=('Write the radiance as a raw memory mapped store for ' +
+                              'atmcorr_specmath.py instead of a GeoTIFF'))
+    parser.add_argument('--profile-startup', action='store_true',
+                        help=('Print the time spent importing each package on exit'))
 
     # Returns the directory
     return parser.parse_args()
 
+
+def stream_radiance(src, dst, gain, offset, abscalfactor, effbandwidth, windows,
+                    threads=1, encoding='float32'):
+    """
+    Converts the raw image to radiance one window at a time. All 8 bands
+    of a window are read and calibrated at once, so the memory used only
+    depends on the size of a window. With more than one thread the windows
+    are read and calibrated in parallel while this thread writes them in
+    order.
+
+    Each window is read straight into a float32 array, which the radiance
+    kernel then overwrites in place, so no other arrays are made.
+
+    The valid-data mask of every window is found from its digital numbers
+    and written along with it. A window of only collar is left unwritten.
+
+    Parameters:
+    src          - the open raw image
+    dst          - the open rad.tif image to be written into
+    gain         - the gain correction values of each band
+    offset       - the offset correction values of each band
+    abscalfactor - a list of the ABSCALFACTOR of each band
+    effbandwidth - a list of the EFFECTIVEBANDWIDTH of each band
+    windows      - the windows to convert the raw image in
+    threads      - the number of threads reading and calibrating windows
+    encoding     - the encoding dst was created with
+
+    Return:
+    None
+    """
+
+    def calibrate(block):
+        mask = valid_mask(block)
+        if not mask.any():
+            return None
+        return encode(radiance(block, gain, offset, abscalfactor, effbandwidth, out=block),
+                      encoding, 'rad'), mask
+
+    for window, result in map_windows(src, windows, calibrate, threads, out_dtype='float32'):
+        if result is not None:
+            write_masked(dst, result[0], result[1], window)
+
+
+def radiance_scene(working_dir, output_dir, f, tile_size, threads, profile=None,
+                   encoding='float32', raw=False):
+    """
+    Converts one raw image to radiance, unless its rad.tif image is
+    already up to date with the raw image, its .xml and the options.
+
+    Parameters:
+    working_dir - the directory with the raw image and its .xml
+    output_dir  - the directory to write the rad.tif image into
+    f           - the name of the raw .tif image
+    tile_size   - the tile edge length in pixels. 0 follows the internal
+                  blocks of the image
+    threads     - the number of threads working on the tiles
+    profile     - the name of the output profile, or None
+    encoding    - how the radiance is stored, one of ENCODINGS
+    raw         - True to write a raw store instead of the rad.tif image.
+                  It is float32 whatever the encoding
+
+    Return:
+    None
+    """
+
+    # If the radiance image needs to be made, use Spitzbart's script to make one
+    xml_file = f.replace('.tif','.xml')
+
+    if not os.path.isfile(os.path.join(working_dir, xml_file)):
+        print('XML: ', xml_file, 'does not exist')
+        return
+
+    # Sees if the rad.tif for the raw image being analyzed is up to date.
+    # The tiling doesn't change the output, so it isn't recorded
+    rad_path = os.path.join(output_dir, f.replace('.tif', '_rad.tif'))
+    outputs = [rad_path]
+    if raw:
+        rad_path = raw_name(rad_path)
+        outputs = store_files(rad_path)
+    # The coefficient file is an input, so editing a value remakes the
+    # images even if its version wasn't bumped
+    inputs = [os.path.join(working_dir, f), os.path.join(working_dir, xml_file),
+              DEFAULT_COEFFICIENTS]
+
+    # collect image metadata, and the gain and offset correction values of
+    # the sensor when the image was taken. An unknown sensor stops here
+    scene = read_metadata(os.path.join(working_dir, xml_file))
+    coefficients = scene_coefficients(scene)
+
+    # The version of the coefficients is recorded, so a new one remakes
+    # the images it applies to
+    params = {'profile': profile, 'encoding': encoding,
+              'coefficients': coefficients_name(coefficients)}
+    code = code_version(__file__, 'calibration', 'coefficients', 'encoding', 'metadata',
+                        'nodata', 'profiles', 'rawstore', 'tiling')
+    if is_current(outputs, inputs, params, code):
+        print(os.path.basename(rad_path) + ' is up to date!')
+        return
+
+    import rasterio
+
+    # A raw store holds the float32 values, which are only encoded once
+    # it is finalized
+    if raw:
+        encoding = 'float32'
+
+    src = rasterio.open(os.path.join(working_dir, f))
+    meta = src.meta
+    meta.update({"driver": "GTiff",
+                 "compress": "LZW",
+                 "count": 8,
+                 "dtype": "float32",
+                 "bigtiff": "YES",
+                 "nodata": 255})
+    meta = profile_meta(encoding_meta(meta, encoding), profile)
+
+    # Creates the rad.tif file to be written into. It only gets its
+    # final name once it is completely written
+    with atomic_output(rad_path) as temp_path:
+        if raw:
+            dst = create_raw(temp_path, meta)
+        else:
+            dst = rasterio.open(temp_path, 'w', **meta)
+            set_scaling(dst, encoding, 'rad')
+        tag_coefficients(dst, coefficients)
+        with dst:
+            # Converts the image a tile at a time, so the memory used
+            # depends on the tile size rather than on the scene
+            windows = tile_windows(src, tile_size)
+            stream_radiance(src, dst, coefficients.gain, coefficients.offset, scene.abscalfactor, scene.effbandwidth,
+                            windows, threads, encoding)
+        if not raw:
+            finish_output(temp_path, profile)
+    record('rad', outputs, inputs, params, code)
+
+    print(f + ' has been processed.')
+    src.close()
+
+
 def main():
     """
     Main function. Searches all of the folders within the specified directory for
@@ -82,77 +261,15 @@ def main():
             # ...append it to the list of raw images
             tif_files.append(image_file)
 
-    # for each .tif file in the folder...
-    for f in tif_files:
-        # Sees if an output file for the raw image being analyzed exists...
-        rad_file_exists = os.path.isfile(os.path.join(working_dir, f.replace('.tif', '_rad.tif')))
-
-        # If the radiance image doesn't exist, use Spitzbart's script to make one
-        if not rad_file_exists:
-            xml_file = f.replace('.tif','.xml')
-
-            if not os.path.isfile(os.path.join(working_dir, xml_file)):
-                print('XML: ', xml_file, 'does not exist')
-                break
-
-            tree=ET.parse(os.path.join(working_dir, xml_file))
-            root = tree.getroot()
-
-            # collect image metadata
-            bands = ['BAND_C','BAND_B','BAND_G','BAND_Y','BAND_R','BAND_RE','BAND_N','BAND_N2']
-
-            src = rasterio.open(os.path.join(working_dir, f))
-            meta = src.meta
-            rt = root[1][2].find('IMAGE')
-            satid = rt.find('SATID').text
-            
-            # gain correction values
-            if satid == 'WV02':
-                gain = [1.151,0.988,0.936,0.949,0.952,0.974,0.961,1.002] # WV02
-            if satid == 'WV03':
-                gain = [0.905,0.940,0.938,0.962,0.964,1.000,0.961,0.978] # WV03
-            
-            #offset correction values
-            if satid == 'WV02':
-                offset = [-7.478,-5.736,-3.546,-3.564,-2.512,-4.120,-3.300,-2.891] # WV02
-            if satid == 'WV03':
-                offset = [-8.604,-5.809,-4.996,-3.649,-3.021,-4.521,-5.522,-2.992] # WV03
-            
-            # Update meta to float64
-            meta.update({"driver": "GTiff",
-                "compress": "LZW",
-                "count": "8",
-                "dtype": "float32",
-                "bigtiff": "YES",
-                "nodata": 255})
-
-            # Creates the rad.tif file to be written into
-            with rasterio.open(os.path.join(output_dir, f.replace('.tif', '_rad.tif')),
-                                'w', **meta) as dst:
-                i = 0
-
-                # The commented out print statements were a part of Spitzbart's
-                # script. If they are needed, they can be commented back in -Brian
-                for band in bands:
-                    rt = root[1][2].find(band)
-                    # collect band metadata
-                    abscalfactor = np.float32(rt.find('ABSCALFACTOR').text)
-                    effbandwidth = np.float32(rt.find('EFFECTIVEBANDWIDTH').text)
-
-                    # print(bands[i])
-                    # print(src.read(i+1)[0,0]," ",abscalfactor," ",effbandwidth)
-
-                    ### Read each layer and write it to stack
-                    rad = np.float32(gain[i])*src.read(i + 1)*(abscalfactor/effbandwidth)+np.float32(offset[i])
-                    #print(rad[0,0],rad.dtype)
-                    dst.write_band(i + 1, rad)
-                    i += 1
-
-            print(f + ' has been processed.')
-            src.close()
-        # If the rad.tif file already exists, print out a message saying so
-        elif rad_file_exists:
-            print(f.replace('.tif', '_rad.tif') + ' already exists!')
+    # Converts every .tif file in the folder, one per worker
+    failures = run_scenes(radiance_scene,
+                          [(f, (working_dir, output_dir, f, args.tile_size,
+                                args.threads, args.profile, args.encoding, args.raw))
+                           for f in tif_files],
+                          args.workers)
+    if failures:
+        sys.exit(1)
+
 
 # If the script was directly called, run the script
 if __name__ == '__main__':
@@ -13,18 +13,32 @@ The reflectance image will be outputted in the same folder as the
 atmospherically corrected image.
 """
 
-import xml.etree.ElementTree as ET
-import math
 import os
 import argparse
 import sys
+# Makes the shared helpers in lib importable no matter where the script
+# is called from. Run directly, the script joins its package and imports
+# it relative to itself, just as when the pipeline imports it
+if not __package__:
+    _PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    sys.path.insert(0, os.path.dirname(_PACKAGE_DIR))
+    __package__ = os.path.basename(_PACKAGE_DIR) + '.cal'
+# Times the imports from here on when --profile-startup is given
+from ..lib import startup  # noqa: F401
 import numpy as np
-import rasterio
+from ..lib.calibration import reflectance
+from ..lib.coefficients import (DEFAULT_COEFFICIENTS, coefficients_name, scene_coefficients,
+                                tag_coefficients)
+from ..lib.encoding import ENCODINGS, encoding_meta, set_scaling
+from ..lib.manifest import code_version, is_current, record
+from ..lib.metadata import read_metadata
+from ..lib.parallel import run_scenes, atomic_output
+from ..lib.profiles import PROFILES, profile_meta, finish_output
+from ..lib.rawstore import (RAW_EXT, RawImage, create_raw, is_raw, store_files, band_math,
+                            latest_images)
+from ..lib.solar import earth_sun_distance, sun_grid as make_sun_grid, upsample
+from ..lib.tiling import tile_windows
 
-# Imports a dictionary containing the Earth-Sun distance in AU depending
-# on the date.
-sys.path.insert(0, "./..")
-from lib.earth_sun_dist import date_distance
 
 def args_parser():
     """
@@ -48,10 +62,194 @@ def args_parser():
                         help=('The directory with the set of images'))
     parser.add_argument('-op', '--output_dir', type=str, default='./',
                         help=('The output directory'))
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help=('Kept for older commands. The image is always ' +
+                              'processed tile by tile'))
+    parser.add_argument('-ts', '--tile_size', type=int, default=0,
+                        help=('The tile edge length in pixels. Defaults to the ' +
+                              'internal blocks of the image'))
+    parser.add_argument('-th', '--threads', type=int, default=1,
+                        help=('The number of threads working on the tiles of one ' +
+                              'image'))
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help=('The number of images to process at the same time'))
+    parser.add_argument('-pr', '--profile', choices=sorted(PROFILES), default=None,
+                        help=('The output profile: fast, compact or cog. Defaults to ' +
+                              'keeping the layout of the input'))
+    parser.add_argument('-e', '--encoding', choices=ENCODINGS, default='float32',
+                        help=('How the values are stored: float32, float16, or uint16 ' +
+                              'with a scale and offset. Defaults to float32'))
+    parser.add_argument('-rw', '--raw', action='store_true',
+                        help=('Write the reflectance as a raw memory mapped store ' +
+                              'instead of a GeoTIFF, to be finalized by finalize.py'))
+    parser.add_argument('-sg', '--sun_grid', action='store_true',
+                        help=('Use the solar elevation at the place and time of every ' +
+                              'pixel instead of MEANSUNEL, from a coarse grid over ' +
+                              'the corners of the image'))
+    parser.add_argument('--profile-startup', action='store_true',
+                        help=('Print the time spent importing each package on exit'))
 
     # Returns the passed in directory
     return parser.parse_args()
 
+
+def refl_name(f2, raw=False):
+    """
+    Names the reflectance image of a radiance or corrected image.
+
+    Parameters:
+    f2  - the name of the .tif image or raw store to convert
+    raw - True for the name of a raw store
+
+    Return:
+    The name of the reflectance image
+    """
+
+    return os.path.splitext(f2)[0] + '_refl' + (RAW_EXT if raw else '.tif')
+
+
+def scene_xml(f2):
+    """
+    Names the .xml file of the raw image a radiance or corrected image was
+    made from, e.g. image_rad_atmcorr.tif -> image.xml.
+
+    Parameters:
+    f2 - the name of the .tif image or raw store to convert
+
+    Return:
+    The name of the .xml file
+    """
+
+    name = os.path.splitext(f2)[0]
+    for suffix in ('_atmcorr', '_rad'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+
+    return name + '.xml'
+
+
+def reflectance_scene(working_dir, output_dir, xml_file, f2, tile_size=0,
+                      threads=1, profile=None, encoding='float32', raw=False,
+                      sun_grid=False):
+    """
+    Converts one radiance or atmospherically corrected image to
+    reflectance, unless its refl.tif image is already up to date with the
+    image, the .xml and the options.
+
+    Parameters:
+    working_dir - the directory with the image and the .xml
+    output_dir  - the directory to write the refl.tif image into
+    xml_file    - the name of the .xml file of the image
+    f2          - the name of the .tif image or raw store to convert
+    tile_size   - the tile edge length in pixels. 0 follows the internal
+                  blocks of the image
+    threads     - the number of threads working on the tiles
+    profile     - the name of the output profile, or None
+    encoding    - how the reflectance is stored, one of ENCODINGS
+    raw         - True to write a raw store instead of the refl.tif image
+    sun_grid    - True to correct every pixel for the solar elevation at
+                  its place and time instead of using MEANSUNEL
+
+    Return:
+    None
+    """
+
+    # Every scene is calibrated with the metadata of its own raw image
+    if not os.path.isfile(os.path.join(working_dir, xml_file)):
+        raise IOError('XML: ' + os.path.join(working_dir, xml_file) + ' does not exist')
+
+    # Check to see if the image was already processed, and nothing it was
+    # made from changed since
+    refl_path = os.path.join(output_dir, refl_name(f2, raw))
+    outputs = store_files(refl_path) if raw else [refl_path]
+    # The coefficient file is an input, so editing a value remakes the
+    # images even if its version wasn't bumped
+    inputs = [os.path.join(working_dir, f2), os.path.join(working_dir, xml_file),
+              DEFAULT_COEFFICIENTS]
+    if is_raw(f2):
+        inputs += store_files(inputs[0])[1:]
+
+    # collect image metadata, and the ESUN values of the sensor when the
+    # image was taken. An unknown sensor stops here
+    scene = read_metadata(os.path.join(working_dir, xml_file))
+    coefficients = scene_coefficients(scene)
+
+    # The version of the coefficients is recorded, so a new one remakes
+    # the images it applies to
+    params = {'profile': profile, 'encoding': encoding, 'sun_grid': sun_grid,
+              'coefficients': coefficients_name(coefficients)}
+    code = code_version(__file__, 'calibration', 'coefficients', 'encoding', 'metadata',
+                        'nodata', 'profiles', 'rawstore', 'solar', 'tiling')
+
+    # If the refl.tif file is up to date, print out a message
+    # saying so
+    if is_current(outputs, inputs, params, code):
+        print(refl_name(f2, raw) + ' is up to date!')
+        return
+
+    # Only imported once there is an image to convert
+    import rasterio
+
+    # Maps the raw store written by atmcorr_specmath.py --raw or rad.py
+    # --raw, or opens the .tif image
+    if is_raw(f2):
+        src = RawImage(os.path.join(working_dir, f2))
+    else:
+        src = rasterio.open(os.path.join(working_dir, f2))
+    if raw:
+        encoding = 'float32'
+    meta = src.meta
+    meta.update({"driver": "GTiff",
+                 "count": 8,
+                 "dtype": "float32",
+                 "bigtiff": "YES",
+                 "nodata": 255})
+    meta = profile_meta(encoding_meta(meta, encoding), profile)
+
+    # Finds the date the image was taken at
+    tlctime = scene.tlctime
+
+    meansunel = np.float32(scene.meansunel)
+
+    # Finds the associated Earth-Sun distance in AU from the
+    # time the image was taken at
+    dist = earth_sun_distance(tlctime)
+
+    esun = coefficients.esun
+
+    # The coarse grid of the solar elevation over the image, interpolated
+    # to the pixels of every tile
+    grid = make_sun_grid(scene, src.width, src.height) if sun_grid else None
+
+    def convert(block, out, window):
+        sun_scale = None if grid is None else upsample(grid, window)
+        return reflectance(block, dist, esun, meansunel, out=out, sun_scale=sun_scale)
+
+    # The refl.tif image only gets its final name once it is
+    # completely written
+    with atomic_output(refl_path) as temp_path:
+        if raw:
+            dst = create_raw(temp_path, meta)
+        else:
+            dst = rasterio.open(temp_path, 'w', **meta)
+            set_scaling(dst, encoding, 'refl')
+        tag_coefficients(dst, coefficients)
+        with dst:
+            # Converts all of the bands of a tile at once on a pool of
+            # threads, so the memory used depends on the tile size rather
+            # than on the scene. An encoded input is decoded while it is
+            # read, and between two raw stores the windows are never copied
+            band_math(src, dst, tile_windows(src, tile_size), convert, threads, encoding, 'refl')
+        if not raw:
+            finish_output(temp_path, profile)
+    record('refl', outputs, inputs, params, code)
+
+    src.close()
+    # Prints that a certain image was successfully converted
+    # to reflectance
+    print(f2 + ' has been processed.')
+
+
 def main():
     """
     Main function. Searches all of the folders within the specified directory 
@@ -75,9 +273,7 @@ def main():
     # the inputted directory
 
     # for each folder in the specified directory...
-    # Initialize a variable to save the name of the .xml file.
     # Initialize a variable to count the number of .xml files.
-    xml_file = ''
     xml_count = 0
 
     # Initialize a list to hold all of the corrected .tif images.
@@ -93,12 +289,12 @@ def main():
     for file in os.listdir(folder_dir):
         # if the file is an .xml file and is NOT related to a P1BS image...
         if file.endswith('.xml') and ('P1BS' not in file):
-            # save the name of the file...
-            xml_file = file
-            # and add 1 to the xml count
+            # add 1 to the xml count. Each image is converted with the .xml
+            # of its own raw image
             xml_count += 1
-        # if the file is a corrected image and is NOT a P1BS image...
-        elif file.endswith('atmcorr.tif') and ('P1BS' not in file):
+        # if the file is a corrected image or raw store and is NOT a P1BS
+        # image...
+        elif file.endswith(('atmcorr.tif', 'atmcorr' + RAW_EXT)) and ('P1BS' not in file):
             # append it to the list of corrected images...
             refl_ready_files.append(file)
             # and add 1 to the image count
@@ -106,18 +302,24 @@ def main():
         else:
             continue
 
-    # Rerunning the loop to check for rad.tif files...
+    # Of a corrected .tif image and a raw store of the same scene, the
+    # newer one is converted
+    refl_ready_files = latest_images(folder_dir, refl_ready_files)
+    corrected = [os.path.splitext(file)[0] for file in refl_ready_files]
+
+    # Rerunning the loop to check for rad.tif files and raw stores...
+    rad_files = []
     for file in os.listdir(folder_dir):
         # if there isn't an atmospherically corrected image...
-        if (file.endswith('rad.tif') and ('P1BS' not in file) and 
-                (file.replace('rad.tif', 'rad_atmcorr.tif') not in
-                refl_ready_files)):
+        if (file.endswith(('rad.tif', 'rad' + RAW_EXT)) and ('P1BS' not in file) and
+                (os.path.splitext(file)[0] + '_atmcorr' not in corrected)):
             # use the radiance image to convert it to reflectance...
-            refl_ready_files.append(file)
+            rad_files.append(file)
             # and add 1 to the image count
             refl_ready_count += 1
         else:
             continue
+    refl_ready_files += latest_images(folder_dir, rad_files)
 
     # A remnant of where the script saved the newly processed images.
     # Easier and safer to just set it equal to the new place to be saved
@@ -126,95 +328,24 @@ def main():
     # If there was an xml and at least one corrected image detected...
     if xml_count != 0 and refl_ready_count != 0:
 
-        # for each detected corrected image...
-        for f2 in refl_ready_files:
-            # Check to see if the image was already processed
-            refl_file_exists = os.path.isfile(os.path.join(output_dir,
-                                                f2.replace('.tif',
-                                                            '_refl.tif')))
-
-            # If it wasn't processed...
-            if not refl_file_exists:
-                
-                tree = ET.parse(os.path.join(working_dir, working_dir, xml_file))
-                root = tree.getroot()
-                
-                src = rasterio.open(os.path.join(working_dir, working_dir, f2))
-                meta = src.meta
-                # Update meta to float64
-                meta.update({"driver": "GTiff",
-                                "count": "8",
-                                "dtype": "float32",
-                                "bigtiff": "YES",
-                                "nodata": 255})
-                
-                # collect image metadata
-                bands = ['BAND_C', 'BAND_B', 'BAND_G', 'BAND_Y', 'BAND_R',
-                            'BAND_RE', 'BAND_N', 'BAND_N2']
-                rt = root[1][2].find('IMAGE')
-
-                # Finds the date the image was taken at
-                tlctime = rt.find('TLCTIME').text
-                
-                satid = rt.find('SATID').text
-                meansunel = np.float32(rt.find('MEANSUNEL').text)
-
-                # Used to find the month the image was taken in
-                months = {'01': 'JAN', '02': 'FEB', '03': 'MAR',
-                            '04': 'APR', '05': 'MAY', '06': 'JUN',
-                            '07': 'JUL', '08': 'AUG', '09': 'SEP',
-                            '10': 'OCT', '11': 'NOV', '12': 'DEC'
-                            }
-
-                # Converts the date in the XML to the date format in
-                # date_distance
-                date = months[tlctime[5:7]] + tlctime[8:10]
-
-                # Finds the associated Earth-Sun distance in AU from the
-                # imported dictionary
-                dist = date_distance[date]
-                
-                if satid == 'WV02':
-                    esun = [1758.2229, 1974.2416, 1856.4104, 1738.4791,
-                            1559.4555, 1342.0695, 1069.7302, 861.2866]
-                if satid == 'WV03':
-                    esun = [1803.9109, 1982.4485, 1857.1232, 1746.5947,
-                            1556.9730, 1340.6822, 1072.5267, 871.1058]
-
-                with rasterio.open(os.path.join(output_dir,
-                                    f2.replace('.tif', '_refl.tif')),
-                                    'w', **meta) as dst:
-                    i = 0
-
-                    # The commented out print statement was a part of 
-                    # Spitzbart's script. If it is needed, it can be 
-                    # commented back in -Brian
-                    for _ in bands:
-                        # Read each layer and write it to stack
-                        refl = (src.read(i + 1) * math.pi * (dist ** 2) /
-                                (esun[i] * math.sin(math.radians(meansunel))
-                                ))
-                        # print(refl[0,0],refl.dtype)
-                        dst.write_band(i + 1, refl)
-                        i += 1
-
-                dst.close()
-                # Prints that a certain image was successfully converted
-                # to reflectance
-                print(f2 + ' has been processed.')
-
-            # If the refl.tif file already exists, print out a message
-            # saying so
-            elif refl_file_exists:
-                print(f2.replace('.tif', '_refl.tif') + ' already exists!')
+        # Converts each detected corrected image, one per worker
+        failures = run_scenes(reflectance_scene,
+                              [(f2, (working_dir, output_dir, scene_xml(f2), f2,
+                                     args.tile_size, args.threads, args.profile,
+                                     args.encoding, args.raw, args.sun_grid))
+                               for f2 in refl_ready_files],
+                              args.workers)
+        if failures:
+            sys.exit(1)
     # If there are no .xml files, print out a message saying so
     elif xml_count == 0:
-        print('There are no .xml files in ' + folder + '!')
+        print('There are no .xml files in ' + working_dir + '!')
     # If there are no raw .tif files to be analyzed, print out a message
     # saying so
     elif refl_ready_count == 0:
-        print('There are no corrected .tif images in ' + folder + '!')
+        print('There are no corrected .tif images in ' + working_dir + '!')
     
+
 # If the script was directly called, start it
 if __name__ == '__main__':
     main()
@@ -9,15 +9,33 @@ It searches through the console specified directory for refl.tif images. If no r
 The output will an image-sized array of values relating to different landcover classes.
 """
 
-# Imports the necessary packages. Rasterio is used to access the band data in .tif files
-import rasterio
-import numpy as np
-import math
+# Imports the necessary packages. Rasterio, used to access the band data in
+# .tif files, is only imported once there is an image to classify
 import os
 import argparse
-import xml.etree.ElementTree as ET
-import cv2
-from shapely.geometry import Polygon, LineString, Point 
+import sys
+from contextlib import ExitStack
+
+# Imports the classification shared with the fused calibration engine. Run
+# directly, the script joins its package and imports it relative to
+# itself, just as when the pipeline imports it
+if not __package__:
+    _PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    sys.path.insert(0, os.path.dirname(_PACKAGE_DIR))
+    __package__ = os.path.basename(_PACKAGE_DIR) + '.classification'
+# Times the imports from here on when --profile-startup is given
+from ..lib import startup  # noqa: F401
+import numpy as np
+from ..lib.classify import (CLASSES, class_masks, sum_bands as band_sum, class_labels,
+                            label_meta, write_colormap)
+from ..lib.encoding import read_decoded
+from ..lib.manifest import code_version, is_current, record
+from ..lib.nodata import write_masked
+from ..lib.parallel import run_scenes, atomic_output
+from ..lib.profiles import PROFILES, profile_meta, finish_output
+from ..lib.rules import RuleSet
+from ..lib.tiling import tile_windows, map_windows
+
 
 def args_parser():
     """
@@ -37,10 +55,261 @@ def args_parser():
                         help=('The directory with the set of images'))
     parser.add_argument('-op', '--output_dir', type=str, default='./',
                         help=('The output directory'))
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help=('The number of images to process at the same time'))
+    parser.add_argument('-pr', '--profile', choices=sorted(PROFILES), default=None,
+                        help=('The output profile: fast, compact or cog. Defaults to ' +
+                              'keeping the layout of the input'))
+    parser.add_argument('-l', '--labels', action='store_true',
+                        help=('Write a single uint8 label image ending with ' +
+                              '_class_labels.tif, in one pass over the tiles of the ' +
+                              'image, instead of the band sum and the class masks'))
+    parser.add_argument('-r', '--rules', type=str, default=None,
+                        help=('A JSON file of spectral rules to classify with ' +
+                              'instead of the band sum. Implies --labels'))
+    parser.add_argument('--write_masks', action='store_true',
+                        help=('With --labels, also write the class masks'))
+    parser.add_argument('--write_sumbands', action='store_true',
+                        help=('With --labels, also write the band sum image'))
+    parser.add_argument('-ts', '--tile_size', type=int, default=0,
+                        help=('The tile edge length in pixels used by --labels. ' +
+                              'Defaults to the internal blocks of the image'))
+    parser.add_argument('-th', '--threads', type=int, default=1,
+                        help=('The number of threads working on the tiles of one ' +
+                              'image with --labels'))
+    parser.add_argument('--profile-startup', action='store_true',
+                        help=('Print the time spent importing each package on exit'))
 
     # Returns the passed in directory
     return parser.parse_args()
 
+
+def write_image(path, meta, data, mask, profile=None, fill=None):
+    """
+    Writes a whole image with its valid-data mask. It only gets its final
+    name once it is completely written.
+
+    Parameters:
+    path    - the path of the image
+    meta    - the rasterio metadata of the image
+    data    - the array to write. Its invalid pixels are overwritten
+    mask    - the uint8 valid-data mask of the image
+    profile - the name of the output profile, or None
+    fill    - the value of the invalid pixels, or None for the nodata
+              value of the image
+
+    Return:
+    None
+    """
+
+    import rasterio
+
+    with atomic_output(path) as temp_path:
+        with rasterio.open(temp_path, 'w', **profile_meta(meta, profile)) as dst:
+            write_masked(dst, data, mask, fill=fill)
+        finish_output(temp_path, profile)
+
+
+def class_scene(working_dir, output_dir, f2, profile=None):
+    """
+    Classifies one reflectance image, unless its class images are already
+    up to date with it.
+
+    Parameters:
+    working_dir - the directory with the image
+    output_dir  - the directory to write the class images into
+    f2          - the name of the refl.tif image
+    profile     - the name of the output profile, or None
+
+    Return:
+    None
+    """
+
+    # Check to see if the image was already processed, and wasn't changed
+    # since
+    paths = [os.path.join(output_dir, f2.replace('.tif', suffix))
+             for suffix in ('_class_geology.tif', '_class_snow.tif', '_class_water.tif',
+                            '_sumbands.tif')]
+    inputs = [os.path.join(working_dir, f2)]
+    params = {'profile': profile}
+    code = code_version(__file__, 'classify', 'encoding', 'nodata', 'profiles')
+
+    if is_current(paths, inputs, params, code):
+        print(f2.replace('.tif', '_class_geology.tif') + ' is up to date!')
+        return
+
+    import rasterio
+
+    src = rasterio.open(os.path.join(working_dir, f2))
+    # print(src.size)
+    meta = src.meta
+    meta.update({"driver": "GTiff",
+                 "count": 1,
+                 "dtype": "float32",
+                 "bigtiff": "YES",
+                 "nodata": 255})
+    
+    # collect image metadata
+    bands = ['BAND_C', 'BAND_B', 'BAND_G', 'BAND_Y', 'BAND_R',
+                'BAND_RE', 'BAND_N', 'BAND_N2']
+
+    i = 0
+    sum_bands = np.zeros((1,src.height,src.width),dtype=np.float32)
+
+    for _ in bands:
+        # Read each layer, decoding it if the refl.tif image was written
+        # with a compact encoding, and write it to stack
+        sum_bands = sum_bands + read_decoded(src, i + 1)
+        i += 1
+    # The valid-data mask carried from the raw image
+    valid = src.dataset_mask()
+    src.close()
+
+    write_image(os.path.join(output_dir, f2.replace('.tif', '_sumbands.tif')),
+                meta, sum_bands, valid, profile)
+    # Prints that this specific parameter has been run
+    print(f2 + ' has been processed.')
+    
+    # Classification of pixels by passing a condition
+    # over the sum array and outputs a new array with
+    # 1 values where true and 0 values where false. Pixels without data
+    # are in no class
+    meta.update({"dtype": "int32"})
+    masks = class_masks(sum_bands)
+    snow_and_ice = masks['snow']
+    #print(snow_and_ice)
+    write_image(os.path.join(output_dir, f2.replace('.tif', '_class_snow.tif')),
+                meta, snow_and_ice, valid, profile, 0)
+
+    shadow_and_water = masks['water']
+    #print(shadow_and_water)
+    write_image(os.path.join(output_dir, f2.replace('.tif', '_class_water.tif')),
+                meta, shadow_and_water, valid, profile, 0)
+    
+    geology = masks['geology']
+    #or, geology = np.where((snow_and_ice == 0) & (shadow_and_water == 0), 1, 0)
+
+    #print(geology)
+    write_image(os.path.join(output_dir, f2.replace('.tif', '_class_geology.tif')),
+                meta, geology, valid, profile, 0)
+    record('class', paths, inputs, params, code)
+
+
+def label_scene(working_dir, output_dir, f2, write_masks=False, write_sumbands=False,
+                tile_size=0, threads=1, profile=None, rules_file=None):
+    """
+    Classifies one reflectance image into a single uint8 label image with
+    a color table, unless it is already up to date. The labels, and the masks and
+    band sum if they are asked for, are all made in one pass over the tiles
+    of the image.
+
+    Parameters:
+    working_dir    - the directory with the image
+    output_dir     - the directory to write the images into
+    f2             - the name of the refl.tif image
+    write_masks    - True to also write the int32 class masks
+    write_sumbands - True to also write the band sum image
+    tile_size      - the tile edge length in pixels. 0 uses the internal
+                     blocks of the image
+    threads        - the number of threads working on the tiles
+    profile        - the name of the output profile, or None
+    rules_file     - the JSON rule file to classify with, or None for the
+                     band sum classes
+
+    Return:
+    None
+    """
+
+    # The rules are compiled here rather than in main, so only the path is
+    # sent to the workers
+    ruleset = RuleSet.from_file(rules_file) if rules_file else None
+
+    # The names of the images to write
+    labels_file = f2.replace('.tif', '_class_labels.tif')
+    names = {'labels': labels_file}
+    if write_sumbands:
+        names['sumbands'] = f2.replace('.tif', '_sumbands.tif')
+    if write_masks:
+        for name in ([cls.name for cls in ruleset.classes] if ruleset else CLASSES):
+            names['class_' + name] = f2.replace('.tif', '_class_' + name + '.tif')
+
+    # Check to see if the images are up to date with the image and rules
+    outputs = [os.path.join(output_dir, name) for name in names.values()]
+    inputs = [os.path.join(working_dir, f2)] + ([rules_file] if rules_file else [])
+    params = {'profile': profile}
+    code = code_version(__file__, 'classify', 'encoding', 'nodata', 'profiles', 'rules',
+                        'tiling')
+    if is_current(outputs, inputs, params, code):
+        print(labels_file + ' is up to date!')
+        return
+
+    import rasterio
+
+    # The images to write, with the metadata of each one
+    with rasterio.open(os.path.join(working_dir, f2)) as src:
+        meta = src.meta
+        meta.update({"driver": "GTiff",
+                     "count": 1,
+                     "dtype": "float32",
+                     "bigtiff": "YES",
+                     "nodata": 255})
+        images = {image: (name, label_meta(meta) if image == 'labels' else
+                          meta if image == 'sumbands' else dict(meta, dtype='int32'))
+                  for image, name in names.items()}
+
+        # The label image is entered first so it is the last to get its
+        # final name
+        with ExitStack() as stack:
+            paths = {image: stack.enter_context(atomic_output(os.path.join(output_dir, name)))
+                     for image, (name, _) in images.items()}
+            dsts = {image: stack.enter_context(rasterio.open(paths[image], 'w',
+                                                             **profile_meta(images[image][1], profile)))
+                    for image in images}
+            if ruleset:
+                write_colormap(dsts['labels'], ruleset.colormap(),
+                               {cls.name: cls.label for cls in ruleset.classes})
+            else:
+                write_colormap(dsts['labels'])
+
+            def classify(block, valid):
+                # Classifies one tile, which was decoded to its reflectance.
+                # The tiles without valid pixels are skipped
+                tile = {}
+                if write_sumbands or not ruleset:
+                    tile['sumbands'] = band_sum(block)
+                if ruleset:
+                    tile['labels'] = ruleset.labels(block)
+                    if write_masks:
+                        for cls in ruleset.classes:
+                            tile['class_' + cls.name] = np.int32(tile['labels'] == cls.label)
+                else:
+                    tile['labels'] = class_labels(tile['sumbands'])
+                    if write_masks:
+                        for name, mask in class_masks(tile['sumbands']).items():
+                            tile['class_' + name] = mask
+                return {image: tile[image] for image in images}, valid
+
+            # Every image gets the valid-data mask of the reflectance. The
+            # invalid pixels of the class masks are 0, and the other images
+            # get their nodata value
+            for window, result in map_windows(src, tile_windows(src, tile_size), classify,
+                                              threads, out_dtype='float32', masked=True):
+                if result is None:
+                    continue
+                tile, valid = result
+                for image, data in tile.items():
+                    write_masked(dsts[image], data, valid, window,
+                                 0 if image.startswith('class_') else None)
+
+            # Every image is closed before its overviews are made
+            for image in images:
+                dsts[image].close()
+                finish_output(paths[image], profile)
+    record('labels', outputs, inputs, params, code)
+
+    print(f2 + ' has been processed.')
+
+
 def main():
     """
     Main function. Searches all of the folders within the specified directory 
@@ -56,9 +325,7 @@ def main():
     working_dir = args.input_dir
     output_dir = args.output_dir
 
-    # Initialize a variable to save the name of the .xml file.
     # Initialize a variable to count the number of .xml files.
-    xml_file = ''
     xml_count = 0
 
     # Initialize a list to hold all of the corrected .tif images.
@@ -74,9 +341,7 @@ def main():
     for file in os.listdir(folder_dir):
         # if the file is an .xml file and is NOT related to a P1BS image...
         if file.endswith('.xml') and ('P1BS' not in file):
-            # save the name of the file...
-            xml_file = file
-            # and add 1 to the xml count
+            # add 1 to the xml count
             xml_count += 1
         # if the file is a corrected image and is NOT a P1BS image...
         elif file.endswith('refl.tif') and ('P1BS' not in file):
@@ -90,82 +355,21 @@ def main():
     # If there was an xml and at least one corrected image detected...
     if xml_count != 0 and class_ready_count != 0:
 
-        # for each detected corrected image...
-        for f2 in class_ready_files:
-            # Check to see if the image was already processed
-            class_file_exists = os.path.isfile(os.path.join(output_dir,
-                                                f2.replace('.tif',
-                                                            '_class.tif')))
-
-            # If it wasn't processed...
-            if not class_file_exists:
-                
-                tree = ET.parse(os.path.join(working_dir, xml_file))
-                root = tree.getroot()
-                
-                src = rasterio.open(os.path.join(working_dir, f2))
-                # print(src.size)
-                meta = src.meta
-                # Update meta to float64
-                meta.update({"driver": "GTiff",
-                                "count": 1,
-                                "dtype": "float32",
-                                "bigtiff": "YES",
-                                "nodata": 255})
-                
-                # collect image metadata
-                bands = ['BAND_C', 'BAND_B', 'BAND_G', 'BAND_Y', 'BAND_R',
-                            'BAND_RE', 'BAND_N', 'BAND_N2']
-                rt = root[1][2].find('IMAGE')
-
-                i = 0
-                sum_bands = np.zeros((1,src.height,src.width),dtype=np.float32)
-
-                for _ in bands:
-                    # Read each layer and write it to stack
-                    sum_bands = sum_bands + src.read(i + 1) 
-                    i += 1
-
-                dst = rasterio.open(os.path.join(output_dir,
-                                    f2.replace('.tif', '_sumbands.tif')),
-                                    'w', **meta)
-                # dmeta = dst.meta
-                #dst.meta.update({"count": "1"})
-                dst.write(sum_bands)
-                dst.close()
-                # Prints that this specific parameter has been run
-                print(f2 + ' has been processed.')
-                
-                # Classification of pixels by passing a condition
-                # over the sum array and outputs a new array with
-                # 1 values where true and 0 values where false
-                meta.update({"dtype": "int32"})
-                snow_and_ice = np.int32(np.where(sum_bands >= 3, 1, 0))
-                #print(snow_and_ice)
-                dst = rasterio.open(os.path.join(output_dir,
-                                                    f2.replace('.tif', '_class_snow.tif')),
-                                                    'w', **meta)
-                dst.write(snow_and_ice)
-                dst.close()
-
-                shadow_and_water = np.int32(np.where((sum_bands > 0) & (sum_bands <= 1), 1, 0))
-                #print(shadow_and_water)
-                dst = rasterio.open(os.path.join(output_dir,
-                                                    f2.replace('.tif', '_class_water.tif')),
-                                                    'w', **meta)
-                dst.write(shadow_and_water)
-                dst.close()
-                
-                geology = np.int32(np.where((sum_bands > 1) & (sum_bands < 3), 1, 0))
-                #or, geology = np.where((snow_and_ice == 0) & (shadow_and_water == 0), 1, 0)
-
-                #print(geology)
-                dst = rasterio.open(os.path.join(output_dir,
-                                                    f2.replace('.tif', '_class_geology.tif')),
-                                                    'w', **meta)
-                dst.write(geology)
-                dst.close()
-
+        # Classifies each detected corrected image, one per worker
+        if args.labels or args.rules:
+            failures = run_scenes(label_scene,
+                                  [(f2, (working_dir, output_dir, f2, args.write_masks,
+                                         args.write_sumbands, args.tile_size, args.threads,
+                                         args.profile, args.rules))
+                                   for f2 in class_ready_files],
+                                  args.workers)
+        else:
+            failures = run_scenes(class_scene,
+                                  [(f2, (working_dir, output_dir, f2, args.profile))
+                                   for f2 in class_ready_files],
+                                  args.workers)
+        if failures:
+            sys.exit(1)
 
     # If there are no .xml files, print out a message saying so
     elif xml_count == 0:
@@ -175,6 +379,7 @@ def main():
     elif class_ready_count == 0:
         print('There are no corrected .tif images in ' + working_dir + '!')
     
+
 # If the script was directly called, start it
 if __name__ == '__main__':
     main()
@@ -9,16 +9,40 @@ This script takes different band math parameter output files from the class.py
 script and converts them into shapefiles for mapping needs.
 """
 
-# Imports the necessary packages. Rasterio is used to access the band data in .tif files
-import rasterio
+# Imports the necessary packages. Rasterio, fiona and shapely, used to read
+# the masks and write the polygons, are only imported once there is a mask
+# to convert
 import os
 import argparse
-import xml.etree.ElementTree as ET
-import geopandas as gpd
-import cv2
 import re
-import numpy as np
-from shapely.geometry import Polygon, LineString, Point 
+import sys
+
+# Makes the shared helpers in lib importable no matter where the script is
+# called from. Run directly, the script joins its package and imports it
+# relative to itself, just as when the pipeline imports it
+if not __package__:
+    _PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    sys.path.insert(0, os.path.dirname(_PACKAGE_DIR))
+    __package__ = os.path.basename(_PACKAGE_DIR) + '.classification'
+# Times the imports from here on when --profile-startup is given
+from ..lib import startup  # noqa: F401
+from ..lib.classify import label_names
+from ..lib.manifest import code_version, is_current, record
+from ..lib.parallel import run_scenes, atomic_output
+
+# The fields of every polygon written to a shapefile. The area is in the
+# units of the coordinate system of the image, square meters for the
+# polar stereographic scenes
+SCHEMA = {'geometry': 'Polygon', 'properties': {'class': 'str:32', 'area': 'float'}}
+
+# The fiona driver and the extension of every output format
+FORMATS = {'shp': ('ESRI Shapefile', '.shp'),
+           'gpkg': ('GPKG', '.gpkg'),
+           'fgb': ('FlatGeobuf', '.fgb')}
+
+# The number of features handed to the driver at a time
+BATCH_SIZE = 10000
+
 
 def args_parser():
     """
@@ -39,32 +63,180 @@ def args_parser():
     parser.add_argument('-ip', '--input_dir', type=str, help=('The directory \
                                                                with the set of \
                                                                images'))
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help=('The number of images to process at the same time'))
+    parser.add_argument('-f', '--format', choices=sorted(FORMATS), default='shp',
+                        help=('The vector format to write. gpkg writes every class ' +
+                              'of a scene as a layer of one GeoPackage'))
+    parser.add_argument('-ts', '--tile_size', type=int, default=0,
+                        help=('The tile edge length in pixels to trace the masks in, ' +
+                              'so the memory used depends on the tile instead of the ' +
+                              'scene. 0 traces the whole mask at once'))
+    parser.add_argument('-th', '--threads', type=int, default=1,
+                        help=('The number of threads tracing the tiles of one mask'))
+    parser.add_argument('--fill_holes', action='store_true',
+                        help=('Write only the outlines of the polygons, filling the ' +
+                              'lakes in geology, the nunataks in snow and so on'))
+    parser.add_argument('-s', '--simplify', type=float, default=0,
+                        help=('The simplification tolerance in pixels. Removes the ' +
+                              'stair steps of the pixel edges. 0 keeps every vertex'))
+    parser.add_argument('-ma', '--min_area', type=float, default=0,
+                        help=('The smallest polygon or hole kept, in pixels'))
+    parser.add_argument('--profile-startup', action='store_true',
+                        help=('Print the time spent importing each package on exit'))
 
-    # Returns the directory
-    return parser.parse_args().input_dir   
+    # Returns the arguments
+    return parser.parse_args()
 
-def polygonize_raster(mask, transforms):
-    """Helper function to create polygons from binary masks
-    
-    Arguments:
-        mask {np.ndarray} -- 2D numpy array with 1s and 0s, used to draw polygon
-        transforms {Affine} -- affine matrix from rasterio.open().transforms, used to project polygon
-    
-    Returns:
-        list([shapely.Polygon]) -- List of polygons in mask. 
+
+def class_names(src, f2):
+    """
+    Finds the class of every pixel value of a class image.
+
+    Parameters:
+    src - the open class image
+    f2  - the name of the class image
+
+    Return:
+    A dictionary of pixel value -> class name
+    """
+
+    # A label image holds the names of its labels
+    if f2.endswith('_class_labels.tif'):
+        return label_names(src)
+
+    # A mask is named after its class, e.g. ..._class_snow.tif
+    label_search = re.search(r'class_(.*)\.tif', f2, re.IGNORECASE)
+    return {1: label_search.group(1) if label_search else ''}
+
+
+def class_layer(f2):
+    """
+    Names the layer of a class image in a GeoPackage after its class,
+    e.g. snow for ..._class_snow.tif and labels for ..._class_labels.tif.
+
+    Parameters:
+    f2 - the name of the class image
+
+    Return:
+    The name of the layer
+    """
+
+    return f2[f2.rfind('_class_') + len('_class_'):-len('.tif')]
+
+
+def scene_output(f2, fmt='shp'):
+    """
+    Names the vector file a class image is written to. A GeoPackage holds
+    every class image of a scene as a layer, the other formats get a file
+    per class image.
+
+    Parameters:
+    f2  - the name of the class image
+    fmt - one of FORMATS
+
+    Return:
+    The name of the vector file
+    """
+
+    if fmt == 'gpkg':
+        return f2[:f2.rfind('_class_')] + '_class' + FORMATS[fmt][1]
+    return f2.replace('.tif', FORMATS[fmt][1])
+
+
+def write_layer(path, fmt, layer, features, crs_wkt):
+    """
+    Writes features into a new vector file or GeoPackage layer with a
+    spatial index, a batch at a time.
+
+    Parameters:
+    path     - the path of the vector file
+    fmt      - one of FORMATS
+    layer    - the name of the layer, used by GeoPackages
+    features - an iterable of the fiona feature dicts
+    crs_wkt  - the coordinate system of the features as WKT
+
+    Return:
+    None
+    """
+
+    import fiona
+
+    driver, _ = FORMATS[fmt]
+    options = {'layer': layer} if fmt == 'gpkg' else {}
+    # The index is an R-tree in a GeoPackage, a packed Hilbert R-tree in a
+    # FlatGeobuf and a .qix quadtree next to a shapefile
+    with fiona.open(path, 'w', driver=driver, schema=SCHEMA, crs_wkt=crs_wkt,
+                    SPATIAL_INDEX='YES', **options) as dst:
+        batch = []
+        for feature in features:
+            batch.append(feature)
+            if len(batch) == BATCH_SIZE:
+                dst.writerecords(batch)
+                batch = []
+        if batch:
+            dst.writerecords(batch)
+
+
+def shp_scene(folder, output_dir, files, fmt='shp', tile_size=0, threads=1, holes=True,
+              simplify=0, min_area=0):
+    """
+    Converts the class images of one vector file, unless the file is
+    already up to date with them. Each mask is traced a tile at a time and every polygon is
+    written as soon as it is complete, so neither the whole mask nor all
+    of the polygons are ever held in memory.
+
+    Parameters:
+    folder     - the directory with the class images
+    output_dir - the directory to write the vector file into
+    files      - the names of the class .tif images of the file. Every
+                 image is a layer of a GeoPackage, the other formats take
+                 a single image
+    fmt        - one of FORMATS
+    tile_size  - the tile edge length in pixels. 0 traces the whole mask
+                 at once
+    threads    - the number of threads tracing tiles
+    holes      - False to write only the outlines of the polygons
+    simplify   - the simplification tolerance in pixels
+    min_area   - the smallest area of a polygon or hole kept, in pixels
+
+    Return:
+    None
     """
-    # write mask to polygon
-    polygons = []
-    edges = cv2.findContours(image=mask, mode=cv2.RETR_EXTERNAL, method=cv2.CHAIN_APPROX_SIMPLE)[0]
-    for edge in edges:
-        if len(edge) > 2:
-            pol = Polygon([transforms * ele[0] for ele in edge])
-            polygons.append(pol)
 
-    if len(polygons) > 0:
-        return polygons
-    else:
-        return False
+    # Check to see if the images were already processed, and didn't change
+    # since
+    out_name = scene_output(files[0], fmt)
+    outfile = os.path.join(output_dir, out_name)
+    inputs = [os.path.join(folder, f2) for f2 in files]
+    params = {'holes': holes, 'simplify': simplify, 'min_area': min_area}
+    code = code_version(__file__, 'classify', 'encoding', 'tiling', 'vectorize')
+    if is_current([outfile], inputs, params, code):
+        print(out_name + ' is up to date!')
+        return
+
+    import rasterio
+    from shapely.geometry import mapping
+    from ..lib.vectorize import polygonize
+
+    # The file only gets its final name once every layer is completely
+    # written
+    with atomic_output(outfile) as temp_outfile:
+        for f2 in sorted(files):
+            with rasterio.open(os.path.join(folder, f2)) as src:
+                names = class_names(src, f2)
+                features = ({'geometry': mapping(polygon),
+                             'properties': {'class': names.get(value, str(value)),
+                                            'area': polygon.area}}
+                            for polygon, value in polygonize(src, tile_size, threads, holes,
+                                                             simplify, min_area))
+                write_layer(temp_outfile, fmt, class_layer(f2), features,
+                            src.crs.to_wkt() if src.crs else None)
+
+    record('vector', [outfile], inputs, params, code)
+
+    # Prints that parameter has been converted
+    print(out_name + ' has been processed.')
 
 
 def main():
@@ -79,7 +251,8 @@ def main():
     """
 
     # Finds the current directory and appends a new folder to be made
-    working_dir = args_parser()
+    args = args_parser()
+    working_dir = args.input_dir
 
     # Empty list holds all of the relevent folders in the directory
     # !!!NEW CHANGE!!!: Now puts the inputted directory into the folders list.
@@ -100,7 +273,10 @@ def main():
 
         # for each file in the subfolder...
         for file in os.listdir(folder_dir):
-            if (('class' in file) and ('P1BS' not in file)):
+            # Leaves out the shapefiles and the temporary files of
+            # outputs still being written
+            if (('class' in file) and ('P1BS' not in file) and
+                    file.endswith('.tif') and not file.startswith('.')):
                 # append it to the list of corrected images...
                 shp_ready_files.append(file)
                 # and add 1 to the image count
@@ -116,49 +292,23 @@ def main():
         # If there was an xml and at least one corrected image detected...
         if shp_ready_count != 0:
 
-            # for each detected corrected image...
-            for f2 in shp_ready_files:
-                # Check to see if the image was already processed
-                shp_file_exists = os.path.isfile(os.path.join(output_dir,
-                                                  f2.replace('.tif',
-                                                             '.shp'))) 
-                
-                 # If it wasn't processed...
-                if not shp_file_exists:
-                    outfile = os.path.join(output_dir, f2.replace('.tif', '.shp')) 
-                    label_search = re.search('class_(.*)\.shp', outfile, re.IGNORECASE)
-
-                    if label_search:
-                        label = label_search.group(1)
-                    #print(outfile)
-                    #print(label)
-                    with rasterio.open(os.path.join(folder, f2)) as src:
-                        mask = src.read(1)
-                        transforms = src.transform
-                        crs = src.crs
-                        meta = src.meta
-                    print(mask.shape)
-                    # print(src.size)
-
-                    # Update meta to float64
-                    meta.update({"driver": "GTiff",
-                                 "count": 1,
-                                 "dtype": "float32",
-                                 "bigtiff": "YES",
-                                 "nodata": 255})
-                    print(mask.shape)
-                    mask_8bit = np.uint8(mask * 255)
-                    #cv2.cvtColor(mask, cv2.COLOR_BGR2GRAY)
-                    print(mask_8bit)
-                    polygon_df = gpd.GeoDataFrame(crs=crs)
-                    pols = polygonize_raster(mask_8bit, transforms)
-                    if pols:
-                       polygon_df = polygon_df.assign(geometry=pols)
-
-                    polygon_df.to_file(outfile)
-                    # Prints that parameter has been converted
-                    print(f2 + ' has been processed.')
-       
+            # Groups the class images by the file they are written to, so
+            # the layers of a GeoPackage are written by a single worker
+            outputs = {}
+            for f2 in sorted(shp_ready_files):
+                outputs.setdefault(scene_output(f2, args.format), []).append(f2)
+
+            # Converts each vector file, one per worker
+            failures = run_scenes(shp_scene,
+                                  [(out_name, (folder, output_dir, files, args.format,
+                                               args.tile_size, args.threads,
+                                               not args.fill_holes, args.simplify,
+                                               args.min_area))
+                                   for out_name, files in outputs.items()],
+                                  args.workers)
+            if failures:
+                sys.exit(1)
+
         # If there are no class .tif files to be analyzed, print out a message
         # saying so
         elif shp_ready_count == 0:
@@ -166,6 +316,7 @@ def main():
         else:
             continue
     
+
 # If the script was directly called, start it
 if __name__ == '__main__':
     main()
@@ -0,0 +1,153 @@
+"""
+The landcover command.
+
+landcover run takes the stages to run as a comma separated list and the
+options of the stage scripts, and runs the whole chain over a directory
+of raw images in one process:
+
+> landcover run -ip /path/to/raw -op /path/to/out --stages rad,atmcorr,refl,class,shp
+"""
+
+import argparse
+import sys
+
+# Times the imports from here on when --profile-startup is given
+from .lib import startup  # noqa: F401
+from .lib.encoding import ENCODINGS
+from .lib.profiles import PROFILES
+
+from .pipeline import STAGES, run
+
+
+def stage_list(text):
+    """
+    Reads a comma separated list of stages.
+
+    Parameters:
+    text - the list as given on the command line, e.g. rad,atmcorr,refl
+
+    Return:
+    A list of the stages
+    """
+
+    stages = [stage.strip() for stage in text.split(',') if stage.strip()]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown or not stages:
+        raise argparse.ArgumentTypeError('The stages have to be some of ' + ','.join(STAGES))
+    return stages
+
+
+def args_parser(argv=None):
+    """
+    Reads the command and its options from the console
+
+    Parameters:
+    argv - the arguments to read, or None for those of the console
+
+    Return:
+    The parsed arguments
+    """
+
+    parser = argparse.ArgumentParser(prog='landcover',
+                                     description='Runs the land cover workflow')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    run_parser = commands.add_parser('run', help=('Runs a chain of stages over every raw ' +
+                                                  'image of a directory'))
+    run_parser.add_argument('-ip', '--input_dir', type=str, default='./',
+                            help=('The directory with the raw images and their .xml files'))
+    run_parser.add_argument('-op', '--output_dir', type=str, default='./',
+                            help=('The directory to write every output into'))
+    run_parser.add_argument('--stages', type=stage_list, default=STAGES,
+                            help=('The comma separated stages to run, from ' +
+                                  ','.join(STAGES) + '. Defaults to all of them'))
+    run_parser.add_argument('-w', '--workers', type=int, default=1,
+                            help=('The number of scenes to process at the same time'))
+    run_parser.add_argument('-sc', '--scene', action='append', default=None,
+                            help=('The name of a raw image to process. May be given ' +
+                                  'more than once. Defaults to every raw image'))
+    run_parser.add_argument('-ts', '--tile_size', type=int, default=0,
+                            help=('The tile edge length in pixels. Defaults to the ' +
+                                  'internal blocks of the image, and to tracing the ' +
+                                  'masks whole in the shp stage'))
+    run_parser.add_argument('-th', '--threads', type=int, default=1,
+                            help=('The number of threads working on the tiles of one image'))
+    run_parser.add_argument('-pr', '--profile', choices=sorted(PROFILES), default=None,
+                            help=('The output profile: fast, compact or cog'))
+    run_parser.add_argument('-e', '--encoding', choices=ENCODINGS, default='float32',
+                            help=('How the rad, atmcorr and refl values are stored'))
+    run_parser.add_argument('-t', '--atm_temp', type=str, default='',
+                            help=('The path to the atmcorr_regr.py output. Defaults to ' +
+                                  'the temporary spectra values'))
+    run_parser.add_argument('--separate', action='store_true',
+                            help=('Run rad, atmcorr and refl as separate stages instead ' +
+                                  'of in one pass over the raw image'))
+    run_parser.add_argument('--write_rad', action='store_true',
+                            help=('Also write the radiance image when rad, atmcorr and ' +
+                                  'refl run in one pass'))
+    run_parser.add_argument('--write_atmcorr', action='store_true',
+                            help=('Also write the atmospherically corrected image when ' +
+                                  'rad, atmcorr and refl run in one pass'))
+    run_parser.add_argument('-rw', '--raw', action='store_true',
+                            help=('With --separate, hand rad and atmcorr to the next ' +
+                                  'stage as raw memory mapped stores'))
+    run_parser.add_argument('-sg', '--sun_grid', action='store_true',
+                            help=('Use the solar elevation of every pixel instead of ' +
+                                  'MEANSUNEL for the reflectance'))
+    run_parser.add_argument('-l', '--labels', action='store_true',
+                            help=('Classify into a single uint8 label image'))
+    run_parser.add_argument('-r', '--rules', type=str, default=None,
+                            help=('A JSON file of spectral rules to classify with. ' +
+                                  'Implies --labels'))
+    run_parser.add_argument('--write_masks', action='store_true',
+                            help=('With --labels, also write the class masks'))
+    run_parser.add_argument('--write_sumbands', action='store_true',
+                            help=('With --labels, also write the band sum image'))
+    run_parser.add_argument('-f', '--format', choices=['fgb', 'gpkg', 'shp'], default='shp',
+                            help=('The vector format the shp stage writes'))
+    run_parser.add_argument('--fill_holes', action='store_true',
+                            help=('Write only the outlines of the polygons'))
+    run_parser.add_argument('-s', '--simplify', type=float, default=0,
+                            help=('The simplification tolerance of the polygons in pixels'))
+    run_parser.add_argument('-ma', '--min_area', type=float, default=0,
+                            help=('The smallest polygon or hole kept, in pixels'))
+    run_parser.add_argument('--profile-startup', action='store_true',
+                            help=('Print the time spent importing each package on exit'))
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Main function. Runs the command given on the console.
+
+    Parameters:
+    argv - the arguments to read, or None for those of the console
+
+    Return:
+    None
+    """
+
+    args = args_parser(argv)
+
+    # A missing directory or an unknown scene is reported without a
+    # traceback. The errors of a scene are reported by its worker
+    try:
+        failures = run(args.input_dir, args.output_dir, args.stages, args.workers, args.scene,
+                       tile_size=args.tile_size, threads=args.threads, profile=args.profile,
+                       encoding=args.encoding, atm_temp=args.atm_temp, fused=not args.separate,
+                       write_rad=args.write_rad, write_atmcorr=args.write_atmcorr, raw=args.raw,
+                       sun_grid=args.sun_grid, labels=args.labels, rules=args.rules,
+                       write_masks=args.write_masks, write_sumbands=args.write_sumbands,
+                       format=args.format, holes=not args.fill_holes,
+                       simplify=args.simplify, min_area=args.min_area)
+    except (IOError, ValueError) as error:
+        sys.exit('landcover: ' + str(error))
+    if failures:
+        sys.exit(1)
+
+
+# If the module was directly called, run the command
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+"""
+Builds the land cover workflow of a directory of scenes as an ensemble of
+pipelines for RADICAL-EnTK, and runs it on an HPC allocation or locally.
+
+Every scene goes through the rad, atmcorr, refl, class and shp stages, in
+that order, and every stage of a scene is a task running
+landcover run --stages <stage> --scene <scene> with the cores it asks for.
+The scenes are packed onto lanes, as many as fit on the cores of the
+allocation side by side. A lane is an EnTK pipeline running the stages of
+its scenes one after the other, so the lanes keep every core busy while
+each scene's stages still run in order. The scenes are given to the lanes
+from the biggest to the smallest, each to the lane with the least work so
+far, which keeps the lanes finishing at about the same time.
+
+--executor local runs the same tasks with subprocesses on this machine,
+with the lanes running side by side, to try a workflow out without EnTK:
+
+> python landcover_entk.py -ip /path/to/raw -op /path/to/out --cores 8 --executor local
+
+--executor entk submits it to a resource, and needs radical.entk and its
+RabbitMQ and MongoDB settings in the environment:
+
+> python landcover_entk.py -ip /path/to/raw -op /path/to/out --cores 256 \\
+      --resource xsede.bridges --walltime 120 --project abc123 --queue RM
+"""
+
+import argparse
+import os
+import shlex
+import subprocess
+import sys
+import threading
+from collections import namedtuple
+
+# Makes the pipeline of the package importable no matter where the script
+# is called from. Run directly, the script joins its package and imports
+# it relative to itself, just as when the pipeline imports it
+if not __package__:
+    _PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    sys.path.insert(0, os.path.dirname(_PACKAGE_DIR))
+    __package__ = os.path.basename(_PACKAGE_DIR) + '.entk_script'
+from ..pipeline import STAGES, raw_images
+
+# name       - the name of the task, <scene>.<stage>
+# scene      - the name of the raw image the task works on
+# stage      - the stage the task runs, from STAGES
+# executable - the program the task runs
+# arguments  - the list of the arguments of the program
+# cores      - the number of cores the task asks for
+TaskSpec = namedtuple('TaskSpec', ['name', 'scene', 'stage', 'executable', 'arguments',
+                                   'cores'])
+
+
+def args_parser():
+    """
+    Reads in the directories and the allocation from the console
+
+    Parameters:
+    None
+
+    Return:
+    Returns the parsed console arguments
+    """
+
+    parser = argparse.ArgumentParser(description='Runs the land cover stages of a ' +
+                                     'directory of raw images as an EnTK ensemble')
+
+    parser.add_argument('-ip', '--input_dir', type=str, default='./',
+                        help=('The directory with the raw images and their .xml files'))
+    parser.add_argument('-op', '--output_dir', type=str, default='./',
+                        help=('The directory to write every output into'))
+    parser.add_argument('--stages', type=str, default=','.join(STAGES),
+                        help=('The comma separated stages to run. Defaults to all of them'))
+    parser.add_argument('-c', '--cores', type=int, default=1,
+                        help=('The number of cores of the allocation'))
+    parser.add_argument('-th', '--threads', type=int, default=1,
+                        help=('The number of cores every task asks for and works on ' +
+                              'the tiles of its image with'))
+    parser.add_argument('-a', '--run_args', type=str, default='',
+                        help=('More options passed to every landcover run task, e.g. ' +
+                              '"-ts 2048 -pr compact -l"'))
+    parser.add_argument('-x', '--executable', type=str, default='landcover',
+                        help=('The landcover command on the compute nodes, e.g. ' +
+                              '"python -m landcover". Defaults to landcover'))
+    parser.add_argument('--executor', choices=['entk', 'local'], default='local',
+                        help=('Submit the workflow with EnTK or run it on this machine'))
+    parser.add_argument('--resource', type=str, default='local.localhost',
+                        help=('The EnTK resource label of the machine'))
+    parser.add_argument('--walltime', type=int, default=60,
+                        help=('The walltime of the allocation in minutes'))
+    parser.add_argument('--project', type=str, default=None,
+                        help=('The project to charge the allocation to'))
+    parser.add_argument('--queue', type=str, default=None,
+                        help=('The queue to submit the allocation to'))
+    parser.add_argument('--dry_run', action='store_true',
+                        help=('Only print the lanes and their tasks'))
+
+    return parser.parse_args()
+
+
+def scene_cost(input_dir, raw_file):
+    """
+    Estimates the work of a scene. Every stage reads and writes the whole
+    image, so the work grows with the size of the raw image.
+
+    Parameters:
+    input_dir - the directory with the raw image
+    raw_file  - the name of the raw .tif image
+
+    Return:
+    The size of the raw image in bytes
+    """
+
+    return os.path.getsize(os.path.join(input_dir, raw_file))
+
+
+def pack_scenes(costs, lanes):
+    """
+    Spreads scenes over lanes so the lanes have about the same work,
+    giving the scenes from the biggest to the smallest each to the lane
+    with the least work so far.
+
+    Parameters:
+    costs - a dictionary of scene -> the work of the scene
+    lanes - the number of lanes
+
+    Return:
+    A list of the scenes of every lane, with no empty lanes
+    """
+
+    packed = [[] for _ in range(max(1, lanes))]
+    loads = [0] * len(packed)
+    for scene in sorted(costs, key=lambda scene: (-costs[scene], scene)):
+        lane = loads.index(min(loads))
+        packed[lane].append(scene)
+        loads[lane] += costs[scene]
+
+    return [scenes for scenes in packed if scenes]
+
+
+def scene_tasks(input_dir, output_dir, scene, stages, threads=1, run_args=(),
+                executable=('landcover',)):
+    """
+    Makes the tasks running the stages of one scene.
+
+    Parameters:
+    input_dir  - the directory with the raw images and their .xml files
+    output_dir - the directory to write every output into
+    scene      - the name of the raw image
+    stages     - the stages to run, in order
+    threads    - the number of cores every task asks for
+    run_args   - more arguments of landcover run
+    executable - the landcover command split into words
+
+    Return:
+    A list of the TaskSpec of each stage, in order
+    """
+
+    # rad, atmcorr and refl are separate tasks, so they aren't fused
+    return [TaskSpec('{}.{}'.format(scene, stage), scene, stage, executable[0],
+                     list(executable[1:]) +
+                     ['run', '-ip', os.path.abspath(input_dir),
+                      '-op', os.path.abspath(output_dir), '--stages', stage,
+                      '--scene', scene, '--separate', '-th', str(threads)] + list(run_args),
+                     threads)
+            for stage in stages]
+
+
+def build_lanes(input_dir, output_dir, stages=None, cores=1, threads=1, run_args=(),
+                executable=('landcover',)):
+    """
+    Builds the ensemble of a directory of raw images.
+
+    Parameters:
+    input_dir  - the directory with the raw images and their .xml files
+    output_dir - the directory to write every output into
+    stages     - the stages to run, or None for all of STAGES
+    cores      - the number of cores of the allocation
+    threads    - the number of cores every task asks for
+    run_args   - more arguments of landcover run
+    executable - the landcover command split into words
+
+    Return:
+    A list of lanes, each a list of the TaskSpecs it runs in order
+    """
+
+    stages = [stage for stage in STAGES if stages is None or stage in stages]
+    costs = {scene: scene_cost(input_dir, scene) for scene in raw_images(input_dir)}
+
+    return [[task for scene in scenes
+             for task in scene_tasks(input_dir, output_dir, scene, stages, threads, run_args,
+                                     executable)]
+            for scenes in pack_scenes(costs, cores // max(1, threads))]
+
+
+def entk_pipelines(lanes):
+    """
+    Turns the lanes into EnTK pipelines, one stage with a single task for
+    every task of a lane.
+
+    Parameters:
+    lanes - the lanes made by build_lanes
+
+    Return:
+    A set of radical.entk Pipelines
+    """
+
+    from radical.entk import Pipeline, Stage, Task
+
+    pipelines = set()
+    for i, lane in enumerate(lanes):
+        pipeline = Pipeline()
+        pipeline.name = 'lane.{}'.format(i)
+        for spec in lane:
+            task = Task()
+            task.name = spec.name
+            task.executable = spec.executable
+            task.arguments = spec.arguments
+            task.cpu_reqs = {'cpu_processes': 1, 'cpu_process_type': None,
+                             'cpu_threads': spec.cores, 'cpu_thread_type': 'OpenMP'}
+            stage = Stage()
+            stage.name = spec.name
+            stage.add_tasks(task)
+            pipeline.add_stages(stage)
+        pipelines.add(pipeline)
+
+    return pipelines
+
+
+def run_entk(lanes, resource, walltime, cores, project=None, queue=None):
+    """
+    Submits the lanes to a resource with EnTK and waits for them.
+
+    Parameters:
+    lanes    - the lanes made by build_lanes
+    resource - the EnTK resource label of the machine
+    walltime - the walltime of the allocation in minutes
+    cores    - the number of cores of the allocation
+    project  - the project to charge, or None
+    queue    - the queue to submit to, or None
+
+    Return:
+    None
+    """
+
+    from radical.entk import AppManager
+
+    description = {'resource': resource, 'walltime': walltime, 'cpus': cores}
+    if project:
+        description['project'] = project
+    if queue:
+        description['queue'] = queue
+
+    manager = AppManager()
+    manager.resource_desc = description
+    manager.workflow = entk_pipelines(lanes)
+    manager.run()
+
+
+def run_local(lanes):
+    """
+    Runs the lanes on this machine in place of EnTK. The lanes run side by
+    side and the tasks of a lane one after the other, like the pipelines
+    of an EnTK allocation. A lane stops at its first failed task, since
+    the later stages of its scene would fail too.
+
+    Parameters:
+    lanes - the lanes made by build_lanes
+
+    Return:
+    A list of the names of the tasks that failed
+    """
+
+    failures = []
+    total = sum(len(lane) for lane in lanes)
+    done = [0]
+    lock = threading.Lock()
+
+    def run_lane(lane):
+        for spec in lane:
+            result = subprocess.run([spec.executable] + spec.arguments,
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    universal_newlines=True)
+            with lock:
+                done[0] += 1
+                if result.returncode == 0:
+                    print('[{}/{}] {} done'.format(done[0], total, spec.name))
+                else:
+                    failures.append(spec.name)
+                    print('[{}/{}] {} FAILED\n{}'.format(done[0], total, spec.name,
+                                                         result.stdout))
+            if result.returncode != 0:
+                return
+
+    threads = [threading.Thread(target=run_lane, args=(lane,)) for lane in lanes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if failures:
+        print('{} of {} tasks failed: {}'.format(len(failures), total, ', '.join(failures)))
+
+    return failures
+
+
+def main():
+    """
+    Main function. Builds the ensemble of the specified directory and runs
+    it with the chosen executor.
+
+    Parameters:
+    None
+
+    Return:
+    None
+    """
+
+    args = args_parser()
+
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        sys.exit('Unknown stages: ' + ', '.join(unknown))
+
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    lanes = build_lanes(args.input_dir, args.output_dir, stages, args.cores, args.threads,
+                        shlex.split(args.run_args), shlex.split(args.executable))
+    if not lanes:
+        print('There are no raw .tif images in ' + args.input_dir + '!')
+        return
+
+    for i, lane in enumerate(lanes):
+        scenes = sorted(set(spec.scene for spec in lane))
+        print('lane {}: {} scenes, {} tasks of {} cores: {}'.format(
+            i, len(scenes), len(lane), args.threads, ', '.join(scenes)))
+        if args.dry_run:
+            for spec in lane:
+                print('    ' + ' '.join([spec.executable] + spec.arguments))
+
+    if args.dry_run:
+        return
+    if args.executor == 'entk':
+        run_entk(lanes, args.resource, args.walltime, len(lanes) * args.threads,
+                 args.project, args.queue)
+    elif run_local(lanes):
+        sys.exit(1)
+
+
+# If the script was directly called, run the script
+if __name__ == '__main__':
+    main()
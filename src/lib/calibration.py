@@ -0,0 +1,206 @@
+"""
+Calibration values and band math shared by the calibration scripts.
+
+The separate scripts and the fused calibration engine share these
+kernels, so they apply exactly the same band math. The gain, offset and
+ESUN of each sensor come from the registry in coefficients.py.
+"""
+
+import math
+
+import numpy as np
+
+# The order of the bands in a WorldView multispectral image and in its .xml
+BANDS = ['BAND_C', 'BAND_B', 'BAND_G', 'BAND_Y', 'BAND_R', 'BAND_RE',
+         'BAND_N', 'BAND_N2']
+
+
+def avgs_finder(atmotxt_dir, missing_txt):
+    """
+    Finds the average atmospheric correction values for bands 1 to 7.
+    Returns them as a list. Will return the temporary spectra values
+    if the atmcorr_regr.py output file is missing.
+
+    Parameters:
+    atmotxt_dir - the directory of the .txt file with the average
+                  atmospheric correction values
+    missing_txt - a boolean. True if the directory is missing the
+                  atmcorr_regr.py output file, False otherwise
+
+    Return:
+    A list containing the average atmospheric correction values of
+    bands 1 through 7
+    """
+
+    # Initializes an empty list to store the average correction
+    # values
+    averages = []
+
+    if not missing_txt:
+        # Opens the .txt document
+        with open(atmotxt_dir, 'r') as atmo_txt:
+            # Stores each line as its own list inside a larger list
+            # Splitting is done due to the formatting in the file
+            text = [line.strip().replace("\n", "").split(": ")
+                    for line in atmo_txt]
+        # Closes the file
+        atmo_txt.close()
+    else:
+        # Opens the .txt document
+        with open(atmotxt_dir, 'r') as atmo_txt:
+            # Stores each line as its own list inside a larger list
+            # Splitting is done due to the formatting in the file
+            text = [line.strip().replace("\n", "").split()
+                    for line in atmo_txt]
+        # Closes the file
+        atmo_txt.close()
+
+    # Sets a counter variable for reading the last lines.
+    n = -7
+
+    # Variable specifies the last line to be read. The atmcorr_temp.txt
+    # file contains band 8, which is considered to equal 0. The output
+    # of atmcorr_regr.py doesn't have this band.
+    last_line = -1
+    if missing_txt:
+        # Doesn't include the temporary text file's last line
+        last_line = -2
+        # Sets the counter variable to account for the extra line
+        n = -8
+
+    # while loop goes through the last seven lines of the saved
+    # .txt file
+    while n <= last_line:
+        # Appends the averages to the initialized averages list
+        # Row n, column 1 due to the splitting from earlier
+        averages.append(float(text[n][1]))
+
+        # Adds 1 to the counter
+        n += 1
+
+    return averages
+
+
+def band_vector(values):
+    """
+    Turns one value per band into a float32 (bands, 1, 1) array, which
+    NumPy broadcasts over the rows and columns of a block.
+
+    Parameters:
+    values - the value of each band
+
+    Return:
+    The float32 (bands, 1, 1) array
+    """
+
+    return np.asarray(values, dtype=np.float32).reshape(-1, 1, 1)
+
+
+def _output(block, out):
+    # Gives the float32 array a kernel writes into. A new one is only
+    # allocated when the caller didn't pass one
+    if out is None:
+        out = np.empty(block.shape, dtype=np.float32)
+    return out
+
+
+def radiance(dn, gain, offset, abscalfactor, effbandwidth, out=None):
+    """
+    Converts a (bands, rows, cols) block of raw digital numbers to
+    top-of-atmosphere radiance with gain * dn * (abscal / effbw) + offset.
+
+    The bands are converted all at once by broadcasting the per band
+    values over the block, and every step writes into out. No temporary
+    arrays are made, whatever the number of bands.
+
+    Parameters:
+    dn           - the raw block
+    gain         - the gain correction value of each band
+    offset       - the offset correction value of each band
+    abscalfactor - the ABSCALFACTOR of each band
+    effbandwidth - the EFFECTIVEBANDWIDTH of each band
+    out          - a float32 array shaped like dn to write into. It may be
+                   dn itself if dn was read as float32. Allocated if None
+
+    Return:
+    The float32 radiance block, which is out if it was given
+    """
+
+    out = _output(dn, out)
+    scale = band_vector(abscalfactor) / band_vector(effbandwidth)
+
+    np.multiply(band_vector(gain), dn, out=out)
+    np.multiply(out, scale, out=out)
+    np.add(out, band_vector(offset), out=out)
+
+    return out
+
+
+def atmcorr(rad, averages, out=None):
+    """
+    Atmospherically corrects a (bands, rows, cols) radiance block by
+    subtracting the average correction value of bands 1 through 7.
+    Band 8 is left as it is.
+
+    Parameters:
+    rad      - the radiance block
+    averages - a list holding the average atmospheric correction values
+               of bands 1 through 7
+    out      - a float32 array shaped like rad to write into. It may be
+               rad itself. Allocated if None
+
+    Return:
+    The float32 corrected block, which is out if it was given
+    """
+
+    out = _output(rad, out)
+    np.subtract(rad, band_vector(list(averages) + [0]), out=out)
+
+    return out
+
+
+def reflectance_factor(dist, esun, meansunel):
+    """
+    Finds the factor turning the radiance of each band into reflectance,
+    pi * d^2 / (ESUN * sin(sun elevation)).
+
+    Parameters:
+    dist      - the Earth-Sun distance in AU
+    esun      - the solar exoatmospheric irradiance of each band
+    meansunel - the mean sun elevation of the image in degrees
+
+    Return:
+    The float32 (bands, 1, 1) factors
+    """
+
+    return band_vector(math.pi * (dist ** 2) /
+                       (np.float64(esun) * math.sin(math.radians(meansunel))))
+
+
+def reflectance(rad, dist, esun, meansunel, out=None, sun_scale=None):
+    """
+    Converts a (bands, rows, cols) radiance block to top-of-atmosphere
+    reflectance with pi * d^2 / (ESUN * sin(sun elevation)). The sun
+    elevation is meansunel, unless sun_scale corrects it for every pixel.
+
+    Parameters:
+    rad       - the radiance or atmospherically corrected block
+    dist      - the Earth-Sun distance in AU
+    esun      - the solar exoatmospheric irradiance of each band
+    meansunel - the mean sun elevation of the image in degrees
+    out       - a float32 array shaped like rad to write into. It may be
+                rad itself. Allocated if None
+    sun_scale - a float32 (rows, cols) array of sin(meansunel) divided by
+                the sine of the sun elevation at every pixel, as made by
+                solar.upsample, or None
+
+    Return:
+    The float32 reflectance block, which is out if it was given
+    """
+
+    out = _output(rad, out)
+    np.multiply(rad, reflectance_factor(dist, esun, meansunel), out=out)
+    if sun_scale is not None:
+        np.multiply(out, sun_scale, out=out)
+
+    return out
@@ -0,0 +1,129 @@
+"""
+The band-sum land cover classification shared by class.py and the fused
+calibration engine.
+
+The classes can be written either as one int32 mask image per class, or
+all together as a single uint8 label image with a color table.
+"""
+
+import numpy as np
+
+# The names of the class masks in the order class.py writes them. Each
+# mask is written to an image ending with _class_<name>.tif
+CLASSES = ['snow', 'water', 'geology']
+
+# The value of each class in a label image. Pixels with a band sum of 0
+# or less (or no data) belong to no class and get NODATA_LABEL
+NODATA_LABEL = 0
+LABELS = {'water': 1, 'geology': 2, 'snow': 3}
+
+# The RGBA color of each label in the color table of a label image
+COLORMAP = {NODATA_LABEL: (0, 0, 0, 0),
+            LABELS['water']: (31, 120, 180, 255),
+            LABELS['geology']: (166, 97, 26, 255),
+            LABELS['snow']: (240, 248, 255, 255)}
+
+
+def sum_bands(refl):
+    """
+    Sums the bands of a (bands, rows, cols) reflectance block.
+
+    Parameters:
+    refl - the reflectance block
+
+    Return:
+    A float32 (1, rows, cols) block holding the sum of all of the bands
+    """
+
+    return refl.sum(axis=0, dtype=np.float32, keepdims=True)
+
+
+def class_masks(summed):
+    """
+    Classifies pixels by passing a condition over the band sum and
+    outputs a mask with 1 values where true and 0 values where false
+    for every class.
+
+    Parameters:
+    summed - the band sum block made by sum_bands
+
+    Return:
+    A dictionary holding the int32 mask of every class in CLASSES
+    """
+
+    return {'snow': np.int32(np.where(summed >= 3, 1, 0)),
+            'water': np.int32(np.where((summed > 0) & (summed <= 1), 1, 0)),
+            'geology': np.int32(np.where((summed > 1) & (summed < 3), 1, 0))}
+
+
+def class_labels(summed):
+    """
+    Classifies pixels by their band sum into a single label block, using
+    the same conditions as class_masks. Later classes overwrite earlier
+    ones in place, so no block other than the labels is made per class.
+
+    Parameters:
+    summed - the band sum block made by sum_bands
+
+    Return:
+    A uint8 block of the same shape holding the LABELS of every pixel
+    """
+
+    labels = np.zeros(summed.shape, dtype=np.uint8)
+    labels[summed > 0] = LABELS['water']
+    labels[summed > 1] = LABELS['geology']
+    labels[summed >= 3] = LABELS['snow']
+
+    return labels
+
+
+def label_meta(meta):
+    """
+    Gives the metadata of a label image made from a reflectance image.
+
+    Parameters:
+    meta - the rasterio metadata of the reflectance image
+
+    Return:
+    A new dict of the metadata of a single band uint8 image
+    """
+
+    return dict(meta, count=1, dtype='uint8', nodata=NODATA_LABEL)
+
+
+def write_colormap(dst, colormap=None, names=None):
+    """
+    Writes the color table of the labels into an open label image, along
+    with the name of every label as a LABEL_<label> tag.
+
+    Parameters:
+    dst      - the label image being written
+    colormap - a dictionary of label -> RGBA color, or None for COLORMAP
+    names    - a dictionary of class name -> label, or None for LABELS
+
+    Return:
+    None
+    """
+
+    colormap = COLORMAP if colormap is None else colormap
+    names = LABELS if names is None else names
+    dst.write_colormap(1, colormap)
+    dst.update_tags(**{'LABEL_{}'.format(label): name for name, label in names.items()})
+
+
+def label_names(src):
+    """
+    Reads the names of the labels of a label image. Images written before
+    the names were stored get the names of LABELS.
+
+    Parameters:
+    src - the open label image
+
+    Return:
+    A dictionary of label -> class name
+    """
+
+    names = {int(key[len('LABEL_'):]): name for key, name in src.tags().items()
+             if key.startswith('LABEL_') and key[len('LABEL_'):].isdigit()}
+
+    return names or {label: name for name, label in LABELS.items()}
@@ -0,0 +1,190 @@
+"""
+The registry of the calibration coefficients of every sensor.
+
+The gain, offset and ESUN of each band used to be Python lists in
+calibration.py, looked up by SATID, so a scene of any other sensor failed
+with a KeyError deep in the calibration. They are now kept in
+coefficients.json, which lists the versions of the coefficients of each
+sensor:
+
+{"WV02": [{"version": "v1", "effective": "2009-10-08",
+           "source": "Where the values come from",
+           "bands": ["BAND_C", ..., "BAND_N2"],
+           "gain": [...], "offset": [...], "esun": [...]}]}
+
+A version applies to the images taken on or after its effective date, up
+to the effective date of the next one, so a new calibration release is
+added as a new version without changing the outputs of older images.
+bands gives the order of the values, which must be the order of the bands
+of the image in calibration.BANDS, so a short or reordered entry is
+rejected rather than calibrating the wrong bands. Adding a sensor, e.g.
+WV04 or GE01, is a matter of adding its entry to the file.
+
+The file is read and checked once per process. Every version holds its
+values as read-only float64 NumPy vectors, shared by all of the scenes and
+threads that use it.
+"""
+
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from .calibration import BANDS
+
+# The coefficients shipped with the scripts
+DEFAULT_COEFFICIENTS = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                    'coefficients.json')
+
+# The tag the version of the coefficients is recorded under in the images
+COEFFICIENTS_TAG = 'CALIBRATION_COEFFICIENTS'
+
+# satid     - the SATID of the sensor, e.g. WV02
+# version   - the name of the version, recorded with the outputs
+# effective - the first date, as YYYY-MM-DD, of the images it applies to
+# bands     - the names of the bands in the .xml, in the order of the image
+# gain      - a float64 array of the gain correction value of each band
+# offset    - a float64 array of the offset correction value of each band
+# esun      - a float64 array of the solar exoatmospheric irradiance of
+#             each band
+Coefficients = namedtuple('Coefficients', ['satid', 'version', 'effective', 'bands',
+                                           'gain', 'offset', 'esun'])
+
+# The registries already read by this process, keyed by path
+_registries = {}
+
+
+def _vector(values, satid, version, name, bands):
+    # A read-only float64 vector of one value per band
+    vector = np.array(values, dtype=np.float64)
+    if vector.shape != (len(bands),):
+        raise ValueError('The {} of {} {} has {} values for {} bands'.format(
+            name, satid, version, vector.size, len(bands)))
+    vector.setflags(write=False)
+    return vector
+
+
+def load_registry(path=DEFAULT_COEFFICIENTS):
+    """
+    Reads a coefficient file, or gets it from the registries already read
+    by this process.
+
+    Parameters:
+    path - the path of the coefficient file
+
+    Return:
+    A dictionary of SATID -> tuple of its Coefficients, oldest first
+    """
+
+    if path in _registries:
+        return _registries[path]
+
+    with open(path, 'r') as f:
+        config = json.load(f)
+
+    registry = {}
+    for satid, versions in config.items():
+        entries = []
+        for entry in versions:
+            bands = list(entry['bands'])
+            if bands != BANDS:
+                raise ValueError(('The bands of {} {} are {}, not the bands of the image ' +
+                                  '{} in that order').format(satid, entry['version'],
+                                                             ', '.join(bands), ', '.join(BANDS)))
+            entries.append(Coefficients(
+                satid=satid,
+                version=entry['version'],
+                effective=entry['effective'],
+                bands=bands,
+                gain=_vector(entry['gain'], satid, entry['version'], 'gain', bands),
+                offset=_vector(entry['offset'], satid, entry['version'], 'offset', bands),
+                esun=_vector(entry['esun'], satid, entry['version'], 'esun', bands)))
+        entries.sort(key=lambda coefficients: coefficients.effective)
+        if len(set(c.effective for c in entries)) != len(entries):
+            raise ValueError('Two versions of the coefficients of ' + satid +
+                             ' have the same effective date')
+        registry[satid] = tuple(entries)
+
+    _registries[path] = registry
+    return registry
+
+
+def sensor_coefficients(satid, tlctime=None, path=DEFAULT_COEFFICIENTS):
+    """
+    Finds the coefficients of a sensor that apply to an image.
+
+    Parameters:
+    satid   - the SATID of the image, e.g. WV02
+    tlctime - the TLCTIME of the image, or None for the latest version
+    path    - the path of the coefficient file
+
+    Return:
+    The Coefficients of the image
+    """
+
+    registry = load_registry(path)
+    if satid not in registry:
+        raise ValueError(('There are no calibration coefficients for SATID {}. The known ' +
+                          'sensors are {}; add it to {}').format(
+                              satid, ', '.join(sorted(registry)), path))
+
+    versions = registry[satid]
+    if tlctime is None:
+        return versions[-1]
+
+    # ISO dates and timestamps are in the order of their strings
+    date = str(tlctime)[:10]
+    applicable = [coefficients for coefficients in versions if coefficients.effective <= date]
+    if not applicable:
+        raise ValueError(('The calibration coefficients of {} start on {}, after the ' +
+                          'image was taken at {}').format(satid, versions[0].effective,
+                                                          tlctime))
+
+    return applicable[-1]
+
+
+def scene_coefficients(scene, path=DEFAULT_COEFFICIENTS):
+    """
+    Finds the coefficients that apply to a scene.
+
+    Parameters:
+    scene - the SceneMetadata of the scene
+    path  - the path of the coefficient file
+
+    Return:
+    The Coefficients of the scene
+    """
+
+    return sensor_coefficients(scene.satid, scene.tlctime, path)
+
+
+def coefficients_name(coefficients):
+    """
+    Names a version of the coefficients for the manifest and the images,
+    e.g. WV02 v1.
+
+    Parameters:
+    coefficients - the Coefficients
+
+    Return:
+    The name as a string
+    """
+
+    return coefficients.satid + ' ' + coefficients.version
+
+
+def tag_coefficients(dst, coefficients):
+    """
+    Records the version of the coefficients an image was made with in its
+    metadata.
+
+    Parameters:
+    dst          - the open image or raw store being written
+    coefficients - the Coefficients
+
+    Return:
+    None
+    """
+
+    dst.update_tags(**{COEFFICIENTS_TAG: coefficients_name(coefficients)})
@@ -0,0 +1,159 @@
+"""
+Compact encodings of the radiance, atmcorr and reflectance images.
+
+The images are float32 by default. Two encodings halve their size:
+
+float16 - the values are stored as 16 bit floats (float32 with NBITS=16
+          in GDAL), keeping about 3 significant digits
+uint16  - the values are stored as integers with a scale and offset,
+          value = code * scale + offset. The scale and offset of each
+          product are in SCALING, and are written into the GeoTIFF
+          metadata of every band
+
+Readers don't need to know how an image was encoded. GDAL expands 16 bit
+floats to float32 by itself, and read_decoded and tiling.map_windows
+apply the scale and offset stored in an image when reading it as floats.
+"""
+
+import numpy as np
+
+from .calibration import band_vector
+
+ENCODINGS = ['float32', 'float16', 'uint16']
+
+# The (scale, offset) of the uint16 encoding of each product. Radiance
+# covers -100 to 555 and reflectance -0.5 to 2.77, which leaves room for
+# negative values after the atmospheric correction
+SCALING = {'rad': (0.01, -100.0),
+           'atmcorr': (0.01, -100.0),
+           'refl': (5e-05, -0.5)}
+
+# The code of uint16 pixels without data. Encoded values stop below it
+UINT16_NODATA = 65535
+
+
+def encoding_meta(meta, encoding='float32'):
+    """
+    Changes the metadata an image is created with to store an encoding.
+
+    Parameters:
+    meta     - the rasterio metadata of a float32 image
+    encoding - one of ENCODINGS
+
+    Return:
+    A new dict of the metadata
+    """
+
+    meta = dict(meta)
+    if encoding == 'float16':
+        meta.update({'dtype': 'float32', 'nbits': 16})
+    elif encoding == 'uint16':
+        meta.update({'dtype': 'uint16', 'nodata': UINT16_NODATA})
+
+    return meta
+
+
+def set_scaling(dst, encoding, product):
+    """
+    Records the encoding of an image in its metadata, along with the scale
+    and offset of every band when it is uint16.
+
+    Parameters:
+    dst      - the open image being written
+    encoding - one of ENCODINGS
+    product  - the product in the image, a key of SCALING
+
+    Return:
+    None
+    """
+
+    if encoding == 'float32':
+        return
+
+    if encoding == 'uint16':
+        scale, offset = SCALING[product]
+        dst.scales = [scale] * dst.count
+        dst.offsets = [offset] * dst.count
+
+    dst.update_tags(ENCODING=encoding)
+
+
+def encode(block, encoding, product):
+    """
+    Encodes a float32 block to be written into an image of an encoding.
+    The block is overwritten when it is encoded as uint16.
+
+    Parameters:
+    block    - the float32 block of the product
+    encoding - one of ENCODINGS
+    product  - the product in the block, a key of SCALING
+
+    Return:
+    The block to write
+    """
+
+    if encoding != 'uint16':
+        return block
+
+    scale, offset = SCALING[product]
+    np.subtract(block, np.float32(offset), out=block)
+    np.divide(block, np.float32(scale), out=block)
+    np.rint(block, out=block)
+    np.clip(block, 0, UINT16_NODATA - 1, out=block)
+
+    return block.astype(np.uint16)
+
+
+def decode(block, src, indexes=None):
+    """
+    Applies the scale and offset of the bands of an image to a float block
+    read from it, in place. Images without them are left as they are.
+
+    Parameters:
+    block   - the float32 block read from src
+    src     - the open image
+    indexes - the band index or list of band indexes the block was read
+              from, as passed to src.read. None for all of the bands
+
+    Return:
+    The decoded block
+    """
+
+    if indexes is None:
+        indexes = src.indexes
+    bands = [indexes] if isinstance(indexes, int) else list(indexes)
+
+    scales = [src.scales[i - 1] for i in bands]
+    offsets = [src.offsets[i - 1] for i in bands]
+    if all(scale == 1 for scale in scales) and all(offset == 0 for offset in offsets):
+        return block
+
+    # A single band read as a 2D array gets its values as scalars
+    if block.ndim == 2:
+        scales, offsets = np.float32(scales[0]), np.float32(offsets[0])
+    else:
+        scales, offsets = band_vector(scales), band_vector(offsets)
+
+    np.multiply(block, scales, out=block)
+    np.add(block, offsets, out=block)
+
+    return block
+
+
+def read_decoded(src, indexes=None, window=None):
+    """
+    Reads bands of an image as float32 with their real values, whatever
+    encoding the image was written with.
+
+    Parameters:
+    src     - the open image
+    indexes - the band index or list of band indexes to read, as passed to
+              src.read. None for all of the bands
+    window  - the window to read, or None for the whole image
+
+    Return:
+    The float32 block
+    """
+
+    block = src.read(indexes, window=window, out_dtype='float32')
+    return decode(block, src, indexes)
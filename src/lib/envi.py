@@ -0,0 +1,127 @@
+"""
+Reads the ENVI ASCII plot files the atmospheric spectra are collected in.
+
+A plot file starts with a title line and one "Column N: ..." line per
+column. Column 1 is the wavelength and every other column is the spectrum
+of one pixel, labelled with its position as "X:663 Y:3864~~1". The last 8
+lines hold the value of each band in every column.
+
+read_plot parses the numbers with NumPy in one go and keeps the pixel
+positions of the header. The result is saved as a .npz next to the .txt,
+so later runs of atmcorr_regr.py load the array instead of parsing the
+text again. The .npz is redone whenever the .txt changes.
+"""
+
+import os
+import re
+from collections import namedtuple
+
+import numpy as np
+
+# Bump when the fields of PlotFile change so old .npz files are ignored
+CACHE_VERSION = 1
+
+# The number of band lines at the bottom of a plot file
+BAND_COUNT = 8
+
+# Finds the pixel position in a "Column N: X:663 Y:3864~~1" header line
+_POSITION = re.compile(r'X:\s*(-?\d+)\s+Y:\s*(-?\d+)')
+
+# wavelength - a float array of the wavelength of each band
+# spectra    - a (bands, pixels) float array of the spectrum of each pixel
+# x, y       - int arrays of the pixel position of each spectrum, -1 when
+#              the header doesn't give one
+PlotFile = namedtuple('PlotFile', ['wavelength', 'spectra', 'x', 'y'])
+
+
+def cache_path(txt_path):
+    """
+    Finds the path of the .npz a plot file is cached in.
+
+    Parameters:
+    txt_path - the path of the plot file
+
+    Return:
+    The path of the .npz next to the plot file
+    """
+
+    return os.path.splitext(txt_path)[0] + '.npz'
+
+
+def parse_plot(txt_path):
+    """
+    Parses an ENVI ASCII plot file.
+
+    Parameters:
+    txt_path - the path of the plot file
+
+    Return:
+    The PlotFile of the file
+    """
+
+    with open(txt_path, 'r') as txt:
+        lines = txt.read().splitlines()
+
+    # The pixel columns are described by the "Column" lines of the header,
+    # skipping column 1 which is the wavelength
+    headers = [line for line in lines if line.startswith('Column')][1:]
+    positions = [_POSITION.search(header) for header in headers]
+    x = np.array([int(pos.group(1)) if pos else -1 for pos in positions], dtype=np.int64)
+    y = np.array([int(pos.group(2)) if pos else -1 for pos in positions], dtype=np.int64)
+
+    # The numbers are split on any run of whitespace, so the width of the
+    # columns doesn't matter
+    band_lines = [line for line in lines if line.strip()][-BAND_COUNT:]
+    values = np.array(' '.join(band_lines).split(), dtype=np.float64)
+    values = values.reshape(BAND_COUNT, -1)
+
+    if headers and values.shape[1] != len(headers) + 1:
+        raise ValueError('{} has {} columns of data but {} in its header'.format(
+            txt_path, values.shape[1], len(headers) + 1))
+
+    # Files without a header still get a position for every spectrum
+    if not headers:
+        x = y = np.full(values.shape[1] - 1, -1, dtype=np.int64)
+
+    return PlotFile(wavelength=values[:, 0], spectra=values[:, 1:], x=x, y=y)
+
+
+def read_plot(txt_path):
+    """
+    Gets the PlotFile of a plot file, parsing the text only if it has no
+    .npz yet or changed since the .npz was saved.
+
+    Parameters:
+    txt_path - the path of the plot file
+
+    Return:
+    The PlotFile of the file
+    """
+
+    stat = os.stat(txt_path)
+    # The .txt is only taken as unchanged if its size and time match
+    stamp = np.array([CACHE_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+    npz_path = cache_path(txt_path)
+
+    try:
+        with np.load(npz_path) as cached:
+            if np.array_equal(cached['stamp'], stamp):
+                return PlotFile(**{field: cached[field] for field in PlotFile._fields})
+    except (OSError, KeyError, ValueError):
+        pass
+
+    plot = parse_plot(txt_path)
+
+    # Written under a temporary name and renamed so concurrent runs never
+    # load a half written file. A folder that can't be written to only
+    # costs a parse next time
+    temp_path = '{}.{}.tmp'.format(npz_path, os.getpid())
+    try:
+        with open(temp_path, 'wb') as cached:
+            np.savez(cached, stamp=stamp, **plot._asdict())
+        os.replace(temp_path, npz_path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    return plot
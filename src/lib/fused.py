@@ -0,0 +1,174 @@
+"""
+Single pass calibration engine.
+
+Goes from raw digital numbers to radiance, atmospherically corrected
+radiance and reflectance (and optionally the class masks) while reading
+every tile of the raw image only once. The separate scripts write and
+read back a full float32 image between each of these steps; here the
+intermediate images are only written if they are asked for.
+"""
+
+import numpy as np
+
+from .calibration import radiance, atmcorr, reflectance
+from .classify import CLASSES, sum_bands, class_masks, class_labels, label_meta, write_colormap
+from .coefficients import scene_coefficients, tag_coefficients
+from .encoding import encoding_meta, set_scaling, encode
+from .metadata import read_metadata
+from .nodata import valid_mask, write_masked
+from .profiles import profile_meta, finish_output
+from .solar import earth_sun_distance, sun_grid as make_sun_grid, upsample
+from .tiling import tile_windows, map_windows
+
+# The images the engine can write. Each one is named like the output of
+# the script that normally makes it, e.g. rad -> image_rad.tif
+PRODUCTS = (['rad', 'atmcorr', 'refl', 'sumbands'] + ['class_' + name for name in CLASSES] +
+            ['labels'])
+
+
+def product_names(raw_file):
+    """
+    Names the images made from a raw image the same way the separate
+    scripts name them.
+
+    Parameters:
+    raw_file - the name of the raw .tif image
+
+    Return:
+    A dictionary of product -> file name for every product in PRODUCTS
+    """
+
+    refl = raw_file.replace('.tif', '_rad_atmcorr_refl.tif')
+    names = {'rad': raw_file.replace('.tif', '_rad.tif'),
+             'atmcorr': raw_file.replace('.tif', '_rad_atmcorr.tif'),
+             'refl': refl,
+             'sumbands': refl.replace('.tif', '_sumbands.tif')}
+    for name in CLASSES:
+        names['class_' + name] = refl.replace('.tif', '_class_' + name + '.tif')
+    names['labels'] = refl.replace('.tif', '_class_labels.tif')
+
+    return names
+
+
+def calibrate(raw_path, xml_path, averages, outputs, tile_size=0, threads=1, profile=None,
+              encoding='float32', sun_grid=False):
+    """
+    Calibrates a raw image in a single pass over its tiles.
+
+    Parameters:
+    raw_path  - the path of the raw .tif image
+    xml_path  - the path of the .xml file of the raw image
+    averages  - a list holding the average atmospheric correction values
+                of bands 1 through 7
+    outputs   - a dictionary of product -> path of the images to write.
+                Products that are left out are never written
+    tile_size - the tile edge length in pixels. 0 uses the internal
+                blocks of the raw image
+    threads   - the number of threads reading and calibrating tiles
+    profile   - the name of the output profile, or None
+    encoding  - how the rad, atmcorr and refl images are stored, one of
+                encoding.ENCODINGS. The band sum and masks aren't encoded
+    sun_grid  - True to correct the reflectance of every pixel for the
+                solar elevation at its place and time instead of using
+                MEANSUNEL
+
+    Return:
+    None
+    """
+
+    # Imported here so calibrate.py only loads GDAL once it has an image
+    # to calibrate
+    import rasterio
+
+    # collect image and band metadata
+    scene = read_metadata(xml_path)
+    coefficients = scene_coefficients(scene)
+    dist = earth_sun_distance(scene.tlctime)
+    meansunel = np.float32(scene.meansunel)
+
+    # Asks for the band sum whenever a class mask has to be made
+    classify = any(product.startswith('class_') for product in outputs)
+
+    with rasterio.open(raw_path) as src:
+        meta = src.meta
+        meta.update({"driver": "GTiff",
+                     "compress": "LZW",
+                     "count": 8,
+                     "dtype": "float32",
+                     "bigtiff": "YES",
+                     "nodata": 255})
+        # The band sum and the masks are single band images
+        class_meta = profile_meta(dict(meta, count=1), profile)
+        mask_meta = profile_meta(dict(meta, count=1, dtype='int32'), profile)
+        labels_meta = profile_meta(label_meta(meta), profile)
+        meta = profile_meta(encoding_meta(meta, encoding), profile)
+
+        # The coarse grid of the solar elevation over the image,
+        # interpolated to the pixels of every tile
+        grid = make_sun_grid(scene, src.width, src.height) if sun_grid else None
+
+        dsts = {}
+        try:
+            # Creates every requested image to be written into
+            for product, path in outputs.items():
+                if product == 'sumbands':
+                    dsts[product] = rasterio.open(path, 'w', **class_meta)
+                elif product.startswith('class_'):
+                    dsts[product] = rasterio.open(path, 'w', **mask_meta)
+                elif product == 'labels':
+                    dsts[product] = rasterio.open(path, 'w', **labels_meta)
+                    write_colormap(dsts[product])
+                else:
+                    dsts[product] = rasterio.open(path, 'w', **meta)
+                    set_scaling(dsts[product], encoding, product)
+                    tag_coefficients(dsts[product], coefficients)
+
+            def compute(block, window):
+                # Calibrates one tile, keeping every product to be written.
+                # The tile was read as float32 and each step overwrites the
+                # one before it, unless that one still has to be written.
+                # A tile of only collar isn't calibrated at all
+                valid = valid_mask(block)
+                if not valid.any():
+                    return None
+                tile = {}
+                tile['rad'] = radiance(block, coefficients.gain, coefficients.offset,
+                                       scene.abscalfactor, scene.effbandwidth, out=block)
+                tile['atmcorr'] = atmcorr(tile['rad'], averages,
+                                          out=None if 'rad' in outputs else tile['rad'])
+                tile['refl'] = reflectance(tile['atmcorr'], dist, coefficients.esun, meansunel,
+                                           out=None if 'atmcorr' in outputs else tile['atmcorr'],
+                                           sun_scale=None if grid is None else
+                                           upsample(grid, window))
+                if classify or 'sumbands' in outputs or 'labels' in outputs:
+                    tile['sumbands'] = sum_bands(tile['refl'])
+                    if 'labels' in outputs:
+                        tile['labels'] = class_labels(tile['sumbands'])
+                    if classify:
+                        for name, mask in class_masks(tile['sumbands']).items():
+                            tile['class_' + name] = mask
+                # Only hands back the products that are written, encoded
+                # once nothing else is computed from them
+                return {product: encode(tile[product], encoding, product)
+                        if product in ('rad', 'atmcorr', 'refl') else tile[product]
+                        for product in outputs}, valid
+
+            # The tiles are read and calibrated on a pool of threads while
+            # this thread writes them in order, each with the valid-data
+            # mask. The invalid pixels of the class masks are 0, and the
+            # other images get their nodata value
+            for window, result in map_windows(src, tile_windows(src, tile_size),
+                                              compute, threads, out_dtype='float32',
+                                              pass_window=True):
+                if result is None:
+                    continue
+                tile, valid = result
+                for product, data in tile.items():
+                    write_masked(dsts[product], data, valid, window,
+                                 0 if product.startswith('class_') else None)
+        finally:
+            for dst in dsts.values():
+                dst.close()
+
+    for path in outputs.values():
+        finish_output(path, profile)
@@ -0,0 +1,204 @@
+"""
+A record of how every product of a directory was made, so a stage only
+reruns when something it depends on changed.
+
+The stages used to skip an image whenever its output file existed, which
+took a file left behind by a killed job as done and never noticed new
+calibration coefficients or a new atmcorr_temp.txt. Now every stage
+records in the manifest of its output directory, a SQLite database named
+MANIFEST_NAME, what went into each product:
+
+inputs  - the size and modification time of every input file, and the
+          SHA-1 of the ones up to HASH_LIMIT bytes
+params  - the options that change the output, e.g. the encoding
+code    - the SHA-1 of the script and the lib modules making the product
+outputs - the size and modification time of every output file
+
+A product is current when all of its outputs are as recorded and none of
+its inputs, options or code changed. An input whose time changed but
+whose hash didn't, e.g. a copied .xml, doesn't count as a change. Since
+the inputs of a stage are the outputs of the one before it, a rebuilt
+rad.tif makes its atmcorr.tif rebuild and so on, like make. An output
+that exists but was never recorded, or changed since, is made again.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+# The name of the manifest database in each output directory
+MANIFEST_NAME = '.landcover_manifest.sqlite'
+
+# Inputs up to this size are hashed. Bigger ones, such as the images, are
+# only compared by their size and modification time
+HASH_LIMIT = 64 * 1024 * 1024
+
+# The directory of the lib modules
+LIB_DIR = os.path.dirname(os.path.realpath(__file__))
+
+# The code versions already worked out by this process
+_code_versions = {}
+
+
+def file_hash(path):
+    """
+    Hashes the content of a file.
+
+    Parameters:
+    path - the path of the file
+
+    Return:
+    The SHA-1 of the file as a hex string
+    """
+
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def code_version(script, *modules):
+    """
+    Works out the version of the code making a product from its source.
+
+    Parameters:
+    script  - the path of the stage script, i.e. its __file__
+    modules - the names of the lib modules the stage uses, e.g.
+              'calibration'
+
+    Return:
+    The SHA-1 of the sources as a hex string
+    """
+
+    paths = [os.path.realpath(script)] + [os.path.join(LIB_DIR, name + '.py')
+                                          for name in sorted(modules)]
+    key = tuple(paths)
+    if key not in _code_versions:
+        digest = hashlib.sha1()
+        for path in paths:
+            digest.update(file_hash(path).encode('ascii'))
+        _code_versions[key] = digest.hexdigest()
+
+    return _code_versions[key]
+
+
+def _stamp(path):
+    # The size and modification time of a file
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _fingerprint(path):
+    # The stamp of an input and its hash if it is small enough
+    stamp = _stamp(path)
+    return stamp + [file_hash(path) if stamp[0] <= HASH_LIMIT else None]
+
+
+def _unchanged(path, recorded):
+    # Compares an input with its recorded fingerprint, hashing it only if
+    # its stamp changed
+    if not os.path.isfile(path):
+        return False
+    if _stamp(path) == recorded[:2]:
+        return True
+    return recorded[2] is not None and file_hash(path) == recorded[2]
+
+
+def _connect(folder):
+    # Opens the manifest of a directory. The timeout lets the workers of a
+    # run wait for each other's writes
+    connection = sqlite3.connect(os.path.join(folder, MANIFEST_NAME), timeout=60)
+    connection.execute('CREATE TABLE IF NOT EXISTS products ('
+                       'product TEXT PRIMARY KEY, stage TEXT, outputs TEXT, inputs TEXT, '
+                       'params TEXT, code TEXT, recorded REAL)')
+    return connection
+
+
+def _key(outputs):
+    # A product is recorded under its first output, relative to the
+    # directory of the manifest
+    folder, name = os.path.split(os.path.abspath(outputs[0]))
+    return folder, name
+
+
+def is_current(outputs, inputs, params, code):
+    """
+    Sees if a product is complete and up to date.
+
+    Parameters:
+    outputs - the paths of the output files of the product, all in one
+              directory. The first one names the product
+    inputs  - the paths of the input files
+    params  - a JSON serializable dict of the options changing the output
+    code    - the code_version of the stage
+
+    Return:
+    True if the product doesn't need to be made again
+    """
+
+    folder, product = _key(outputs)
+    if not os.path.isfile(os.path.join(folder, MANIFEST_NAME)):
+        return False
+
+    connection = _connect(folder)
+    try:
+        row = connection.execute('SELECT outputs, inputs, params, code FROM products '
+                                 'WHERE product = ?', (product,)).fetchone()
+    finally:
+        connection.close()
+    if row is None:
+        return False
+
+    recorded_outputs, recorded_inputs = json.loads(row[0]), json.loads(row[1])
+    if row[2] != json.dumps(params, sort_keys=True) or row[3] != code:
+        return False
+
+    # Outputs missing, changed or never recorded are made again
+    names = [os.path.basename(path) for path in outputs]
+    if sorted(names) != sorted(recorded_outputs):
+        return False
+    for name in names:
+        path = os.path.join(folder, name)
+        if not os.path.isfile(path) or _stamp(path) != recorded_outputs[name]:
+            return False
+
+    paths = [os.path.abspath(path) for path in inputs]
+    if sorted(paths) != sorted(recorded_inputs):
+        return False
+
+    return all(_unchanged(path, recorded_inputs[path]) for path in paths)
+
+
+def record(stage, outputs, inputs, params, code):
+    """
+    Records a product once all of its outputs are completely written.
+
+    Parameters:
+    stage   - the name of the stage making the product, e.g. rad
+    outputs - the paths of the output files of the product, all in one
+              directory. The first one names the product
+    inputs  - the paths of the input files
+    params  - a JSON serializable dict of the options changing the output
+    code    - the code_version of the stage
+
+    Return:
+    None
+    """
+
+    folder, product = _key(outputs)
+    row = (product, stage,
+           json.dumps({os.path.basename(path): _stamp(path) for path in outputs}),
+           json.dumps({os.path.abspath(path): _fingerprint(path) for path in inputs}),
+           json.dumps(params, sort_keys=True), code, time.time())
+
+    connection = _connect(folder)
+    try:
+        with connection:
+            connection.execute('INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               row)
+    finally:
+        connection.close()
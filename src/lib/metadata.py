@@ -0,0 +1,181 @@
+"""
+Reads the DigitalGlobe .xml metadata of a scene once.
+
+Every stage used to parse the same .xml again and reach into it by
+position (root[1][2].find('IMAGE')). read_metadata finds the elements by
+name instead and returns the values the stages need as a small record.
+Records are memoized in the process and on disk, keyed by the path and
+modification time of the .xml, so later stages and reruns don't parse the
+.xml at all. The disk cache lives in $LANDCOVER_CACHE, or
+~/.cache/landcover if it isn't set.
+"""
+
+import hashlib
+import os
+import pickle
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+import numpy as np
+
+from .calibration import BANDS
+
+# Bump when the fields of SceneMetadata change so old cache files are ignored
+CACHE_VERSION = 2
+
+# The corners of the image in the .xml, clockwise from the upper left
+CORNERS = ['UL', 'UR', 'LR', 'LL']
+
+# satid        - the SATID of the image, e.g. WV02
+# tlctime      - the TLCTIME string of the image
+# meansunel    - the MEANSUNEL of the image in degrees, as a float
+# source_image - the SOURCE_IMAGE name, or None if the .xml has none
+# abscalfactor - a float64 array of the ABSCALFACTOR of each band in BANDS
+# effbandwidth - a float64 array of the EFFECTIVEBANDWIDTH of each band in BANDS
+# corners      - a float64 (4, 2) array of the (latitude, longitude) of the
+#                CORNERS of the image, or None if the .xml has none
+# firstline    - the FIRSTLINETIME string, or None
+# linerate     - the AVGLINERATE in lines per second, as a float, or None
+# numrows      - the NUMROWS of the image, as an int, or None
+SceneMetadata = namedtuple('SceneMetadata', ['satid', 'tlctime', 'meansunel', 'source_image',
+                                             'abscalfactor', 'effbandwidth', 'corners',
+                                             'firstline', 'linerate', 'numrows'])
+
+# The records already read by this process, keyed by (path, mtime)
+_memo = {}
+
+
+def cache_dir():
+    """
+    Finds the directory the metadata records are cached in.
+
+    Parameters:
+    None
+
+    Return:
+    The path of the cache directory
+    """
+
+    return os.path.join(os.environ.get('LANDCOVER_CACHE',
+                                       os.path.join(os.path.expanduser('~'), '.cache',
+                                                    'landcover')),
+                        'metadata')
+
+
+def _find_text(element, tag):
+    # The text of the first element named tag under element, or None
+    found = element.find('.//' + tag)
+    return None if found is None else found.text
+
+
+def _text(element, tag, xml_path):
+    # The text of the element named tag right under element. A missing
+    # element is a broken .xml, reported like any other
+    found = element.find(tag)
+    if found is None:
+        raise ValueError(xml_path + ' has no ' + tag + ' element')
+    return found.text
+
+
+def parse_metadata(xml_path):
+    """
+    Parses a scene's .xml file into a SceneMetadata record.
+
+    Parameters:
+    xml_path - the path of the .xml file
+
+    Return:
+    The SceneMetadata of the scene
+    """
+
+    root = ET.parse(xml_path).getroot()
+
+    # The image metadata is the element holding IMAGE and the BAND_* elements
+    imd = next((element for element in root.iter() if element.find('IMAGE') is not None),
+               None)
+    if imd is None:
+        raise ValueError(xml_path + ' has no IMAGE element')
+    image = imd.find('IMAGE')
+    bands = [imd.find(band) for band in BANDS]
+    missing = [band for band, element in zip(BANDS, bands) if element is None]
+    if missing:
+        raise ValueError(xml_path + ' has no ' + ', '.join(missing) + ' element')
+
+    source_image = root.find('.//SOURCE_IMAGE')
+
+    # The corners are given with every band, and are the same for all of them
+    first_band = bands[0]
+    corners = [(_find_text(first_band, corner + 'LAT'), _find_text(first_band, corner + 'LON'))
+               for corner in CORNERS]
+    if any(value is None for corner in corners for value in corner):
+        corners = None
+    else:
+        corners = np.array(corners, dtype=np.float64)
+
+    linerate = _find_text(image, 'AVGLINERATE')
+    numrows = _find_text(imd, 'NUMROWS')
+
+    return SceneMetadata(
+        satid=_text(image, 'SATID', xml_path),
+        tlctime=_text(image, 'TLCTIME', xml_path),
+        meansunel=float(_text(image, 'MEANSUNEL', xml_path)),
+        source_image=None if source_image is None else source_image.text,
+        abscalfactor=np.array([float(_text(band, 'ABSCALFACTOR', xml_path))
+                               for band in bands]),
+        effbandwidth=np.array([float(_text(band, 'EFFECTIVEBANDWIDTH', xml_path))
+                               for band in bands]),
+        corners=corners,
+        firstline=_find_text(image, 'FIRSTLINETIME'),
+        linerate=None if linerate is None else float(linerate),
+        numrows=None if numrows is None else int(numrows))
+
+
+def read_metadata(xml_path):
+    """
+    Gets the SceneMetadata of a scene, parsing its .xml only if it isn't
+    cached yet or changed since it was cached.
+
+    Parameters:
+    xml_path - the path of the .xml file
+
+    Return:
+    The SceneMetadata of the scene
+    """
+
+    xml_path = os.path.realpath(xml_path)
+    mtime = os.stat(xml_path).st_mtime_ns
+    key = (xml_path, mtime)
+
+    if key in _memo:
+        return _memo[key]
+
+    cache_file = os.path.join(cache_dir(),
+                              hashlib.sha1(xml_path.encode('utf-8')).hexdigest() + '.pkl')
+
+    # Uses the record on disk if it was made from the same version of the .xml
+    try:
+        with open(cache_file, 'rb') as cached:
+            version, cached_mtime, fields = pickle.load(cached)
+        if version == CACHE_VERSION and cached_mtime == mtime:
+            _memo[key] = SceneMetadata(**fields)
+            return _memo[key]
+    except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+        pass
+
+    record = parse_metadata(xml_path)
+    _memo[key] = record
+
+    # Saves the record for later stages. Written under a temporary name and
+    # renamed so concurrent workers never read a half written file. A cache
+    # that can't be written only costs a parse next time
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        temp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+        with open(temp_file, 'wb') as cached:
+            pickle.dump((CACHE_VERSION, mtime, record._asdict()), cached,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, cache_file)
+    except OSError:
+        pass
+
+    return record
@@ -0,0 +1,92 @@
+"""
+The valid-data mask of a scene.
+
+An orthorectified strip is padded to a rectangle with a collar of pixels
+whose digital numbers are 0 in every band, often more than a third of the
+image. The offset of the radiance turned the collar into negative
+radiance, which class.py then classified like any other pixel, even
+though every image declared a nodata value.
+
+The mask is worked out once, from the digital numbers of the raw image,
+by rad.py or the fused engine: a pixel is valid when any of its bands is
+not 0. Every image made from then on carries it, as an internal GDAL mask
+band of the GeoTIFF or as the .mask file of a raw store, and the later
+stages read the mask of their input instead of working it out again. The
+masks hold VALID for valid pixels and INVALID for the others, like the
+masks GDAL reads. Invalid pixels are written with the nodata value of
+the image, or as 0 in the class masks and label images.
+
+A tile without a single valid pixel is neither computed nor written.
+The GeoTIFFs are created with SPARSE_OK, so GDAL leaves the blocks that
+were never written out of the file and reads them as nodata, with an
+invalid mask.
+"""
+
+import numpy as np
+
+# The values of valid and invalid pixels in a mask
+VALID = 255
+INVALID = 0
+
+
+def valid_mask(dn):
+    """
+    Finds the valid pixels of a block of raw digital numbers, those with
+    at least one band that isn't 0.
+
+    Parameters:
+    dn - the (bands, rows, cols) raw block, as read or as float32
+
+    Return:
+    A uint8 (rows, cols) mask of VALID and INVALID
+    """
+
+    valid = np.zeros(dn.shape[1:], dtype=bool)
+    for band in dn:
+        valid |= band != 0
+
+    return valid * np.uint8(VALID)
+
+
+def fill_invalid(block, mask, value):
+    """
+    Writes a value into the invalid pixels of a block, in place.
+
+    Parameters:
+    block - a (bands, rows, cols) or (rows, cols) block
+    mask  - the uint8 (rows, cols) mask of the block
+    value - the value of the invalid pixels, e.g. the nodata value of the
+            image the block is written into. None leaves them as they are
+
+    Return:
+    The block
+    """
+
+    if value is None:
+        return block
+    np.copyto(block, np.asarray(value, dtype=block.dtype), where=(mask == INVALID))
+
+    return block
+
+
+def write_masked(dst, data, mask, window=None, fill=None):
+    """
+    Writes a block and its mask into an image, after filling its invalid
+    pixels.
+
+    Parameters:
+    dst    - the open image or raw store being written
+    data   - the block to write, encoded like dst. It is overwritten
+    mask   - the uint8 (rows, cols) mask of the block
+    window - the window to write, or None for the whole image
+    fill   - the value of the invalid pixels. None for the nodata value
+             of dst
+
+    Return:
+    None
+    """
+
+    if fill is None:
+        fill = dst.nodata
+    dst.write(fill_invalid(data, mask, fill), window=window)
+    dst.write_mask(mask, window=window)
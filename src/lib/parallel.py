@@ -0,0 +1,123 @@
+"""
+Scene level parallelism shared by the stage scripts.
+
+Every script hands its list of scenes to run_scenes, which runs one scene
+per worker process and reports the progress and failures of each scene.
+Outputs are written through atomic_output so that a file only shows up
+under its final name once it is complete. The manifest checks of the
+scripts therefore never see a half written image, even when several
+workers are running in the same directory.
+"""
+
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+
+
+def _run_one(func, args):
+    """
+    Runs a single scene, catching its errors so that they can be reported
+    by the parent process instead of stopping the other scenes.
+
+    Parameters:
+    func - the function processing one scene
+    args - a tuple of the arguments passed to func
+
+    Return:
+    None if the scene was processed, the formatted traceback otherwise
+    """
+
+    try:
+        func(*args)
+    except Exception:
+        return traceback.format_exc()
+    return None
+
+
+def run_scenes(func, scenes, workers=1):
+    """
+    Processes scenes, one scene per worker process.
+
+    Parameters:
+    func    - the function processing one scene. It has to be defined at
+              the top level of its module so it can be sent to a worker
+    scenes  - a list of (label, args) tuples. label names the scene in the
+              progress messages and args is passed to func as func(*args)
+    workers - the number of worker processes. 1 runs the scenes one after
+              the other in the current process
+
+    Return:
+    A list of the labels of the scenes that failed
+    """
+
+    failures = []
+    total = len(scenes)
+
+    def report(done, label, error):
+        # Prints the progress of the run and the error of a failed scene
+        if error is None:
+            print('[{}/{}] {} done'.format(done, total, label))
+        else:
+            failures.append(label)
+            print('[{}/{}] {} FAILED\n{}'.format(done, total, label, error))
+
+    if workers <= 1 or total <= 1:
+        for done, (label, args) in enumerate(scenes, 1):
+            report(done, label, _run_one(func, args))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, total)) as pool:
+            futures = {pool.submit(_run_one, func, args): label for label, args in scenes}
+            for done, future in enumerate(as_completed(futures), 1):
+                report(done, futures[future], future.result())
+
+    if failures:
+        print('{} of {} scenes failed: {}'.format(len(failures), total, ', '.join(failures)))
+
+    return failures
+
+
+def _temp_files(folder, temp_stem, ext):
+    """
+    Lists the files written under a temporary name, including sidecars
+    such as the .shx and .dbf of a shapefile or the .aux.xml of an image.
+    The file ending with the extension of the output comes last.
+    """
+
+    files = [f for f in os.listdir(folder) if f.startswith(temp_stem + '.')]
+    return sorted(files, key=lambda f: f == temp_stem + ext)
+
+
+@contextmanager
+def atomic_output(path):
+    """
+    Gives a temporary path to write an output to, and renames what was
+    written there to its final name once the block finished without
+    errors. If it failed, the temporary files are removed.
+
+    The temporary name starts with a dot and keeps the extension, so the
+    output drivers are picked the same way as for the final name.
+
+    Parameters:
+    path - the final path of the output
+
+    Return:
+    Yields the temporary path to write to
+    """
+
+    folder, name = os.path.split(path)
+    folder = folder or '.'
+    stem, ext = os.path.splitext(name)
+    temp_stem = '.{}.{}.tmp'.format(stem, os.getpid())
+
+    try:
+        yield os.path.join(folder, temp_stem + ext)
+    except BaseException:
+        for f in _temp_files(folder, temp_stem, ext):
+            os.remove(os.path.join(folder, f))
+        raise
+
+    # Renames the main file last so it only exists once its sidecars do
+    for f in _temp_files(folder, temp_stem, ext):
+        os.rename(os.path.join(folder, f),
+                  os.path.join(folder, stem + f[len(temp_stem):]))
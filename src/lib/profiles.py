@@ -0,0 +1,149 @@
+"""
+Named output profiles shared by every script writing images.
+
+Without a profile the images keep the layout GDAL gives them, which for
+the raw WorldView images means one strip per row. A profile writes them
+as tiled GeoTIFFs instead, so the windowed reads of the later stages only
+decode the tiles they need, and picks the compression:
+
+fast    - LZW without a predictor. Cheap to write and read
+compact - DEFLATE at level 9 with a predictor. The smallest files, at the
+          cost of more CPU when writing
+cog     - a Cloud Optimized GeoTIFF. DEFLATE with a predictor, internal
+          overviews, and the overviews stored before the full resolution
+          image so a remote reader can get at any level with few requests
+"""
+
+import os
+
+import numpy as np
+
+# The edge length of the internal tiles in pixels
+BLOCK_SIZE = 512
+
+# The compression of each profile, and whether it stores a predictor and
+# builds overviews
+PROFILES = {'fast': {'compress': 'LZW', 'predictor': False, 'overviews': False},
+            'compact': {'compress': 'DEFLATE', 'zlevel': 9, 'predictor': True,
+                        'overviews': False},
+            'cog': {'compress': 'DEFLATE', 'zlevel': 6, 'predictor': True,
+                    'overviews': True}}
+
+
+def creation_options(profile, dtype):
+    """
+    Gives the GeoTIFF creation options of a profile.
+
+    Parameters:
+    profile - the name of the profile
+    dtype   - the data type of the image, which picks the predictor
+
+    Return:
+    A dict of the creation options, to update rasterio metadata with
+    """
+
+    preset = PROFILES[profile]
+    options = {'driver': 'GTiff',
+               'tiled': True,
+               'blockxsize': BLOCK_SIZE,
+               'blockysize': BLOCK_SIZE,
+               'compress': preset['compress'],
+               # Compresses the tiles on every core
+               'num_threads': 'ALL_CPUS'}
+
+    if 'zlevel' in preset:
+        options['zlevel'] = preset['zlevel']
+
+    # Floating point images get the floating point predictor and integer
+    # images the horizontal differencing one
+    if preset['predictor']:
+        options['predictor'] = 3 if np.dtype(dtype).kind == 'f' else 2
+
+    return options
+
+
+def profile_meta(meta, profile=None):
+    """
+    Applies a profile to the metadata an image is created with. Every
+    image is created sparse, so the tiles that are never written because
+    they hold no valid pixels take no space in the file.
+
+    Parameters:
+    meta    - the rasterio metadata of the image
+    profile - the name of the profile. None keeps the layout of meta
+
+    Return:
+    A new dict of the metadata
+    """
+
+    meta = dict(meta, sparse_ok=True)
+    if profile is not None:
+        meta.pop('compress', None)
+        meta.update(creation_options(profile, meta['dtype']))
+
+    return meta
+
+
+def overview_factors(width, height):
+    """
+    Finds the overview levels of an image, halving it until it fits in a
+    single tile.
+
+    Parameters:
+    width  - the width of the image in pixels
+    height - the height of the image in pixels
+
+    Return:
+    A list of the decimation factors, e.g. [2, 4, 8]
+    """
+
+    factors = []
+    factor = 2
+    while max(width, height) / (factor // 2) > BLOCK_SIZE:
+        factors.append(factor)
+        factor *= 2
+
+    return factors
+
+
+def finish_output(path, profile=None):
+    """
+    Does what a profile needs once an image has been completely written.
+    For cog, the overviews are built and the image is rewritten with them
+    in front of the full resolution data. Other profiles need nothing.
+
+    Parameters:
+    path    - the path of the closed image
+    profile - the name of the profile it was written with
+
+    Return:
+    None
+    """
+
+    if profile is None or not PROFILES[profile]['overviews']:
+        return
+
+    # Imported here so the scripts only load GDAL once they write an image
+    import rasterio
+    import rasterio.shutil
+    from rasterio.enums import Resampling
+
+    with rasterio.Env(GDAL_NUM_THREADS='ALL_CPUS'):
+        with rasterio.open(path, 'r+') as dst:
+            dtype = dst.dtypes[0]
+            # Averaging would make up classes that don't exist in masks
+            resampling = (Resampling.average if np.dtype(dtype).kind == 'f'
+                          else Resampling.nearest)
+            factors = overview_factors(dst.width, dst.height)
+            # An image fitting in a single tile needs no overviews
+            if factors:
+                dst.build_overviews(factors, resampling)
+                dst.update_tags(ns='rio_overview', resampling=resampling.name)
+
+        # The copy keeps the start of the name, so it is cleaned up with
+        # the rest of the temporary files if anything fails
+        stem, ext = os.path.splitext(path)
+        cog_path = stem + '.cog' + ext
+        rasterio.shutil.copy(path, cog_path, copy_src_overviews=True, bigtiff='IF_SAFER',
+                             **creation_options(profile, dtype))
+        os.replace(cog_path, path)
@@ -0,0 +1,543 @@
+"""
+A raw, memory mapped store for the images handed from one stage to the
+next.
+
+atmcorr_specmath.py and refl.py only subtract or scale the bands of their
+input, so when they read a compressed float32 GeoTIFF written by the stage
+before them, most of their time goes into decoding it, and into encoding
+their own output for the stage after them. With --raw the stages write
+their image as a raw store instead: the float32 values band interleaved by
+pixel (BIP) in a file ending with RAW_EXT, a JSON sidecar next to it
+holding the size, transform, CRS and nodata value of the image, and the
+uint8 valid-data mask of the image in a file ending with MASK_EXT.
+
+The store is opened with numpy.memmap, so a window of it is a view of the
+mapped file rather than a copy. Two raw stores are worked on without any
+copies at all: the band math reads the window of the input from the page
+cache and writes its result straight into the window of the output. The
+windows without valid pixels are left unwritten, so the pages of the
+file behind them are never allocated.
+
+Only the products that are kept need to be GeoTIFFs. finalize converts a
+store into a GeoTIFF with the profile and encoding it would have been
+written with, and finalize.py does it for every kept product of a
+directory.
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .encoding import encoding_meta, set_scaling, encode
+from .nodata import VALID, fill_invalid, write_masked
+from .profiles import profile_meta, finish_output
+from .tiling import map_windows
+
+# The extension of a raw store, and the ones its sidecar and its mask
+# add to its name
+RAW_EXT = '.bip'
+SIDECAR_EXT = '.json'
+MASK_EXT = '.mask'
+
+# The number of rows of a window when a store is walked in its own
+# blocks. The rows of a BIP file are contiguous, so a strip of rows is a
+# contiguous part of the file
+BLOCK_ROWS = 256
+
+
+def sidecar_path(path):
+    """
+    Gives the path of the sidecar of a raw store.
+
+    Parameters:
+    path - the path of the raw store
+
+    Return:
+    The path of its JSON sidecar
+    """
+
+    return path + SIDECAR_EXT
+
+
+def mask_path(path):
+    """
+    Gives the path of the valid-data mask of a raw store.
+
+    Parameters:
+    path - the path of the raw store
+
+    Return:
+    The path of its mask
+    """
+
+    return path + MASK_EXT
+
+
+def store_files(path):
+    """
+    Lists the files of a raw store, for the manifest. A store written
+    before the masks existed has none.
+
+    Parameters:
+    path - the path of the raw store
+
+    Return:
+    A list of the paths of the store, its sidecar and its mask
+    """
+
+    files = [path, sidecar_path(path)]
+    if os.path.isfile(mask_path(path)) or not os.path.isfile(path):
+        files.append(mask_path(path))
+
+    return files
+
+
+def is_raw(path):
+    """
+    Sees if a path names a raw store rather than a GeoTIFF.
+
+    Parameters:
+    path - the path or name of an image
+
+    Return:
+    True if it ends with RAW_EXT
+    """
+
+    return path.endswith(RAW_EXT)
+
+
+def raw_name(name):
+    """
+    Names the raw store of an image the way a stage would name its
+    GeoTIFF, e.g. image_rad.tif -> image_rad.bip.
+
+    Parameters:
+    name - the name of the GeoTIFF
+
+    Return:
+    The name of the raw store
+    """
+
+    return os.path.splitext(name)[0] + RAW_EXT
+
+
+def _slices(window):
+    # The row and column slices of a rasterio Window, or of the whole
+    # image for None
+    if window is None:
+        return slice(None), slice(None)
+    row_off, col_off = int(window.row_off), int(window.col_off)
+    return (slice(row_off, row_off + int(window.height)),
+            slice(col_off, col_off + int(window.width)))
+
+
+class RawImage(object):
+    """
+    An open raw store. It can be read and written like the rasterio
+    datasets the stages work on, so map_windows and the write loops of the
+    stages take either, and it gives views of its windows without copies.
+    """
+
+    def __init__(self, path, mode='r'):
+        """
+        Opens a raw store and maps its file.
+
+        Parameters:
+        path - the path of the raw store
+        mode - 'r' to read it, 'r+' to also write into it
+
+        Return:
+        None
+        """
+
+        with open(sidecar_path(path), 'r') as sidecar:
+            self.info = json.load(sidecar)
+
+        self.name = path
+        self.width = self.info['width']
+        self.height = self.info['height']
+        self.count = self.info['count']
+        self.nodata = self.info['nodata']
+        self.indexes = list(range(1, self.count + 1))
+        # The values are stored as they are, with no scale or offset
+        self.scales = (1.0,) * self.count
+        self.offsets = (0.0,) * self.count
+        self.array = np.memmap(path, dtype=self.info['dtype'], mode=mode,
+                               shape=(self.height, self.width, self.count))
+        # A store written before the masks existed has every pixel valid
+        self.mask = None
+        if os.path.isfile(mask_path(path)):
+            self.mask = np.memmap(mask_path(path), dtype=np.uint8, mode=mode,
+                                  shape=(self.height, self.width))
+
+    @property
+    def meta(self):
+        """
+        The rasterio metadata of a float32 GeoTIFF of the same image.
+        """
+
+        from affine import Affine
+        from rasterio.crs import CRS
+
+        return {'driver': 'GTiff', 'dtype': self.info['dtype'], 'nodata': self.nodata,
+                'width': self.width, 'height': self.height, 'count': self.count,
+                'crs': CRS.from_wkt(self.info['crs']) if self.info['crs'] else None,
+                'transform': Affine(*self.info['transform'])}
+
+    def block_windows(self, bidx=0):
+        """
+        Walks the store in strips of BLOCK_ROWS rows, like the internal
+        blocks of a GeoTIFF, so tiling.tile_windows works on it.
+
+        Parameters:
+        bidx - the band, which doesn't change the blocks of a BIP file
+
+        Return:
+        Yields ((row, 0), Window) tuples
+        """
+
+        from rasterio.windows import Window
+
+        for i, row_off in enumerate(range(0, self.height, BLOCK_ROWS)):
+            yield (i, 0), Window(0, row_off, self.width, min(BLOCK_ROWS, self.height - row_off))
+
+    def view(self, window=None):
+        """
+        Gives a window of the store without copying it. Writing into the
+        view writes into the store.
+
+        Parameters:
+        window - the window, or None for the whole image
+
+        Return:
+        A (bands, rows, cols) view of the mapped file
+        """
+
+        rows, cols = _slices(window)
+        return self.array[rows, cols].transpose(2, 0, 1)
+
+    def read(self, indexes=None, window=None, out_dtype=None):
+        """
+        Reads a window into a new array, like rasterio's read.
+
+        Parameters:
+        indexes   - the band index or list of band indexes to read. None
+                    for all of the bands
+        window    - the window to read, or None for the whole image
+        out_dtype - the data type of the array, or None for that of the
+                    store
+
+        Return:
+        A (bands, rows, cols) array, or a (rows, cols) one for a single
+        band index
+        """
+
+        block = self.view(window)
+        if indexes is not None:
+            bands = indexes - 1 if isinstance(indexes, int) else [i - 1 for i in indexes]
+            block = block[bands]
+
+        return np.array(block, dtype=out_dtype or block.dtype)
+
+    def write(self, block, window=None):
+        """
+        Writes a block into a window of the store, like rasterio's write.
+
+        Parameters:
+        block  - the (bands, rows, cols) block, or a (rows, cols) one for a
+                 single band store
+        window - the window to write, or None for the whole image
+
+        Return:
+        None
+        """
+
+        view = self.view(window)
+        view[...] = block if block.ndim == 3 else block[None]
+
+    def mask_view(self, window=None):
+        """
+        Gives a window of the valid-data mask without copying it, or None
+        for a store without a mask.
+
+        Parameters:
+        window - the window, or None for the whole image
+
+        Return:
+        A uint8 (rows, cols) view of the mapped mask, or None
+        """
+
+        if self.mask is None:
+            return None
+        rows, cols = _slices(window)
+        return self.mask[rows, cols]
+
+    def dataset_mask(self, window=None):
+        """
+        Reads a window of the valid-data mask, like rasterio's
+        dataset_mask.
+
+        Parameters:
+        window - the window to read, or None for the whole image
+
+        Return:
+        A uint8 (rows, cols) array of nodata.VALID and nodata.INVALID
+        """
+
+        view = self.mask_view(window)
+        if view is None:
+            rows, cols = _slices(window)
+            return np.full(self.array[rows, cols, 0].shape, VALID, dtype=np.uint8)
+
+        return np.array(view)
+
+    def write_mask(self, mask, window=None):
+        """
+        Writes a window of the valid-data mask, like rasterio's write_mask.
+
+        Parameters:
+        mask   - the uint8 (rows, cols) mask
+        window - the window to write, or None for the whole image
+
+        Return:
+        None
+        """
+
+        self.mask_view(window)[...] = mask
+
+    def tags(self):
+        """
+        Gives the tags of the store, like rasterio's tags.
+
+        Return:
+        A dictionary of the tags
+        """
+
+        return dict(self.info.get('tags', {}))
+
+    def update_tags(self, **tags):
+        """
+        Adds tags to the store, like rasterio's update_tags. They are kept
+        in the sidecar and written into the GeoTIFF it is finalized into.
+
+        Parameters:
+        tags - the tags as keyword arguments
+
+        Return:
+        None
+        """
+
+        self.info.setdefault('tags', {}).update({key: str(value) for key, value in tags.items()})
+        with open(sidecar_path(self.name), 'w') as sidecar:
+            json.dump(self.info, sidecar, indent=2)
+
+    def close(self):
+        """
+        Flushes what was written and unmaps the file.
+        """
+
+        if self.array is not None:
+            if self.array.mode != 'r':
+                self.array.flush()
+                if self.mask is not None:
+                    self.mask.flush()
+            self.array = None
+            self.mask = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def create_raw(path, meta):
+    """
+    Creates a raw store of the size and georeferencing of an image, with a
+    mask of only invalid pixels. The store always holds float32 values;
+    the encoding of the product is only applied when it is finalized.
+
+    Parameters:
+    path - the path of the raw store
+    meta - the rasterio metadata of the image
+
+    Return:
+    The RawImage, open for writing
+    """
+
+    crs = meta.get('crs')
+    info = {'width': int(meta['width']), 'height': int(meta['height']),
+            'count': int(meta['count']), 'dtype': 'float32', 'interleave': 'bip',
+            'transform': list(meta['transform'])[:6],
+            'crs': crs.to_wkt() if crs else None,
+            'nodata': meta.get('nodata')}
+    with open(sidecar_path(path), 'w') as sidecar:
+        json.dump(info, sidecar, indent=2)
+
+    # Sizes the file without writing it, so the pages are only allocated
+    # once they are written
+    with open(path, 'wb') as f:
+        f.truncate(info['width'] * info['height'] * info['count'] * 4)
+    with open(mask_path(path), 'wb') as f:
+        f.truncate(info['width'] * info['height'])
+
+    return RawImage(path, 'r+')
+
+
+def map_views(src, dst, windows, func, threads=1):
+    """
+    Passes every window of a raw store through func straight into the same
+    window of another raw store, on a pool of threads. func reads the view
+    of the input and writes into the view of the output, so the tiles are
+    never copied. Views of a mapped file can be shared between threads.
+    The mask of the input is copied to the output, and the windows without
+    valid pixels are skipped.
+
+    Parameters:
+    src     - the RawImage to read from
+    dst     - the RawImage to write into
+    windows - an iterable of the windows
+    func    - a function taking the view of a window of src, the view of
+              the same window of dst to write into and the window
+    threads - the number of threads
+
+    Return:
+    None
+    """
+
+    def work(window):
+        mask = src.dataset_mask(window)
+        if not mask.any():
+            return
+        out = dst.view(window)
+        func(src.view(window), out, window)
+        fill_invalid(out, mask, dst.nodata)
+        dst.write_mask(mask, window)
+
+    if threads <= 1:
+        for window in windows:
+            work(window)
+        return
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        # list() waits for every window and raises the first error
+        list(pool.map(work, windows))
+
+
+def band_math(src, dst, windows, kernel, threads=1, encoding='float32', product=None):
+    """
+    Runs the band math of a stage over the windows of its input and writes
+    the results into its output, each of which may be a GeoTIFF or a raw
+    store. Between two raw stores the kernel writes straight into the
+    output; otherwise every window is read as float32, computed in place
+    and written in order, as map_windows does. The valid-data mask of the
+    input is carried to the output, and the windows without valid pixels
+    are neither computed nor written.
+
+    Parameters:
+    src      - the open input image or RawImage
+    dst      - the open output image or RawImage
+    windows  - an iterable of the windows
+    kernel   - a function taking a float32 (bands, rows, cols) block, the
+               array to write the result into, which may be the block, and
+               the window of the block
+    threads  - the number of threads
+    encoding - the encoding dst was created with. Raw stores are always
+               float32
+    product  - the product in dst, a key of encoding.SCALING
+
+    Return:
+    None
+    """
+
+    if isinstance(dst, RawImage):
+        if isinstance(src, RawImage):
+            map_views(src, dst, windows, kernel, threads)
+            return
+        encoding = 'float32'
+
+    def compute(block, window, mask):
+        return encode(kernel(block, block, window), encoding, product), mask
+
+    for window, result in map_windows(src, windows, compute, threads, out_dtype='float32',
+                                      pass_window=True, masked=True):
+        if result is not None:
+            write_masked(dst, result[0], result[1], window)
+
+
+def latest_images(folder, names):
+    """
+    Keeps one of the GeoTIFF and the raw store of the same image, when a
+    directory has both, whichever was written last.
+
+    Parameters:
+    folder - the directory of the images
+    names  - the names of the .tif images and raw stores
+
+    Return:
+    A sorted list of the names to use
+    """
+
+    latest = {}
+    for name in names:
+        stem = os.path.splitext(name)[0]
+        if (stem not in latest or os.path.getmtime(os.path.join(folder, name)) >
+                os.path.getmtime(os.path.join(folder, latest[stem]))):
+            latest[stem] = name
+
+    return sorted(latest.values())
+
+
+def finalize(raw_path, tif_path, product, profile=None, encoding='float32'):
+    """
+    Converts a raw store into a GeoTIFF, with the layout and encoding the
+    stage would have written it with.
+
+    Parameters:
+    raw_path - the path of the raw store
+    tif_path - the path of the GeoTIFF to write
+    product  - the product in the store, a key of encoding.SCALING
+    profile  - the name of the output profile, or None
+    encoding - how the GeoTIFF stores the values, one of ENCODINGS
+
+    Return:
+    None
+    """
+
+    import rasterio
+
+    with RawImage(raw_path) as src:
+        meta = dict(src.meta, compress='LZW', bigtiff='YES')
+        meta = profile_meta(encoding_meta(meta, encoding), profile)
+        with rasterio.open(tif_path, 'w', **meta) as dst:
+            set_scaling(dst, encoding, product)
+            if src.tags():
+                dst.update_tags(**src.tags())
+            for _, window in src.block_windows():
+                # The windows without valid pixels are left out of the
+                # sparse GeoTIFF
+                mask = src.dataset_mask(window)
+                if not mask.any():
+                    continue
+                # Read as a copy, since the uint16 encoding overwrites it
+                write_masked(dst, encode(src.read(window=window), encoding, product), mask,
+                             window)
+    finish_output(tif_path, profile)
+
+
+def remove_raw(path):
+    """
+    Removes a raw store, its sidecar and its mask.
+
+    Parameters:
+    path - the path of the raw store
+
+    Return:
+    None
+    """
+
+    for f in store_files(path):
+        if os.path.isfile(f):
+            os.remove(f)
@@ -0,0 +1,291 @@
+"""
+Spectral rule classification.
+
+The classes are read from a JSON file instead of being hard coded. The
+file names spectral indices as band expressions and gives every class a
+label, a color and a rule:
+
+{"indices": {"ndwi": "(B3 - B7) / (B3 + B7)",
+             "ndsi": "(B3 - B8) / (B3 + B8)"},
+ "classes": [{"name": "water", "label": 1, "color": [31, 120, 180, 255],
+              "rule": "ndwi > 0.3 and ndsi < 0.4"},
+             {"name": "snow", "label": 3, "color": [240, 248, 255, 255],
+              "rule": "ndsi >= 0.4"}]}
+
+The bands are B1 to B8 or coastal, blue, green, yellow, red, red_edge,
+nir and nir2. Expressions use numbers, + - * / **, comparisons, and, or,
+not, and the functions in FUNCTIONS. An index can use the indices above
+it. Every class needs its own name and label, and the name, which ends up
+in the names of the class mask files, may only hold letters, digits and
+underscores. The classes are tried in order and a pixel gets the label of
+the first rule it passes, or NODATA_LABEL if it passes none.
+
+All of the indices and rules are compiled into one list of steps, in
+which every sub-expression that shows up more than once, e.g. B3 + B7 in
+two indices, is a single step. A tile is classified by running the steps
+once, so adding a rule only costs the parts of it that are new. Results
+are dropped as soon as no later step needs them.
+"""
+
+import ast
+import json
+import os
+import re
+from collections import namedtuple
+
+import numpy as np
+
+from .classify import NODATA_LABEL
+
+# The default rules, which give the same labels as classify.class_labels
+DEFAULT_RULES = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             'class_rules.json')
+
+# The position of every band name in a (bands, rows, cols) block
+BAND_INDEX = {'B1': 0, 'B2': 1, 'B3': 2, 'B4': 3, 'B5': 4, 'B6': 5, 'B7': 6, 'B8': 7,
+              'coastal': 0, 'blue': 1, 'green': 2, 'yellow': 3, 'red': 4,
+              'red_edge': 5, 'nir': 6, 'nir2': 7}
+
+# The names a class can have, which are safe in file names
+CLASS_NAME = re.compile(r'[A-Za-z0-9_]+\Z')
+
+# The functions expressions can call
+FUNCTIONS = {'abs': np.abs, 'sqrt': np.sqrt, 'log': np.log, 'exp': np.exp,
+             'min': np.minimum, 'max': np.maximum}
+
+_BINARY = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply,
+           ast.Div: np.divide, ast.Pow: np.power}
+_COMPARE = {ast.Gt: np.greater, ast.GtE: np.greater_equal, ast.Lt: np.less,
+            ast.LtE: np.less_equal, ast.Eq: np.equal, ast.NotEq: np.not_equal}
+
+# name  - the name of the class
+# label - the uint8 value of the class in the label image
+# color - the RGBA color of the label
+# rule  - the rule as written in the file
+RuleClass = namedtuple('RuleClass', ['name', 'label', 'color', 'rule'])
+
+
+class RuleSet(object):
+    """
+    A compiled set of class rules.
+
+    A step is a tuple of the operation and the steps it takes, e.g.
+    ('add', ('band', 2), ('band', 6)), so two equal sub-expressions are
+    the same tuple and are only added to the steps once.
+    """
+
+    def __init__(self, config):
+        """
+        Compiles the indices and classes of a rule configuration.
+
+        Parameters:
+        config - the dict read from a rule file
+
+        Return:
+        None
+        """
+
+        self.classes = []
+        self.steps = []
+        self._known = set()
+
+        # Indices are compiled to the step computing them, so a rule using
+        # one shares its steps with every other rule using it
+        self.indices = {}
+        for name, expression in config.get('indices', {}).items():
+            if name in BAND_INDEX or name in FUNCTIONS:
+                raise ValueError('The index ' + name + ' has the name of a band or function')
+            self.indices[name] = self._compile(expression)
+
+        self._rule_steps = []
+        for entry in config['classes']:
+            name, label = entry['name'], int(entry['label'])
+            if not isinstance(name, str) or not CLASS_NAME.match(name):
+                raise ValueError('The class name ' + repr(name) + ' can only have letters, ' +
+                                 'digits and underscores')
+            if not 0 < label < 256 or label == NODATA_LABEL:
+                raise ValueError('The label of ' + name + ' has to be from 1 to 255')
+            for cls in self.classes:
+                if cls.name == name:
+                    raise ValueError('Two classes are named ' + name)
+                if cls.label == label:
+                    raise ValueError('The classes ' + cls.name + ' and ' + name +
+                                     ' have the same label ' + str(label))
+            self.classes.append(RuleClass(name, label,
+                                          tuple(entry.get('color', (255, 255, 255, 255))),
+                                          entry['rule']))
+            self._rule_steps.append(self._compile(entry['rule']))
+
+        # The steps refer to each other by position once compiled, and the
+        # position of the last step using each step tells when its result
+        # can be dropped. The rule results are kept to the end
+        position = {step: i for i, step in enumerate(self.steps)}
+        self._program = [(step[0], tuple(position[arg] if isinstance(arg, tuple) else arg
+                                         for arg in step[1:]))
+                         for step in self.steps]
+        self._rule_positions = [position[step] for step in self._rule_steps]
+        # Band and constant steps hold a band index or a number rather than
+        # positions, and call steps start with the name of the function
+        inputs = [() if op in ('band', 'const') else
+                  args[1:] if op == 'call' else args
+                  for op, args in self._program]
+        last_use = {}
+        for i, used in enumerate(inputs):
+            for arg in used:
+                last_use[arg] = i
+        self._free = [[] for _ in self._program]
+        for arg, i in last_use.items():
+            if arg not in self._rule_positions:
+                self._free[i].append(arg)
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_RULES):
+        """
+        Reads and compiles a rule file.
+
+        Parameters:
+        path - the path of the JSON rule file
+
+        Return:
+        The RuleSet
+        """
+
+        with open(path, 'r') as rule_file:
+            return cls(json.load(rule_file))
+
+    def colormap(self):
+        """
+        Gives the color table of the label image.
+
+        Parameters:
+        None
+
+        Return:
+        A dictionary of label -> RGBA color
+        """
+
+        colors = {NODATA_LABEL: (0, 0, 0, 0)}
+        colors.update({cls.label: cls.color for cls in self.classes})
+        return colors
+
+    def labels(self, block):
+        """
+        Classifies a (bands, rows, cols) reflectance block.
+
+        Parameters:
+        block - the float reflectance block
+
+        Return:
+        A uint8 (1, rows, cols) block of the label of every pixel
+        """
+
+        values = [None] * len(self._program)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i, (op, args) in enumerate(self._program):
+                values[i] = self._run(op, args, values, block)
+                # Frees the results no later step needs
+                for arg in self._free[i]:
+                    values[arg] = None
+
+        labels = np.full((1,) + block.shape[1:], NODATA_LABEL, dtype=np.uint8)
+        # Written from the last class to the first, so the first rule a
+        # pixel passes is the one that sticks
+        for cls, i in reversed(list(zip(self.classes, self._rule_positions))):
+            passed = np.broadcast_to(values[i], block.shape[1:])
+            labels[0][passed.astype(bool)] = cls.label
+
+        return labels
+
+    @staticmethod
+    def _run(op, args, values, block):
+        # Runs one step on the results of the steps it takes
+        if op == 'band':
+            return block[args[0]]
+        if op == 'const':
+            return np.float32(args[0])
+        if op == 'call':
+            return FUNCTIONS[args[0]](*[values[arg] for arg in args[1:]])
+
+        args = [values[arg] for arg in args]
+        if op == 'neg':
+            return np.negative(args[0])
+        if op == 'not':
+            return np.logical_not(args[0])
+        if op == 'and':
+            return np.logical_and(*args)
+        if op == 'or':
+            return np.logical_or(*args)
+        if op in _BINARY_NAMES:
+            return _BINARY_NAMES[op](*args)
+        return _COMPARE_NAMES[op](*args)
+
+    def _add(self, step):
+        # Adds a step unless an equal one is already there
+        if step not in self._known:
+            self._known.add(step)
+            self.steps.append(step)
+        return step
+
+    def _compile(self, expression):
+        # Compiles an expression into steps and returns its last step
+        try:
+            tree = ast.parse(expression, mode='eval')
+        except SyntaxError:
+            raise ValueError('Can not parse the expression: ' + expression)
+        return self._node(tree.body, expression)
+
+    def _node(self, node, expression):
+        # Turns one node of a parsed expression into a step
+        if isinstance(node, ast.Name):
+            if node.id in self.indices:
+                return self.indices[node.id]
+            if node.id in BAND_INDEX:
+                return self._add(('band', BAND_INDEX[node.id]))
+            raise ValueError('Unknown name ' + node.id + ' in: ' + expression)
+
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return self._add(('const', float(node.value)))
+
+        if isinstance(node, ast.UnaryOp):
+            operand = self._node(node.operand, expression)
+            if isinstance(node.op, ast.USub):
+                return self._add(('neg', operand))
+            if isinstance(node.op, ast.UAdd):
+                return operand
+            if isinstance(node.op, ast.Not):
+                return self._add(('not', operand))
+
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY:
+            return self._add((_BINARY[type(node.op)].__name__,
+                              self._node(node.left, expression),
+                              self._node(node.right, expression)))
+
+        if isinstance(node, ast.BoolOp):
+            op = 'and' if isinstance(node.op, ast.And) else 'or'
+            step = self._node(node.values[0], expression)
+            for value in node.values[1:]:
+                step = self._add((op, step, self._node(value, expression)))
+            return step
+
+        # a < b < c is compiled as a < b and b < c
+        if isinstance(node, ast.Compare) and all(type(op) in _COMPARE for op in node.ops):
+            left = self._node(node.left, expression)
+            step = None
+            for op, comparator in zip(node.ops, node.comparators):
+                right = self._node(comparator, expression)
+                compared = self._add((_COMPARE[type(op)].__name__, left, right))
+                step = compared if step is None else self._add(('and', step, compared))
+                left = right
+            return step
+
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and
+                node.func.id in FUNCTIONS and not node.keywords):
+            return self._add(('call', node.func.id) +
+                             tuple(self._node(arg, expression) for arg in node.args))
+
+        raise ValueError('Unsupported expression ' + ast.dump(node) + ' in: ' + expression)
+
+
+# The NumPy functions of the binary and comparison steps, by step name
+_BINARY_NAMES = {func.__name__: func for func in _BINARY.values()}
+_COMPARE_NAMES = {func.__name__: func for func in _COMPARE.values()}
@@ -0,0 +1,278 @@
+"""
+Solar geometry of a scene from the time it was taken.
+
+The Earth-Sun distance used to be looked up in a table of 366 days keyed
+like 'JAN01', built from the TLCTIME sliced into strings. It was only
+precise to the day, and the leap day was an entry of its own. Here it is
+computed from the full timestamp with the formula DigitalGlobe gives for
+the radiometric use of WorldView imagery:
+
+d = 1.00014 - 0.01671 cos(g) - 0.00014 cos(2g)
+g = 357.529 + 0.98560028 D
+
+where g is the mean anomaly of the Sun in degrees and D the days since
+J2000.0. The position of the Sun, and from it the solar elevation at any
+latitude and longitude, follows the low precision formulas of the
+Astronomical Almanac, good to about 0.01 degrees.
+
+Every function takes arrays of timestamps as well as single ones, so the
+values of a whole batch of scenes are computed at once. The distances are
+kept in a table for the process, so the scenes of a batch that share it
+look theirs up instead of computing it again.
+
+On a long strip the Sun is not at MEANSUNEL everywhere. sun_grid computes
+the solar elevation on a coarse grid of nodes over the image, placing the
+nodes between the corners given in the .xml and timing them from the
+first line time and line rate, and upsample interpolates it bilinearly to
+the pixels of a tile. The grid holds sin(MEANSUNEL) / sin(elevation), the
+factor turning the reflectance made with MEANSUNEL into the reflectance
+with the elevation of each pixel, so a tile costs one interpolation and
+one multiplication.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+# The J2000.0 epoch, 2000-01-01 12:00 UTC
+J2000_TIME = np.datetime64('2000-01-01T12:00:00', 'us')
+
+# The spacing of the nodes of a sun grid in pixels. The elevation changes
+# by hundredths of a degree over this distance
+GRID_STEP = 256
+
+# The Earth-Sun distance of every timestamp computed by this process
+_distances = {}
+
+# values - the float64 (rows, cols) grid of sin(MEANSUNEL) / sin(elevation)
+# rows   - the float64 pixel rows of the nodes, from 0 to the last row
+# cols   - the float64 pixel columns of the nodes, from 0 to the last column
+SunGrid = namedtuple('SunGrid', ['values', 'rows', 'cols'])
+
+
+def _datetimes(tlctimes):
+    # Parses TLCTIME strings such as 2010-10-25T20:52:21.032000Z into a
+    # datetime64 array. NumPy doesn't take the Z of UTC
+    times = np.atleast_1d(np.asarray(tlctimes))
+    if times.dtype.kind in 'US':
+        times = np.array([str(t).rstrip('Z') for t in times.ravel()],
+                         dtype='datetime64[us]').reshape(times.shape)
+    return times.astype('datetime64[us]')
+
+
+def days_since_j2000(tlctimes):
+    """
+    Finds the days between J2000.0 and timestamps, with their fraction.
+
+    Parameters:
+    tlctimes - a TLCTIME string, or an array of TLCTIME strings or
+               datetime64 values
+
+    Return:
+    A float64 array of the days
+    """
+
+    return (_datetimes(tlctimes) - J2000_TIME) / np.timedelta64(1, 'D')
+
+
+def earth_sun_distances(tlctimes):
+    """
+    Computes the Earth-Sun distance at many timestamps at once, and keeps
+    them in the table of the process.
+
+    Parameters:
+    tlctimes - a list or array of TLCTIME strings
+
+    Return:
+    A float64 array of the distances in AU
+    """
+
+    times = np.atleast_1d(np.asarray(tlctimes))
+    g = np.radians(357.529 + 0.98560028 * days_since_j2000(times))
+    distances = 1.00014 - 0.01671 * np.cos(g) - 0.00014 * np.cos(2 * g)
+
+    if times.dtype.kind in 'US':
+        _distances.update(zip(times.ravel().tolist(), distances.ravel().tolist()))
+
+    return distances
+
+
+def earth_sun_distance(tlctime):
+    """
+    Gets the Earth-Sun distance at the time an image was taken, from the
+    table of the process when it is already there.
+
+    Parameters:
+    tlctime - the TLCTIME of the image as written in its .xml
+
+    Return:
+    The Earth-Sun distance in AU
+    """
+
+    if tlctime not in _distances:
+        earth_sun_distances([tlctime])
+
+    return _distances[tlctime]
+
+
+def sun_position(tlctimes):
+    """
+    Finds where the Sun is on the sky at timestamps.
+
+    Parameters:
+    tlctimes - a TLCTIME string, or an array of TLCTIME strings or
+               datetime64 values
+
+    Return:
+    A tuple of float64 arrays of the declination of the Sun and the
+    Greenwich hour angle of the Sun, both in radians
+    """
+
+    n = days_since_j2000(tlctimes)
+
+    # The mean longitude and mean anomaly of the Sun, its ecliptic
+    # longitude and the obliquity of the ecliptic, in degrees
+    mean_longitude = 280.460 + 0.9856474 * n
+    g = np.radians(357.528 + 0.9856003 * n)
+    ecliptic = np.radians(mean_longitude + 1.915 * np.sin(g) + 0.020 * np.sin(2 * g))
+    obliquity = np.radians(23.439 - 0.0000004 * n)
+
+    right_ascension = np.arctan2(np.cos(obliquity) * np.sin(ecliptic), np.cos(ecliptic))
+    declination = np.arcsin(np.sin(obliquity) * np.sin(ecliptic))
+
+    # The Greenwich mean sidereal time in degrees
+    sidereal = np.radians(280.46061837 + 360.98564736629 * n)
+
+    return declination, sidereal - right_ascension
+
+
+def solar_elevation(tlctimes, lat, lon):
+    """
+    Computes the elevation of the Sun above the horizon at points on the
+    ground. The timestamps and the points are broadcast against each
+    other, so one time and a grid of points give the elevation over a
+    scene, and an array of times with one point per time gives it for many
+    scenes.
+
+    Parameters:
+    tlctimes - a TLCTIME string, or an array of TLCTIME strings or
+               datetime64 values
+    lat      - the latitudes of the points in degrees
+    lon      - the longitudes of the points in degrees, east positive
+
+    Return:
+    A float64 array of the solar elevations in degrees
+    """
+
+    declination, greenwich_hour_angle = sun_position(tlctimes)
+    if np.ndim(tlctimes) == 0:
+        declination, greenwich_hour_angle = declination[0], greenwich_hour_angle[0]
+
+    lat = np.radians(lat)
+    hour_angle = greenwich_hour_angle + np.radians(lon)
+    sin_elevation = (np.sin(lat) * np.sin(declination) +
+                     np.cos(lat) * np.cos(declination) * np.cos(hour_angle))
+
+    return np.degrees(np.arcsin(np.clip(sin_elevation, -1, 1)))
+
+
+def _nodes(size, step):
+    # The pixel positions of the nodes along an edge of size pixels, at
+    # least 2 and about step apart, the first and last on the edge pixels
+    return np.linspace(0, max(size - 1, 1), max(2, int(np.ceil((size - 1) / step)) + 1))
+
+
+def sun_grid(scene, width, height, step=GRID_STEP):
+    """
+    Computes the grid of the correction from MEANSUNEL to the solar
+    elevation at every node over an image. The place of a node is
+    interpolated between the corners of the image, and its time between
+    the first and the last line. A scene without corners in its .xml gets
+    a grid of ones, i.e. MEANSUNEL everywhere; without a line rate, every
+    node is at TLCTIME.
+
+    Parameters:
+    scene  - the SceneMetadata of the image
+    width  - the width of the image in pixels
+    height - the height of the image in pixels
+    step   - the spacing of the nodes in pixels
+
+    Return:
+    The SunGrid of the image
+    """
+
+    rows, cols = _nodes(height, step), _nodes(width, step)
+    if scene.corners is None:
+        return SunGrid(np.ones((len(rows), len(cols))), rows, cols)
+
+    # Bilinear weights of the corners, upper left, upper right, lower
+    # right and lower left, at every node
+    y = (rows / max(height - 1, 1))[:, None]
+    x = (cols / max(width - 1, 1))[None, :]
+    weights = [(1 - y) * (1 - x), (1 - y) * x, y * x, y * (1 - x)]
+
+    lat = sum(w * corner_lat for w, corner_lat in zip(weights, scene.corners[:, 0]))
+    # The longitudes are unwrapped around the upper left corner, so a strip
+    # crossing the antimeridian isn't interpolated the long way around
+    corner_lons = scene.corners[0, 1] + (scene.corners[:, 1] - scene.corners[0, 1] +
+                                         180) % 360 - 180
+    lon = sum(w * corner_lon for w, corner_lon in zip(weights, corner_lons))
+
+    # The time of each row of nodes, going from the first line of the
+    # image to its last at the average line rate
+    if scene.firstline is not None and scene.linerate:
+        first = _datetimes(scene.firstline)[0]
+        seconds = y[:, 0] * (scene.numrows or height) / scene.linerate
+        times = first + (seconds * 1e6).astype('timedelta64[us]')
+    else:
+        times = np.repeat(_datetimes(scene.tlctime), len(rows))
+
+    elevation = solar_elevation(times[:, None], lat, lon)
+    values = (np.sin(np.radians(scene.meansunel)) /
+              np.sin(np.radians(np.maximum(elevation, 0.1))))
+
+    return SunGrid(values, rows, cols)
+
+
+def _weights(nodes, pixels):
+    # The index of the node before every pixel and the weight of the
+    # node after it
+    index = np.clip(np.searchsorted(nodes, pixels, side='right') - 1, 0, len(nodes) - 2)
+    weight = (pixels - nodes[index]) / (nodes[index + 1] - nodes[index])
+    return index, weight
+
+
+def upsample(grid, window=None, shape=None):
+    """
+    Interpolates a sun grid bilinearly to every pixel of a window. The
+    columns are interpolated on the rows of nodes first, so only the two
+    row lookups are done per pixel.
+
+    Parameters:
+    grid   - the SunGrid of the image
+    window - the rasterio Window of the tile, or None for the whole image
+    shape  - the (rows, cols) of the whole image, needed when window is
+             None
+
+    Return:
+    A float32 (rows, cols) array of the factors of the pixels
+    """
+
+    if window is None:
+        row_off, col_off, height, width = 0, 0, shape[0], shape[1]
+    else:
+        row_off, col_off = int(window.row_off), int(window.col_off)
+        height, width = int(window.height), int(window.width)
+
+    ix, wx = _weights(grid.cols, np.arange(col_off, col_off + width, dtype=np.float64))
+    iy, wy = _weights(grid.rows, np.arange(row_off, row_off + height, dtype=np.float64))
+
+    # The grid at the columns of the tile, on every row of nodes
+    across = (grid.values[:, ix] * (1 - wx) + grid.values[:, ix + 1] * wx).astype(np.float32)
+    wy = wy.astype(np.float32)[:, None]
+
+    out = across[iy]
+    out *= 1 - wy
+    out += across[iy + 1] * wy
+
+    return out
@@ -0,0 +1,93 @@
+"""
+Measures what the imports of a stage cost.
+
+On an ensemble of thousands of short tasks, importing GDAL, shapely and
+the rest can take longer than the work itself, most of all when there is
+nothing left to do in a directory. The scripts therefore only import the
+heavy packages on the code paths that use them, and take
+--profile-startup to show where the import time of a run goes.
+
+Importing the module calls profile_startup, so a script only has to
+import it before the imports it should measure. When --profile-startup
+is on the command line it wraps the import statement to time every module loaded
+from then on, and prints the time spent importing each top level package
+when the process exits. The time of a module doesn't include the modules
+it imports, which are counted under their own package.
+"""
+
+import atexit
+import builtins
+import sys
+import time
+
+# The number of packages listed in the report
+REPORT_SIZE = 15
+
+# The import statement before it was wrapped
+_import = builtins.__import__
+
+# The import time of every top level package, not counting the packages
+# it imports
+_package_times = {}
+
+# The time spent in nested imports of the imports in progress
+_nested = []
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    # Modules that are already loaded cost nothing worth timing
+    if level == 0 and name in sys.modules and not fromlist:
+        return _import(name, globals, locals, fromlist, level)
+
+    _nested.append(0.0)
+    start = time.perf_counter()
+    try:
+        return _import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = _nested.pop()
+        if _nested:
+            _nested[-1] += elapsed
+        # A relative import belongs to the package of the module making it
+        if level > 0:
+            name = (globals or {}).get('__package__') or name
+        package = name.split('.')[0]
+        _package_times[package] = _package_times.get(package, 0.0) + elapsed - nested
+
+
+def _report(started):
+    # Prints the import time of the packages that cost the most
+    total = time.perf_counter() - started
+    imports = sum(_package_times.values())
+    lines = ['Startup profile: {:.3f} s of {:.3f} s spent importing'.format(imports, total)]
+    for package, seconds in sorted(_package_times.items(), key=lambda item: -item[1])[
+            :REPORT_SIZE]:
+        lines.append('    {:<24} {:8.3f} s'.format(package, seconds))
+    print('\n'.join(lines), file=sys.stderr)
+
+
+def profile_startup(argv=None):
+    """
+    Starts timing the imports of the process if --profile-startup was
+    given, and prints them when the process exits.
+
+    Parameters:
+    argv - the command line arguments, or None for sys.argv
+
+    Return:
+    True if the imports are being timed
+    """
+
+    argv = sys.argv if argv is None else argv
+    if '--profile-startup' not in argv or builtins.__import__ is _timed_import:
+        return builtins.__import__ is _timed_import
+
+    builtins.__import__ = _timed_import
+    atexit.register(_report, time.perf_counter())
+
+    return True
+
+
+# Starts the timing as the scripts import the module, before their other
+# imports
+profile_startup()
@@ -0,0 +1,155 @@
+"""
+Helpers for walking a raster in windows instead of reading whole bands.
+
+The stage scripts use these so that the peak memory of a run depends on
+the size of a tile rather than on the size of the scene, and so that the
+tiles of one large scene can be spread over several cores.
+"""
+
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .encoding import decode
+
+# rasterio is imported by the functions using it. They are only called
+# with a dataset that is already open, so by then it is loaded, and a
+# script with nothing to do never loads GDAL
+
+
+def tile_windows(src, tile_size=0):
+    """
+    Generates the windows to process a dataset in.
+
+    Parameters:
+    src       - an open rasterio dataset
+    tile_size - the edge length of a square tile in pixels. If 0, the
+                internal block layout of the first band of src is used
+
+    Return:
+    Yields rasterio Window objects covering the whole dataset, row by row
+    """
+
+    from rasterio.windows import Window
+
+    # Follow the GeoTIFF's own blocks, each of which is decoded exactly once
+    if tile_size <= 0:
+        for _, window in src.block_windows(1):
+            yield window
+        return
+
+    # Otherwise cut the scene into tile_size x tile_size windows, clipping
+    # the last row and column of tiles to the edge of the image
+    for row_off in range(0, src.height, tile_size):
+        height = min(tile_size, src.height - row_off)
+        for col_off in range(0, src.width, tile_size):
+            width = min(tile_size, src.width - col_off)
+            yield Window(col_off, row_off, width, height)
+
+
+def whole_window(src):
+    """
+    Covers a dataset with a single window, for when the whole image is
+    processed at once.
+
+    Parameters:
+    src - an open rasterio dataset
+
+    Return:
+    A list holding one Window over the whole dataset
+    """
+
+    from rasterio.windows import Window
+
+    return [Window(0, 0, src.width, src.height)]
+
+
+def map_windows(src, windows, func, threads=1, out_dtype=None, pass_window=False,
+                masked=False):
+    """
+    Reads every window of a dataset and passes it through func, on a pool
+    of threads. The results come back in the order of the windows, so the
+    caller can act as the single thread writing them to the output.
+
+    Reading and the NumPy band math both release the GIL, so the tiles of
+    one scene are decoded and computed in parallel. A GDAL dataset handle
+    can't be shared between threads, so every thread opens its own handle
+    on the file behind src. A raw store maps its file, so its threads all
+    read from src itself. At most 2 * threads tiles are held in memory.
+
+    Parameters:
+    src         - the open rasterio dataset to read from
+    windows     - an iterable of the windows to read
+    func        - a function taking the (bands, rows, cols) block of a
+                  window and returning the computed result
+    threads     - the number of threads. 1 reads and computes in the
+                  calling thread with src itself
+    out_dtype   - the data type GDAL converts the blocks to while reading
+                  them, so func can work in place on a block of that type.
+                  None keeps the data type of src. When it is a float
+                  type, blocks of images with a scale and offset are
+                  decoded to their real values
+    pass_window - True to also pass the window to func, as func(block,
+                  window), for work that depends on where the tile is
+    masked      - True to read the valid-data mask of every window first.
+                  A window without valid pixels isn't read or computed,
+                  and comes back with None as its result. The others pass
+                  their uint8 mask to func after the block and window, as
+                  func(block, mask) or func(block, window, mask)
+
+    Return:
+    Yields (window, result) tuples in the order of windows
+    """
+
+    scaled = out_dtype is not None and np.dtype(out_dtype).kind == 'f'
+
+    def compute(handle, window):
+        if masked:
+            mask = handle.dataset_mask(window=window)
+            if not mask.any():
+                return None
+        block = handle.read(window=window, out_dtype=out_dtype)
+        if scaled:
+            block = decode(block, handle)
+        args = (block, window) if pass_window else (block,)
+        return func(*(args + (mask,) if masked else args))
+
+    if threads <= 1:
+        for window in windows:
+            yield window, compute(src, window)
+        return
+
+    local = threading.local()
+    handles = []
+    lock = threading.Lock()
+
+    from .rawstore import RawImage
+
+    def work(window):
+        if isinstance(src, RawImage):
+            return compute(src, window)
+        # Opens a handle for this thread the first time it runs a tile
+        if not hasattr(local, 'src'):
+            import rasterio
+            local.src = rasterio.open(src.name)
+            with lock:
+                handles.append(local.src)
+        return compute(local.src, window)
+
+    pending = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            for window in windows:
+                pending.append((window, pool.submit(work, window)))
+                # Hands back the oldest tile once enough are in flight
+                if len(pending) >= 2 * threads:
+                    window, future = pending.popleft()
+                    yield window, future.result()
+            while pending:
+                window, future = pending.popleft()
+                yield window, future.result()
+    finally:
+        for handle in handles:
+            handle.close()
@@ -0,0 +1,314 @@
+"""
+Turns class masks into polygons one tile at a time.
+
+Tracing a whole scene at once needs the whole mask in memory, so
+polygonize cuts the mask into tiles and traces each tile on its own. The
+outlines follow the pixel edges, so the pieces of a polygon crossing a
+seam share the edge along the seam exactly and merge back into one, and
+the polygons are the same whatever the tile size.
+
+Polygons not touching a seam are complete and are handed back right
+away, once the ones smaller than the minimum area are dropped and the
+rest are simplified. The pieces touching a seam are kept as they are,
+and the stretches of their outlines along the seams tell which of them
+meet: pieces of the same value sharing a stretch of a seam are joined in
+a union-find. Once a row of tiles is done, every group of pieces without
+a piece on the bottom of the row can't grow any more, so its pieces are
+merged into polygons, once, and handed back. Only the stretches along the
+bottom of the last row and the pieces of the groups still reaching it are
+kept, so a polygon is never merged again row after row and the work of a
+run grows with the size of the scene rather than with its square.
+"""
+
+import numpy as np
+from rasterio import Affine
+from rasterio.features import shapes
+from shapely.affinity import affine_transform, translate
+from shapely.geometry import Polygon
+from shapely.geometry.polygon import orient
+from shapely.ops import unary_union
+
+from .tiling import map_windows, tile_windows, whole_window
+
+
+def mask_polygons(mask, holes=True):
+    """
+    Traces the outlines of the non-zero areas of a mask, one polygon per
+    connected area of the same value. Only pixels sharing an edge are
+    connected, so that two polygons never touch at a single corner, which
+    keeps the outlines valid and lets the pieces of a polygon cut by a
+    seam merge the same way wherever the seam is.
+
+    Parameters:
+    mask  - a 2D uint8, uint16, int16 or int32 array
+    holes - False to leave out the holes of the polygons
+
+    Return:
+    A list of (polygon, value) tuples, with the polygons in the pixel
+    coordinates of the mask
+    """
+
+    polygons = []
+    # The identity transform keeps the polygons in pixel coordinates without
+    # rasterio warning that the mask isn't georeferenced
+    for geometry, value in shapes(mask, mask=np.not_equal(mask, 0), connectivity=4,
+                                  transform=Affine.identity()):
+        rings = geometry['coordinates']
+        polygons.append((Polygon(rings[0], rings[1:] if holes else None), int(value)))
+
+    return polygons
+
+
+def _world(transform, col_off, row_off):
+    # The pixel -> world transform of a tile in the order shapely takes it
+    return [transform.a, transform.b, transform.d, transform.e,
+            transform.a * col_off + transform.b * row_off + transform.c,
+            transform.d * col_off + transform.e * row_off + transform.f]
+
+
+def _merge(polygons, holes=True):
+    # Merges the pieces of a polygon cut by the seams. The holes of the
+    # pieces never reach a seam, so only their outlines are merged, which
+    # is much quicker on large polygons, and the holes are put back after
+    union = unary_union([Polygon(polygon.exterior) for polygon in polygons])
+    parts = getattr(union, 'geoms', [union])
+    inner = [hole for polygon in polygons for hole in polygon.interiors] if holes else []
+
+    merged = []
+    for part in parts:
+        # A hole closed by the merge is treated like the holes within a
+        # tile
+        rings = list(part.interiors) if holes else []
+        rings += [hole for hole in inner
+                  if len(parts) == 1 or part.contains(Polygon(hole).representative_point())]
+        # Drops the vertices left in the middle of straight edges where they
+        # crossed a seam
+        merged.append(Polygon(part.exterior, rings).simplify(0))
+
+    return merged
+
+
+def _stretches(polygon, width, height):
+    # The stretches of the outline of a piece lying on the edges of its
+    # tile, as lists of (start, end) offsets along the left, top, right and
+    # bottom edges. Holes never reach the edge of a tile
+    points = np.asarray(polygon.exterior.coords)
+    start, end = points[:-1], points[1:]
+
+    edges = []
+    for axis, at in ((0, 0), (1, 0), (0, width), (1, height)):
+        on = (start[:, axis] == at) & (end[:, axis] == at)
+        first, last = start[on, 1 - axis], end[on, 1 - axis]
+        edges.append(list(zip(np.minimum(first, last).tolist(),
+                              np.maximum(first, last).tolist())))
+
+    return edges
+
+
+def _find(parent, piece):
+    # The piece standing for the group of a piece, halving the path to it
+    while parent[piece] != piece:
+        parent[piece] = parent[parent[piece]]
+        piece = parent[piece]
+    return piece
+
+
+def _join(parent, members, before, after):
+    """
+    Joins the groups of the pieces of the same value on both sides of a
+    seam that share a stretch of it. Pieces touching at a single corner
+    aren't joined, like pixels touching at a corner aren't connected.
+
+    Parameters:
+    parent  - the dictionary of piece -> the piece it was joined to
+    members - the dictionary of the piece standing for a group -> the list
+              of the pieces of the group
+    before  - the sorted (start, end, value, piece) stretches of the
+              pieces above or left of the seam, in image pixels
+    after   - the same for the pieces below or right of the seam
+
+    Return:
+    None
+    """
+
+    i = j = 0
+    while i < len(before) and j < len(after):
+        first, second = before[i], after[j]
+        if first[2] == second[2] and max(first[0], second[0]) < min(first[1], second[1]):
+            first, second = _find(parent, first[3]), _find(parent, second[3])
+            if first != second:
+                # The smaller group joins the larger one
+                if len(members[first]) < len(members[second]):
+                    first, second = second, first
+                parent[second] = first
+                members[first].extend(members.pop(second))
+        # The stretches of each side don't overlap, so the one ending first
+        # can't meet anything else
+        if before[i][1] <= after[j][1]:
+            i += 1
+        else:
+            j += 1
+
+
+def _start_low(ring):
+    # Starts a closed ring at its lowest vertex. With the rings oriented
+    # and the holes sorted the same way, a polygon is simplified the same
+    # way wherever its tracing started
+    points = np.asarray(ring.coords)[:-1]
+    first = np.lexsort((points[:, 0], points[:, 1]))[0]
+    return np.roll(points, -first, axis=0)
+
+
+def _finish(polygon, simplify=0, min_area=0):
+    """
+    Drops a small polygon, fills its small holes and simplifies it.
+
+    Parameters:
+    polygon  - the complete polygon in pixel coordinates
+    simplify - the simplification tolerance in pixels. 0 keeps every
+               vertex
+    min_area - the smallest area of a polygon or hole kept, in pixels
+
+    Return:
+    The polygon, or None if it was dropped
+    """
+
+    if min_area > 0:
+        if polygon.area < min_area:
+            return None
+        if polygon.interiors:
+            polygon = Polygon(polygon.exterior,
+                              [hole for hole in polygon.interiors
+                               if Polygon(hole).area >= min_area])
+
+    if simplify > 0:
+        polygon = orient(polygon)
+        holes = sorted((_start_low(hole) for hole in polygon.interiors),
+                       key=lambda hole: (hole[0, 1], hole[0, 0]))
+        polygon = Polygon(_start_low(polygon.exterior), holes)
+        # Keeps the holes inside the shell and the rings from crossing
+        polygon = polygon.simplify(simplify, preserve_topology=True)
+
+    return polygon
+
+
+def polygonize_array(mask, transform=None, holes=True, simplify=0, min_area=0):
+    """
+    Traces the polygons of the non-zero pixels of a mask or label block
+    already in memory, all at once.
+
+    Parameters:
+    mask      - a 2D block, or a (1, rows, cols) block as read from an image
+    transform - the affine transform of the block, or None to keep the
+                polygons in pixel coordinates
+    holes     - False to write only the outlines of the polygons
+    simplify  - the simplification tolerance in pixels. 0 keeps every
+                vertex of the pixel edges
+    min_area  - the smallest area of a polygon or hole kept, in pixels
+
+    Return:
+    Yields (polygon, value) tuples like polygonize
+    """
+
+    mask = mask[0] if mask.ndim == 3 else mask
+    # Blocks of a type GDAL can't trace are traced as uint8, like images
+    if mask.dtype.name not in ('uint8', 'uint16', 'int16', 'int32'):
+        mask = mask.astype(np.uint8)
+    matrix = _world(transform or Affine.identity(), 0, 0)
+
+    for polygon, value in mask_polygons(mask, holes):
+        polygon = _finish(polygon, simplify, min_area)
+        if polygon is not None:
+            yield affine_transform(polygon, matrix), value
+
+
+def polygonize(src, tile_size=0, threads=1, holes=True, simplify=0, min_area=0):
+    """
+    Traces the polygons of the non-zero pixels of the first band of an
+    image, a tile at a time. A label image gets polygons for every label.
+
+    Parameters:
+    src       - the open rasterio dataset of the mask
+    tile_size - the edge length of a tile in pixels. 0 traces the whole
+                image at once
+    threads   - the number of threads reading and tracing tiles
+    holes     - False to write only the outlines of the polygons
+    simplify  - the simplification tolerance in pixels. 0 keeps every
+                vertex of the pixel edges
+    min_area  - the smallest area of a polygon or hole kept, in pixels
+
+    Return:
+    Yields (polygon, value) tuples of the shapely Polygons in the
+    coordinates of the image and the pixel value they cover
+    """
+
+    windows = tile_windows(src, tile_size) if tile_size > 0 else whole_window(src)
+    image = _world(src.transform, 0, 0)
+    # Images of a type GDAL can't trace are read as uint8
+    dtype = src.dtypes[0] if src.dtypes[0] in ('uint8', 'uint16', 'int16', 'int32') else 'uint8'
+
+    def trace(block):
+        return mask_polygons(block[0], holes)
+
+    def done(polygon, value, matrix):
+        # Hands back a complete polygon unless it is too small
+        polygon = _finish(polygon, simplify, min_area)
+        return None if polygon is None else (affine_transform(polygon, matrix), value)
+
+    # The pieces cut by a seam, in image pixels, and their groups
+    pieces, parent, members = {}, {}, {}
+    piece = 0
+    # The stretches along the bottom of the tiles of the last row and of
+    # the current one, by column offset, and along the right edge of the
+    # last tile
+    above, below, left = {}, {}, []
+    for window, polygons in map_windows(src, windows, trace, threads, out_dtype=dtype):
+        col_off, row_off = int(window.col_off), int(window.row_off)
+        width, height = int(window.width), int(window.height)
+        # The edges of the tile, in the order of the bounds of a polygon,
+        # other than the edges of the image. -1 matches no polygon
+        seams = (0 if col_off > 0 else -1, 0 if row_off > 0 else -1,
+                 width if col_off + width < src.width else -1,
+                 height if row_off + height < src.height else -1)
+
+        tile = _world(src.transform, col_off, row_off)
+        # The stretches of the pieces along each seam of the tile
+        edges = ([], [], [], [])
+        for polygon, value in polygons:
+            if not any(edge == seam for edge, seam in zip(polygon.bounds, seams)):
+                feature = done(polygon, value, tile)
+                if feature:
+                    yield feature
+                continue
+
+            piece += 1
+            pieces[piece] = (translate(polygon, col_off, row_off), value)
+            parent[piece], members[piece] = piece, [piece]
+            for side, stretches in enumerate(_stretches(polygon, width, height)):
+                if seams[side] >= 0:
+                    # Along the image, offset by the tile
+                    off = row_off if side % 2 == 0 else col_off
+                    edges[side].extend((start + off, end + off, value, piece)
+                                       for start, end in stretches)
+
+        if seams[0] >= 0:
+            _join(parent, members, left, sorted(edges[0]))
+        if seams[1] >= 0:
+            _join(parent, members, above.pop(col_off, []), sorted(edges[1]))
+        left, below[col_off] = sorted(edges[2]), sorted(edges[3])
+
+        # Once the last tile of a row is traced, the groups without a piece
+        # on the bottom of the row are complete and are merged
+        if col_off + width >= src.width:
+            growing = set(_find(parent, stretch[3]) for stretches in below.values()
+                          for stretch in stretches)
+            for group in [group for group in members if group not in growing]:
+                complete = members.pop(group)
+                for member in complete:
+                    del parent[member]
+                value = pieces[complete[0]][1]
+                for polygon in _merge([pieces.pop(member)[0] for member in complete], holes):
+                    feature = done(polygon, value, image)
+                    if feature:
+                        yield feature
+            above, below = below, {}
@@ -0,0 +1,226 @@
+"""
+Runs a chain of stages over a directory of scenes in one process.
+
+Running rad.py, atmcorr_specmath.py, refl.py, class.py and shp.py one
+after the other starts Python, imports rasterio, GDAL and the rest and
+lists the directory once per stage, and for every scene the stages are
+waiting on each other's whole directory. run takes the stages to run and
+hands every scene to a worker, which goes through all of the stages of
+that scene with the scene functions of the scripts. The imports are paid
+once per batch, and a scene is finished as soon as its own stages are.
+
+When rad, atmcorr and refl are all asked for, they are run by the fused
+calibration engine instead, which passes every tile from one step to the
+next in memory and reads the raw image once. It only writes the refl.tif
+image, unless the write_rad or write_atmcorr options ask for the others
+too, and the images it writes are the same as those of the separate
+stages. With --separate, the raw option
+hands rad and atmcorr to the next stage as raw memory mapped stores
+instead of GeoTIFFs, and refl writes the usual refl.tif image.
+
+The outputs are named and checked against the manifest exactly as by
+the scripts, so the pipeline and the scripts can be mixed on the same
+directory.
+"""
+
+import os
+import xml.etree.ElementTree as ET
+from importlib import import_module
+
+from .lib.calibration import avgs_finder
+from .lib.metadata import read_metadata
+from .lib.parallel import run_scenes
+from .lib.rawstore import raw_name
+from .lib.solar import earth_sun_distances
+
+# The stages in the order they run
+STAGES = ['rad', 'atmcorr', 'refl', 'class', 'shp']
+
+# The atmospheric correction values used when no atmcorr_regr.py output
+# is given
+DEFAULT_ATMCORR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'lib',
+                               'atmcorr_temp.txt')
+
+# The options of the stages and their defaults, which are the defaults of
+# the scripts
+OPTIONS = {'tile_size': 0, 'threads': 1, 'profile': None, 'encoding': 'float32',
+           'atm_temp': '', 'fused': True, 'write_rad': False, 'write_atmcorr': False,
+           'raw': False, 'sun_grid': False,
+           'labels': False, 'rules': None, 'write_masks': False, 'write_sumbands': False,
+           'format': 'shp', 'holes': True, 'simplify': 0, 'min_area': 0}
+
+
+def _script(name):
+    # Imports a stage script of the package, e.g. cal.rad. class.py can't
+    # be imported with an import statement since class is a keyword
+    return import_module('.' + name, __package__)
+
+
+def raw_images(input_dir):
+    """
+    Finds the raw images of a directory the same way rad.py does.
+
+    Parameters:
+    input_dir - the directory with the raw images and their .xml files
+
+    Return:
+    A sorted list of the names of the raw .tif images
+    """
+
+    return sorted(f for f in os.listdir(input_dir)
+                  if (f.endswith('.tif') and ('rad' not in f) and
+                      ('atmcorr' not in f) and
+                      ('refl' not in f) and
+                      ('P1BS' not in f) and
+                      not f.startswith('.')))
+
+
+def run_scene(input_dir, output_dir, raw_file, stages, options):
+    """
+    Runs the stages of one scene one after the other. Every stage reads
+    the outputs of the stage before it from the output directory, or the
+    outputs of an earlier run if that stage isn't in the chain.
+
+    Parameters:
+    input_dir  - the directory with the raw image and its .xml
+    output_dir - the directory to write every output into
+    raw_file   - the name of the raw .tif image
+    stages     - a list of the stages to run, from STAGES
+    options    - a dict of the options in OPTIONS
+
+    Return:
+    None
+    """
+
+    xml_path = os.path.abspath(os.path.join(input_dir, raw_file.replace('.tif', '.xml')))
+    if not os.path.isfile(xml_path):
+        raise IOError('XML: ' + xml_path + ' does not exist')
+
+    # The images of the scene, named the way the scripts name them
+    rad_file = raw_file.replace('.tif', '_rad.tif')
+    atmcorr_file = rad_file.replace('.tif', '_atmcorr.tif')
+    raw = options['raw']
+    if raw:
+        rad_file, atmcorr_file = raw_name(rad_file), raw_name(atmcorr_file)
+    # refl.py uses the corrected image when there is one
+    if 'atmcorr' in stages or os.path.isfile(os.path.join(output_dir, atmcorr_file)):
+        refl_input = atmcorr_file
+    else:
+        refl_input = rad_file
+    refl_file = os.path.splitext(refl_input)[0] + '_refl.tif'
+
+    tile_size, threads = options['tile_size'], options['threads']
+    profile, encoding = options['profile'], options['encoding']
+    atm_temp = options['atm_temp']
+
+    calibration = [stage for stage in ('rad', 'atmcorr', 'refl') if stage in stages]
+    if options['fused'] and len(calibration) == 3:
+        averages = (avgs_finder(atm_temp, False) if atm_temp != ''
+                    else avgs_finder(DEFAULT_ATMCORR, True))
+        # The intermediate images are only written when asked for, like
+        # calibrate.py does
+        products = ['refl']
+        if options['write_rad']:
+            products.append('rad')
+        if options['write_atmcorr']:
+            products.append('atmcorr')
+        _script('cal.calibrate').calibrate_scene(input_dir, output_dir, raw_file, averages,
+                                                 products, tile_size, threads, profile,
+                                                 encoding, options['sun_grid'])
+    else:
+        if 'rad' in stages:
+            _script('cal.rad').radiance_scene(input_dir, output_dir, raw_file, tile_size,
+                                              threads, profile, encoding, raw)
+        if 'atmcorr' in stages:
+            # spec_mather joins the directory and the name without a separator
+            _script('cal.atmcorr_specmath').specmath_scene(
+                os.path.join(output_dir, ''), output_dir, rad_file, atm_temp, DEFAULT_ATMCORR,
+                tile_size, threads, profile, encoding, raw)
+        if 'refl' in stages:
+            # The .xml stays next to the raw image. Joined with the output
+            # directory, its absolute path is kept as it is
+            _script('cal.refl').reflectance_scene(output_dir, output_dir, xml_path, refl_input,
+                                                  tile_size, threads, profile,
+                                                  encoding, sun_grid=options['sun_grid'])
+
+    if 'class' in stages:
+        classifier = _script('classification.class')
+        if options['labels'] or options['rules']:
+            classifier.label_scene(output_dir, output_dir, refl_file, options['write_masks'],
+                                   options['write_sumbands'], tile_size, threads, profile,
+                                   options['rules'])
+        else:
+            classifier.class_scene(output_dir, output_dir, refl_file, profile)
+
+    if 'shp' in stages:
+        shp = _script('classification.shp')
+        # Every class image of the scene, grouped by the vector file it is
+        # written to like shp.py does
+        prefix = refl_file.replace('.tif', '_class_')
+        outputs = {}
+        for f2 in sorted(os.listdir(output_dir)):
+            if f2.startswith(prefix) and f2.endswith('.tif'):
+                outputs.setdefault(shp.scene_output(f2, options['format']), []).append(f2)
+        for files in outputs.values():
+            shp.shp_scene(output_dir, output_dir, files, options['format'], tile_size, threads,
+                          options['holes'], options['simplify'], options['min_area'])
+
+
+def run(input_dir, output_dir, stages=None, workers=1, scenes=None, **options):
+    """
+    Runs a chain of stages over every raw image of a directory.
+
+    Parameters:
+    input_dir  - the directory with the raw images and their .xml files
+    output_dir - the directory to write every output into
+    stages     - the stages to run, from STAGES, or None for all of them.
+                 They always run in the order of STAGES
+    workers    - the number of scenes to process at the same time
+    scenes     - the names of the raw images to process, or None for all
+                 of them
+    options    - the options of the stages, see OPTIONS
+
+    Return:
+    A list of the names of the raw images that failed
+    """
+
+    if stages is None:
+        stages = STAGES
+    if not os.path.isdir(input_dir):
+        raise IOError('The input directory ' + input_dir + ' does not exist')
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        raise ValueError('Unknown stages: ' + ', '.join(unknown))
+    unknown = [option for option in options if option not in OPTIONS]
+    if unknown:
+        raise ValueError('Unknown options: ' + ', '.join(unknown))
+    stages = [stage for stage in STAGES if stage in stages]
+    options = dict(OPTIONS, **options)
+
+    raw_files = raw_images(input_dir)
+    if scenes is not None:
+        unknown = [scene for scene in scenes if scene not in raw_files]
+        if unknown:
+            raise ValueError('No raw images named: ' + ', '.join(unknown))
+        raw_files = [f for f in raw_files if f in scenes]
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    # Computes the Earth-Sun distances of the whole batch at once. The
+    # workers are forked from this process, so they share the table
+    if 'refl' in stages:
+        tlctimes = []
+        for f in raw_files:
+            # A scene whose .xml is missing or broken fails in its worker
+            try:
+                tlctimes.append(read_metadata(os.path.join(
+                    input_dir, f.replace('.tif', '.xml'))).tlctime)
+            except (OSError, ValueError, ET.ParseError):
+                continue
+        earth_sun_distances(tlctimes)
+
+    return run_scenes(run_scene,
+                      [(f, (input_dir, output_dir, f, stages, options))
+                       for f in raw_files],
+                      workers)
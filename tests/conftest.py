@@ -0,0 +1,16 @@
+"""
+Imports src as the landcover package, the name it is installed under, so
+the tests import the package the way its users do.
+"""
+
+import importlib.util
+import os
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src')
+
+if 'landcover' not in sys.modules:
+    _spec = importlib.util.spec_from_file_location(
+        'landcover', os.path.join(SRC_DIR, '__init__.py'), submodule_search_locations=[SRC_DIR])
+    sys.modules['landcover'] = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(sys.modules['landcover'])
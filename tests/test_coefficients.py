@@ -0,0 +1,77 @@
+"""
+Tests the lookup of the calibration coefficients of a scene and the
+checks of the coefficient file.
+"""
+
+import json
+
+import pytest
+
+from landcover.lib.calibration import BANDS
+from landcover.lib.coefficients import load_registry, sensor_coefficients
+
+
+def entry(version, effective, bands=BANDS, gain=1.0):
+    return {'version': version, 'effective': effective, 'source': 'test',
+            'bands': list(bands), 'gain': [gain] * len(bands),
+            'offset': [0.0] * len(bands), 'esun': [1000.0] * len(bands)}
+
+
+def write_registry(path, config):
+    with open(path, 'w') as f:
+        json.dump(config, f)
+    return str(path)
+
+
+@pytest.fixture
+def registry(tmp_path):
+    # Two versions of WV02, the second one effective from 2016
+    return write_registry(tmp_path / 'coefficients.json',
+                          {'WV02': [entry('v2', '2016-01-01', gain=2.0),
+                                    entry('v1', '2009-10-08')]})
+
+
+def test_shipped_registry():
+    registry = load_registry()
+    assert set(registry) >= {'WV02', 'WV03'}
+    for versions in registry.values():
+        for coefficients in versions:
+            assert coefficients.bands == BANDS
+            assert not coefficients.gain.flags.writeable
+
+
+def test_unknown_satid(registry):
+    with pytest.raises(ValueError, match='WV02'):
+        sensor_coefficients('GE01', '2012-02-03T21:48:24.000000Z', registry)
+
+
+@pytest.mark.parametrize('tlctime, version', [
+    ('2009-10-08T00:00:00.000000Z', 'v1'),
+    ('2015-12-31T23:59:59.999999Z', 'v1'),
+    ('2016-01-01T00:00:00.000000Z', 'v2'),
+    ('2020-06-15T12:00:00.000000Z', 'v2'),
+    (None, 'v2')])
+def test_effective_version(registry, tlctime, version):
+    coefficients = sensor_coefficients('WV02', tlctime, registry)
+    assert coefficients.version == version
+    assert coefficients.gain[0] == (2.0 if version == 'v2' else 1.0)
+
+
+def test_before_first_version(registry):
+    with pytest.raises(ValueError, match='start on 2009-10-08'):
+        sensor_coefficients('WV02', '2009-10-07T23:59:59.000000Z', registry)
+
+
+@pytest.mark.parametrize('bands', [BANDS[:7], BANDS[1:] + BANDS[:1]])
+def test_wrong_bands(tmp_path, bands):
+    path = write_registry(tmp_path / 'bands.json', {'WV02': [entry('v1', '2009-10-08', bands)]})
+    with pytest.raises(ValueError, match='bands'):
+        load_registry(path)
+
+
+def test_short_values(tmp_path):
+    bad = entry('v1', '2009-10-08')
+    bad['esun'] = bad['esun'][:7]
+    path = write_registry(tmp_path / 'short.json', {'WV02': [bad]})
+    with pytest.raises(ValueError, match='esun'):
+        load_registry(path)
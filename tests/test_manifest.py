@@ -0,0 +1,92 @@
+"""
+Tests when the manifest takes a product as current and when it has it
+made again.
+"""
+
+import os
+
+import pytest
+
+from landcover.lib.manifest import code_version, is_current, record
+
+CODE = 'code'
+PARAMS = {'profile': 'fast', 'encoding': 'float32'}
+
+
+def write(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+@pytest.fixture
+def product(tmp_path):
+    # A recorded product made from an image and its .xml
+    inputs = [str(tmp_path / 'scene.tif'), str(tmp_path / 'scene.xml')]
+    outputs = [str(tmp_path / 'scene_rad.tif'), str(tmp_path / 'scene_rad.tif.aux.xml')]
+    write(inputs[0], 'image')
+    write(inputs[1], '<isd>metadata</isd>')
+    for path in outputs:
+        write(path, 'output')
+    record('rad', outputs, inputs, PARAMS, CODE)
+    return outputs, inputs
+
+
+def test_recorded_product_is_current(product):
+    outputs, inputs = product
+    assert is_current(outputs, inputs, dict(PARAMS), CODE)
+
+
+def test_unrecorded_output_is_made(tmp_path):
+    # An output left behind by a killed job was never recorded
+    write(str(tmp_path / 'scene.tif'), 'image')
+    write(str(tmp_path / 'scene_rad.tif'), 'partial')
+    assert not is_current([str(tmp_path / 'scene_rad.tif')], [str(tmp_path / 'scene.tif')],
+                          PARAMS, CODE)
+
+
+def test_partial_output_is_made(product):
+    outputs, inputs = product
+    write(outputs[1], 'outp')
+    assert not is_current(outputs, inputs, PARAMS, CODE)
+
+
+def test_missing_output_is_made(product):
+    outputs, inputs = product
+    os.remove(outputs[1])
+    assert not is_current(outputs, inputs, PARAMS, CODE)
+
+
+def test_touched_xml_is_unchanged(product):
+    outputs, inputs = product
+    stat = os.stat(inputs[1])
+    os.utime(inputs[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert is_current(outputs, inputs, PARAMS, CODE)
+
+
+def test_changed_input_is_made(product):
+    outputs, inputs = product
+    write(inputs[1], '<isd>other metadata</isd>')
+    assert not is_current(outputs, inputs, PARAMS, CODE)
+
+
+def test_new_input_is_made(product, tmp_path):
+    outputs, inputs = product
+    write(str(tmp_path / 'coefficients.json'), '{}')
+    assert not is_current(outputs, inputs + [str(tmp_path / 'coefficients.json')], PARAMS, CODE)
+
+
+def test_changed_param_is_made(product):
+    outputs, inputs = product
+    assert not is_current(outputs, inputs, dict(PARAMS, encoding='uint16'), CODE)
+
+
+def test_changed_code_is_made(product):
+    outputs, inputs = product
+    assert not is_current(outputs, inputs, PARAMS, 'other code')
+
+
+def test_code_version_depends_on_modules():
+    script = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src', 'cal',
+                          'rad.py')
+    assert code_version(script, 'calibration') == code_version(script, 'calibration')
+    assert code_version(script, 'calibration') != code_version(script, 'calibration', 'tiling')
@@ -0,0 +1,34 @@
+"""
+Tests that a broken .xml is reported as a ValueError.
+"""
+
+import pytest
+
+from landcover.lib.calibration import BANDS
+from landcover.lib.metadata import parse_metadata
+
+
+def write_xml(path, image=('SATID', 'TLCTIME', 'MEANSUNEL'), bands=BANDS):
+    values = {'SATID': 'WV02', 'TLCTIME': '2010-10-25T20:52:21.000000Z', 'MEANSUNEL': '30.5'}
+    fields = ''.join('<{0}>{1}</{0}>'.format(tag, values[tag]) for tag in image)
+    band_xml = ''.join('<{0}><ABSCALFACTOR>0.01</ABSCALFACTOR>'
+                       '<EFFECTIVEBANDWIDTH>0.05</EFFECTIVEBANDWIDTH></{0}>'.format(band)
+                       for band in bands)
+    path.write_text('<isd><IMD><IMAGE>' + fields + '</IMAGE>' + band_xml + '</IMD></isd>')
+    return str(path)
+
+
+def test_complete_xml(tmp_path):
+    scene = parse_metadata(write_xml(tmp_path / 'scene.xml'))
+    assert scene.satid == 'WV02' and scene.meansunel == 30.5
+    assert len(scene.abscalfactor) == len(BANDS)
+
+
+def test_missing_image_element(tmp_path):
+    with pytest.raises(ValueError, match='SATID'):
+        parse_metadata(write_xml(tmp_path / 'scene.xml', image=('TLCTIME', 'MEANSUNEL')))
+
+
+def test_missing_band(tmp_path):
+    with pytest.raises(ValueError, match=BANDS[-1]):
+        parse_metadata(write_xml(tmp_path / 'scene.xml', bands=BANDS[:-1]))
@@ -0,0 +1,18 @@
+"""
+Tests that importing the package leaves the import path of its users
+alone.
+"""
+
+import sys
+
+
+def test_import_keeps_the_path():
+    path = list(sys.path)
+    import landcover.api  # noqa: F401
+    import landcover.cli  # noqa: F401
+    import landcover.cal.rad  # noqa: F401
+    import landcover.classification.shp  # noqa: F401
+
+    assert sys.path == path
+    # The helpers are only loaded as part of the package
+    assert 'lib' not in sys.modules and 'pipeline' not in sys.modules
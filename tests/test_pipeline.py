@@ -0,0 +1,21 @@
+"""
+Tests how landcover run reports a missing directory and a broken scene.
+"""
+
+import pytest
+
+from landcover.pipeline import run
+
+
+def test_missing_input_dir(tmp_path):
+    with pytest.raises(IOError, match='does not exist'):
+        run(str(tmp_path / 'missing'), str(tmp_path))
+
+
+def test_broken_xml_fails_only_its_scene(tmp_path):
+    (tmp_path / 'WV02_A.tif').write_bytes(b'')
+    (tmp_path / 'WV02_A.xml').write_text('<isd><IMD><IMAGE></IMAGE></IMD></isd>')
+    (tmp_path / 'WV02_B.tif').write_bytes(b'')
+    (tmp_path / 'WV02_B.xml').write_text('<isd')
+
+    assert run(str(tmp_path), str(tmp_path), stages=['refl']) == ['WV02_A.tif', 'WV02_B.tif']
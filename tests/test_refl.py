@@ -0,0 +1,24 @@
+"""
+Tests that refl.py converts every image with the .xml of its own scene.
+"""
+
+import pytest
+
+from landcover.cal.refl import reflectance_scene, scene_xml
+
+
+@pytest.mark.parametrize('image, xml', [
+    ('WV02_A_rad.tif', 'WV02_A.xml'),
+    ('WV02_A_rad_atmcorr.tif', 'WV02_A.xml'),
+    ('WV03_B_rad_atmcorr.bip', 'WV03_B.xml'),
+    ('WV03_B_rad.bip', 'WV03_B.xml'),
+])
+def test_scene_xml(image, xml):
+    assert scene_xml(image) == xml
+
+
+def test_missing_xml_fails_the_scene(tmp_path):
+    (tmp_path / 'WV02_A.xml').write_text('<isd/>')
+    with pytest.raises(IOError, match='WV03_B.xml'):
+        reflectance_scene(str(tmp_path), str(tmp_path), scene_xml('WV03_B_rad_atmcorr.tif'),
+                          'WV03_B_rad_atmcorr.tif')
@@ -0,0 +1,80 @@
+"""
+Tests the compiler of the spectral class rules.
+"""
+
+import json
+
+import numpy as np
+import pytest
+
+from landcover.lib.classify import CLASSES, class_labels, class_masks, sum_bands
+from landcover.lib.rules import RuleSet
+
+NDWI = {'indices': {'ndwi': '(B3 - B7) / (B3 + B7)'},
+        'classes': [{'name': 'water', 'label': 1, 'rule': 'ndwi > 0.3 and B3 + B7 > 0.1'},
+                    {'name': 'bright', 'label': 2, 'rule': 'B3 + B7 > 1'}]}
+
+
+def reflectance_block(rows=64, cols=64):
+    # Multiples of 1/16 add up exactly in any order, so the band sums hit
+    # the class thresholds exactly for some pixels
+    rng = np.random.default_rng(0)
+    return (rng.integers(0, 13, size=(8, rows, cols)) / 16).astype(np.float32)
+
+
+def classes(*entries):
+    return {'classes': [dict(entry, rule='B1 > 0') for entry in entries]}
+
+
+def test_shared_subexpressions():
+    ruleset = RuleSet(NDWI)
+
+    # B3 + B7 is used by the index and by both rules, but is computed once
+    assert ruleset.steps.count(('add', ('band', 2), ('band', 6))) == 1
+    assert len(ruleset.steps) == len(set(ruleset.steps))
+    # 5 steps for the index, then only the constants, comparisons and the
+    # and of the rules are new
+    assert len(ruleset.steps) == 12
+
+
+def test_rules_match_numpy():
+    block = reflectance_block()
+    b3, b7 = block[2], block[6]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        water = ((b3 - b7) / (b3 + b7) > 0.3) & (b3 + b7 > 0.1)
+    expected = np.where(water, 1, np.where(b3 + b7 > 1, 2, 0))
+
+    assert np.array_equal(RuleSet(NDWI).labels(block)[0], expected)
+
+
+def test_default_labels_match_masks():
+    block = reflectance_block()
+    ruleset = RuleSet.from_file()
+    labels = ruleset.labels(block)
+    summed = sum_bands(block)
+    masks = class_masks(summed)
+
+    assert np.array_equal(labels, class_labels(summed))
+    assert sorted(cls.name for cls in ruleset.classes) == sorted(CLASSES)
+    for cls in ruleset.classes:
+        assert np.array_equal(labels[0] == cls.label, masks[cls.name][0] == 1)
+
+
+def test_from_file(tmp_path):
+    path = tmp_path / 'rules.json'
+    path.write_text(json.dumps(NDWI))
+    assert [cls.name for cls in RuleSet.from_file(str(path)).classes] == ['water', 'bright']
+
+
+@pytest.mark.parametrize('config, message', [
+    (classes({'name': 'water', 'label': 1}, {'name': 'water', 'label': 2}), 'named water'),
+    (classes({'name': 'water', 'label': 1}, {'name': 'snow', 'label': 1}), 'same label'),
+    (classes({'name': '../water', 'label': 1}), 'letters'),
+    (classes({'name': 'open water', 'label': 1}), 'letters'),
+    (classes({'name': '', 'label': 1}), 'letters'),
+    (classes({'name': 'water', 'label': 0}), '1 to 255'),
+    ({'classes': [{'name': 'water', 'label': 1, 'rule': 'B9 > 0'}]}, 'Unknown name'),
+    ({'indices': {'B1': 'B2'}, 'classes': []}, 'name of a band')])
+def test_invalid_rules(config, message):
+    with pytest.raises(ValueError, match=message):
+        RuleSet(config)
@@ -0,0 +1,74 @@
+"""
+Tests that tracing a mask in tiles gives the same polygons as tracing it
+whole, whatever seams cut them.
+"""
+
+import numpy as np
+import pytest
+from rasterio import Affine
+from rasterio.io import MemoryFile
+
+from landcover.lib.vectorize import polygonize
+
+SIZE = 48
+# 2 m pixels of a polar stereographic scene
+TRANSFORM = Affine(2, 0, 500000, 0, -2, -1200000)
+
+
+def synthetic_mask():
+    # A class spanning the scene, a ring whose hole is cut by the seams of
+    # most tile sizes, two squares of a class and a checkerboard touching
+    # only at their corners
+    mask = np.zeros((SIZE, SIZE), dtype=np.uint8)
+    mask[20:24, :] = 1
+    mask[:, 30:33] = 1
+    mask[2:16, 2:16] = 2
+    mask[6:12, 6:12] = 0
+    mask[32:36, 8:12] = 3
+    mask[36:40, 12:16] = 3
+    mask[40:44, 40:44] = np.indices((4, 4)).sum(axis=0) % 2 * 4
+    return mask
+
+
+def key(features):
+    # The polygons in an order and form independent of the tracing
+    return sorted((value, polygon.normalize().wkb) for polygon, value in features)
+
+
+@pytest.fixture(scope='module')
+def src():
+    with MemoryFile() as memfile:
+        with memfile.open(driver='GTiff', width=SIZE, height=SIZE, count=1,
+                          dtype='uint8', crs='EPSG:3031', transform=TRANSFORM) as dst:
+            dst.write(synthetic_mask(), 1)
+        with memfile.open() as dataset:
+            yield dataset
+
+
+def test_whole_trace(src):
+    features = list(polygonize(src))
+    values = [value for _, value in features]
+
+    # The spanning class is one polygon, the ring keeps its hole, and the
+    # shapes touching at a corner stay apart
+    assert values.count(1) == 1
+    assert values.count(2) == 1
+    assert values.count(3) == 2
+    assert values.count(4) == 8
+    ring = [polygon for polygon, value in features if value == 2][0]
+    assert len(ring.interiors) == 1
+    assert ring.area == (14 * 14 - 6 * 6) * 4
+
+
+@pytest.mark.parametrize('tile_size', [5, 6, 8, 12, 14, 17, 47])
+@pytest.mark.parametrize('holes', [True, False])
+def test_tiles_match_whole(src, tile_size, holes):
+    whole = key(polygonize(src, holes=holes))
+    assert key(polygonize(src, tile_size, holes=holes)) == whole
+    assert key(polygonize(src, tile_size, threads=3, holes=holes)) == whole
+
+
+@pytest.mark.parametrize('tile_size', [6, 12])
+def test_tiles_match_whole_simplified(src, tile_size):
+    whole = key(polygonize(src, simplify=1.5, min_area=10))
+    assert key(polygonize(src, tile_size, simplify=1.5, min_area=10)) == whole
@@ -0,0 +1,180 @@
+"""
+Micro-benchmark of the calibration kernels in lib/calibration.py against
+the band by band loops rad.py and refl.py used before.
+
+A synthetic 8 band block of raw digital numbers is converted to radiance
+and then to reflectance, both ways. For each way the script prints the
+throughput and how much memory NumPy allocated on top of the input block
+and the output, in units of one float32 band. The band loops make several
+band sized temporaries per band, while the kernels write into the
+preallocated output and make none.
+
+The script should be called from console, e.g.
+> python bench_kernels.py --rows 2048 --cols 2048 --repeats 5
+"""
+
+import os
+import argparse
+import sys
+import math
+import time
+import tracemalloc
+
+import numpy as np
+
+# Makes the shared helpers in lib importable no matter where the script
+# is called from
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+from lib.calibration import radiance, reflectance  # noqa: E402
+from lib.coefficients import sensor_coefficients  # noqa: E402
+
+# The latest coefficients of WV02
+WV02 = sensor_coefficients('WV02')
+
+# Typical WV02 values of the .xml metadata
+ABSCALFACTOR = [9.295654e-03, 1.783568e-02, 1.364197e-02, 6.810718e-03,
+                1.851735e-02, 6.063145e-03, 2.050828e-02, 9.042234e-03]
+EFFBANDWIDTH = [4.730000e-02, 5.430000e-02, 6.300000e-02, 3.740000e-02,
+                5.740000e-02, 3.930000e-02, 9.890000e-02, 9.960000e-02]
+DIST = 0.99
+MEANSUNEL = 35.0
+
+
+def args_parser():
+    """
+    Reads in the size of the synthetic block from the console
+
+    Parameters:
+    None
+
+    Return:
+    Returns the parsed console arguments
+    """
+
+    parser = argparse.ArgumentParser(description='Benchmarks the calibration kernels ' +
+                                     'against the band by band loops')
+
+    parser.add_argument('-r', '--rows', type=int, default=2048,
+                        help=('The number of rows of the synthetic block'))
+    parser.add_argument('-c', '--cols', type=int, default=2048,
+                        help=('The number of columns of the synthetic block'))
+    parser.add_argument('-n', '--repeats', type=int, default=5,
+                        help=('The number of timed runs of each way. The best one is kept'))
+
+    return parser.parse_args()
+
+
+def band_loop(dn, out):
+    """
+    Converts the block the way rad.py and refl.py used to, one band at a
+    time.
+
+    Parameters:
+    dn  - the (8, rows, cols) uint16 block
+    out - the float32 array the reflectance is written into
+
+    Return:
+    None
+    """
+
+    gain = WV02.gain
+    offset = WV02.offset
+    esun = WV02.esun
+    meansunel = np.float32(MEANSUNEL)
+
+    for i in range(len(dn)):
+        abscalfactor = np.float32(ABSCALFACTOR[i])
+        effbandwidth = np.float32(EFFBANDWIDTH[i])
+        rad = np.float32(gain[i]) * dn[i] * (abscalfactor / effbandwidth) + np.float32(offset[i])
+        out[i] = (rad * math.pi * (DIST ** 2) /
+                  (esun[i] * math.sin(math.radians(meansunel))))
+
+
+def kernels(dn, out):
+    """
+    Converts the block with the broadcasting kernels, in place in out.
+
+    Parameters:
+    dn  - the (8, rows, cols) uint16 block
+    out - the float32 array the reflectance is written into
+
+    Return:
+    None
+    """
+
+    radiance(dn, WV02.gain, WV02.offset, ABSCALFACTOR, EFFBANDWIDTH, out=out)
+    reflectance(out, DIST, WV02.esun, MEANSUNEL, out=out)
+
+
+def measure(func, dn, repeats):
+    """
+    Times a way of converting the block and measures the memory it
+    allocates.
+
+    Parameters:
+    func    - band_loop or kernels
+    dn      - the (8, rows, cols) uint16 block
+    repeats - the number of timed runs
+
+    Return:
+    A tuple of the best time in seconds, the peak memory allocated on top
+    of the block and the output in bytes, and the output
+    """
+
+    out = np.empty(dn.shape, dtype=np.float32)
+
+    # NumPy reports its array buffers to tracemalloc, so the peak is the
+    # largest amount of temporaries alive at once
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    func(dn, out)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(dn, out)
+        best = min(best, time.perf_counter() - start)
+
+    return best, peak, out
+
+
+def main():
+    """
+    Main function. Runs both ways on the same block, checks that they give
+    the same reflectance and prints the results.
+
+    Parameters:
+    None
+
+    Return:
+    None
+    """
+
+    args = args_parser()
+
+    rng = np.random.default_rng(0)
+    dn = rng.integers(0, 2048, size=(8, args.rows, args.cols), dtype=np.uint16)
+    band_bytes = args.rows * args.cols * 4
+    megapixels = dn.size / 1e6
+
+    print('{} x {} x 8 block, best of {} runs'.format(args.rows, args.cols, args.repeats))
+    print('{:<10} {:>12} {:>14} {:>20}'.format('', 'time (s)', 'Mpix/s', 'temporaries (bands)'))
+
+    results = {}
+    for name, func in [('band loop', band_loop), ('kernels', kernels)]:
+        best, peak, out = measure(func, dn, args.repeats)
+        results[name] = out
+        print('{:<10} {:>12.4f} {:>14.1f} {:>20.2f}'.format(name, best, megapixels / best,
+                                                            peak / band_bytes))
+
+    # The loop computes reflectance in float64 before storing it, so the
+    # two only agree to float32 precision
+    diff = np.abs(results['band loop'] - results['kernels']).max()
+    print('largest difference: {:.3g}'.format(diff))
+
+
+# If the script was directly called, run the script
+if __name__ == '__main__':
+    main()
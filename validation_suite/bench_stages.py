@@ -0,0 +1,523 @@
+"""
+Benchmark of the stage scripts on synthetic WorldView scenes.
+
+For every satellite and size asked for, the script writes a synthetic 8
+band uint16 scene with a matching .xml and ENVI plot files of collected
+spectra, then runs atmcorr_regr.py, rad.py, atmcorr_specmath.py, refl.py,
+class.py and shp.py on it the way they are run from the console, each in
+its own process. Every stage is timed from the start of its process to
+its exit, so the startup of the script is part of its time.
+
+For each stage the script reports the wall time, the throughput in
+megapixels of the scene per second, the peak resident memory of the
+process, the bytes it read from and wrote to storage and the size of its
+input files, and saves them as JSON. The bytes come from /proc/self/io,
+so reads served from the page cache, e.g. of an image the stage before
+just wrote, aren't counted, and are left out where /proc doesn't exist.
+Given the JSON of an earlier run with --compare, it prints how much
+faster or slower each stage got and exits with an error if any stage got
+slower by more than --threshold, so two commits can be compared on the
+same machine:
+
+> python bench_stages.py --sizes 1024,4096 --output before.json
+> git checkout <other commit>
+> python bench_stages.py --sizes 1024,4096 --output after.json --compare before.json
+
+The scenes are written a strip at a time, so sizes up to 40000 x 40000
+pixels only need the disk space of the images.
+"""
+
+import os
+import argparse
+import glob
+import json
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.warp import transform as warp_transform
+from rasterio.windows import Window
+
+# The directory of the stage scripts
+SRC_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+from lib.manifest import MANIFEST_NAME  # noqa: E402
+
+# The stages in the order they are run, with the script running each one
+# and the images it reads. {scene} is the name of the raw image without
+# .tif
+STAGES = [('atmcorr_regr', os.path.join('cal', 'atmcorr_regr.py'),
+           ['{scene}_rad_atmcorr*.txt']),
+          ('rad', os.path.join('cal', 'rad.py'), ['{scene}.tif']),
+          ('atmcorr_specmath', os.path.join('cal', 'atmcorr_specmath.py'),
+           ['{scene}_rad.tif']),
+          ('refl', os.path.join('cal', 'refl.py'), ['{scene}_rad_atmcorr.tif']),
+          ('class', os.path.join('classification', 'class.py'),
+           ['{scene}_rad_atmcorr_refl.tif']),
+          ('shp', os.path.join('classification', 'shp.py'),
+           ['{scene}_rad_atmcorr_refl_class_*.tif'])]
+
+# The .xml values of each satellite. The ABSCALFACTOR and
+# EFFECTIVEBANDWIDTH of each band are typical of real scenes
+SATELLITES = {
+    'WV02': {'tlctime': '2010-10-25T20:52:21.032000Z', 'meansunel': 30.5,
+             'abscalfactor': [9.295654e-03, 1.783568e-02, 1.364197e-02, 6.810718e-03,
+                              1.851735e-02, 6.063145e-03, 2.050828e-02, 9.042234e-03],
+             'effbandwidth': [4.73e-02, 5.43e-02, 6.30e-02, 3.74e-02,
+                              5.74e-02, 3.93e-02, 9.89e-02, 9.96e-02]},
+    'WV03': {'tlctime': '2016-01-15T14:05:10.500000Z', 'meansunel': 40.2,
+             'abscalfactor': [8.638036e-03, 1.767625e-02, 1.298608e-02, 6.672986e-03,
+                              1.828717e-02, 6.205879e-03, 2.030009e-02, 8.964100e-03],
+             'effbandwidth': [4.05e-02, 5.40e-02, 6.18e-02, 3.81e-02,
+                              5.85e-02, 3.87e-02, 1.004e-01, 8.89e-02]}}
+
+BANDS = ['BAND_C', 'BAND_B', 'BAND_G', 'BAND_Y', 'BAND_R', 'BAND_RE', 'BAND_N', 'BAND_N2']
+
+# The polar stereographic upper left corner and pixel size of the scenes,
+# on the Antarctic Peninsula
+ORIGIN = (-2400000.0, 1300000.0)
+PIXEL_SIZE = 2.0
+
+# The fraction of the columns on the left of a scene without data, like
+# the collar of an orthorectified strip
+COLLAR = 0.05
+
+# The number of rows written at a time
+STRIP_ROWS = 512
+
+# Runs a stage script and prints the peak resident memory of its process
+# and the bytes it read from and wrote to storage last on stderr. The peak
+# the OS reports for a child process also counts the memory of this
+# process it was forked from, but the high water mark in /proc belongs to
+# the memory of the script alone
+PEAK_RSS_RUNNER = '''
+import atexit, resource, runpy, sys
+
+def peak_rss():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    # macOS reports the peak in bytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def io_bytes():
+    # The bytes read from and written to storage by every thread
+    try:
+        with open('/proc/self/io') as io:
+            fields = dict(line.split(':') for line in io)
+        return int(fields['read_bytes']), int(fields['write_bytes'])
+    except (IOError, KeyError, ValueError):
+        return -1, -1
+
+atexit.register(lambda: print('stats', peak_rss(), *io_bytes(), file=sys.stderr))
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name='__main__')
+'''
+
+
+def args_parser():
+    """
+    Reads in the scenes to benchmark from the console
+
+    Parameters:
+    None
+
+    Return:
+    Returns the parsed console arguments
+    """
+
+    parser = argparse.ArgumentParser(description='Benchmarks the stage scripts on ' +
+                                     'synthetic WorldView scenes')
+
+    parser.add_argument('-s', '--sizes', type=str, default='1024',
+                        help=('The comma separated edge lengths of the scenes in pixels, ' +
+                              'e.g. 1024,4096,40000'))
+    parser.add_argument('--satids', type=str, default='WV02,WV03',
+                        help=('The comma separated satellites to make scenes of'))
+    parser.add_argument('--stages', type=str, default=','.join(name for name, _, _ in STAGES),
+                        help=('The comma separated stages to time. A stage reads the ' +
+                              'outputs of the ones before it, which are run untimed'))
+    parser.add_argument('-a', '--stage_args', type=str, default='',
+                        help=('More options passed to rad, atmcorr_specmath, refl and ' +
+                              'class, e.g. "--threads 4 --tile_size 1024"'))
+    parser.add_argument('-n', '--repeats', type=int, default=1,
+                        help=('The number of timed runs of each stage. The fastest is kept'))
+    parser.add_argument('-d', '--work_dir', type=str, default=None,
+                        help=('The directory to write the scenes into. Defaults to a ' +
+                              'temporary directory that is removed afterwards'))
+    parser.add_argument('-o', '--output', type=str, default='bench_stages.json',
+                        help=('The JSON file to save the results to'))
+    parser.add_argument('-c', '--compare', type=str, default=None,
+                        help=('The JSON file of an earlier run to compare with'))
+    parser.add_argument('-t', '--threshold', type=float, default=0.1,
+                        help=('The fraction by which a stage may get slower before it ' +
+                              'is reported as a regression'))
+
+    return parser.parse_args()
+
+
+def synthetic_strip(row_off, rows, width, size, seed):
+    """
+    Makes a strip of raw digital numbers. A smooth field of a few waves
+    with some noise spans the whole range of the band sum classes in areas
+    of many pixels, so the masks have polygons of realistic sizes. The
+    collar on the left has no data.
+
+    Parameters:
+    row_off - the first row of the strip
+    rows    - the number of rows of the strip
+    width   - the width of the scene
+    size    - the edge length the waves are scaled to
+    seed    - the seed of the noise of the strip
+
+    Return:
+    A uint16 (8, rows, width) block
+    """
+
+    y = (np.arange(row_off, row_off + rows, dtype=np.float32) / size)[:, None]
+    x = (np.arange(width, dtype=np.float32) / size)[None, :]
+    field = (0.5 + 0.3 * np.sin(2 * np.pi * 3 * x) * np.cos(2 * np.pi * 2 * y) +
+             0.2 * np.sin(2 * np.pi * 7 * (x + y)))
+
+    rng = np.random.default_rng(seed)
+    # The bands get darker towards the near infrared, like snow does
+    bands = np.linspace(1.0, 0.6, 8, dtype=np.float32)[:, None, None]
+    dn = 100 + 1800 * np.clip(field[None] * bands +
+                              rng.normal(0, 0.02, (8, rows, width)).astype(np.float32), 0, 1)
+    dn = dn.astype(np.uint16)
+    dn[:, :, :int(width * COLLAR)] = 0
+
+    return dn
+
+
+def write_scene(folder, satid, size, seed=0):
+    """
+    Writes a synthetic raw image, its .xml and the ENVI plot files of
+    spectra collected from it.
+
+    Parameters:
+    folder - the directory to write into
+    satid  - the satellite, a key of SATELLITES
+    size   - the edge length of the image in pixels
+    seed   - the seed of the noise
+
+    Return:
+    The name of the raw image without .tif
+    """
+
+    values = SATELLITES[satid]
+    tlctime = values['tlctime']
+    # Named like the raw images, e.g. WV02_20101025205221_SYNTH-M1BS-..._u16ns3031
+    scene = '{}_{}_SYNTH{}-M1BS-1030010000000000_u16ns3031'.format(
+        satid, tlctime[:19].replace('-', '').replace(':', '').replace('T', ''), size)
+
+    transform = from_origin(ORIGIN[0], ORIGIN[1], PIXEL_SIZE, PIXEL_SIZE)
+    meta = {'driver': 'GTiff', 'width': size, 'height': size, 'count': 8,
+            'dtype': 'uint16', 'crs': 'EPSG:3031', 'transform': transform,
+            'bigtiff': 'IF_SAFER'}
+    with rasterio.open(os.path.join(folder, scene + '.tif'), 'w', **meta) as dst:
+        for row_off in range(0, size, STRIP_ROWS):
+            rows = min(STRIP_ROWS, size - row_off)
+            dst.write(synthetic_strip(row_off, rows, size, size, seed + row_off),
+                      window=Window(0, row_off, size, rows))
+
+    write_xml(os.path.join(folder, scene + '.xml'), satid, transform, size)
+    write_spectra(folder, scene, seed)
+
+    return scene
+
+
+def write_xml(path, satid, transform, size):
+    """
+    Writes the .xml of a synthetic scene, with the layout of the
+    DigitalGlobe .xml and the corners of the scene in latitude and
+    longitude.
+
+    Parameters:
+    path      - the path of the .xml
+    satid     - the satellite, a key of SATELLITES
+    transform - the affine transform of the image
+    size      - the edge length of the image in pixels
+
+    Return:
+    None
+    """
+
+    values = SATELLITES[satid]
+
+    # The corners of the image, upper left, upper right, lower right and
+    # lower left
+    cols, rows = [0, size, size, 0], [0, 0, size, size]
+    xs = [transform.c + transform.a * col for col in cols]
+    ys = [transform.f + transform.e * row for row in rows]
+    lons, lats = warp_transform('EPSG:3031', 'EPSG:4326', xs, ys)
+    corners = ''.join('<{0}LON>{1:.8f}</{0}LON><{0}LAT>{2:.8f}</{0}LAT>'.format(corner, lon, lat)
+                      for corner, lon, lat in zip(['UL', 'UR', 'LR', 'LL'], lons, lats))
+
+    bands = ''.join('<{0}>{1}<ABSCALFACTOR>{2:.6e}</ABSCALFACTOR>'
+                    '<EFFECTIVEBANDWIDTH>{3:.4e}</EFFECTIVEBANDWIDTH></{0}>'.format(
+                        band, corners, abscal, effbw)
+                    for band, abscal, effbw in zip(BANDS, values['abscalfactor'],
+                                                   values['effbandwidth']))
+
+    xml = ('<?xml version="1.0" encoding="UTF-8"?>\n<isd><IMD>'
+           '<PRODUCTLEVEL>LV2A</PRODUCTLEVEL><NUMROWS>{rows}</NUMROWS>'
+           '<NUMCOLUMNS>{rows}</NUMCOLUMNS>{bands}'
+           '<IMAGE><SATID>{satid}</SATID><FIRSTLINETIME>{time}</FIRSTLINETIME>'
+           '<AVGLINERATE>{rate}</AVGLINERATE><TLCTIME>{time}</TLCTIME>'
+           '<MEANSUNAZ>60.0</MEANSUNAZ><MEANSUNEL>{sunel}</MEANSUNEL></IMAGE></IMD>'
+           '<SOURCE_IMAGE>ortho{source}-M1BS-1030010000000000</SOURCE_IMAGE></isd>\n').format(
+               rows=size, bands=bands, satid=satid, time=values['tlctime'],
+               rate=5000.0, sunel=values['meansunel'],
+               source=time.strftime('%y%b%d%H%M%S', time.strptime(values['tlctime'][:19],
+                                                                  '%Y-%m-%dT%H:%M:%S')).upper())
+
+    with open(path, 'w') as xml_file:
+        xml_file.write(xml)
+
+
+def write_spectra(folder, scene, seed=0, files=5, spectra=20):
+    """
+    Writes ENVI ASCII plot files of spectra collected from dark areas of a
+    scene, named like the ones atmcorr_regr.py reads.
+
+    Parameters:
+    folder  - the directory to write into
+    scene   - the name of the raw image without .tif
+    seed    - the seed of the spectra
+    files   - the number of plot files
+    spectra - the number of spectra in every file
+
+    Return:
+    None
+    """
+
+    rng = np.random.default_rng(seed)
+    wavelengths = [0.427, 0.478, 0.546, 0.608, 0.659, 0.724, 0.831, 0.908]
+    # Dark objects are bright in the blue and fall off towards the infrared
+    path_radiance = np.array([38.0, 30.0, 19.0, 12.0, 9.0, 6.0, 4.0, 2.0])
+
+    for i in range(1, files + 1):
+        scale = rng.uniform(0.5, 3.0, spectra)
+        values = (path_radiance[:, None] * (1 + 0.1 * scale[None, :]) +
+                  rng.normal(0, 0.5, (8, spectra)))
+        lines = ['ENVI ASCII Plot File [Synthetic]', 'Column 1: Wavelength']
+        lines += ['Column {}: X:{} Y:{}~~{}'.format(j + 2, 1000 + j, 2000 + j, j + 1)
+                  for j in range(spectra)]
+        lines += ['  ' + '  '.join(['{:.6f}'.format(wavelengths[band])] +
+                                   ['{:.6f}'.format(value) for value in values[band]])
+                  for band in range(8)]
+        with open(os.path.join(folder, '{}_rad_atmcorr{}.txt'.format(scene, i)), 'w') as txt:
+            txt.write('\n'.join(lines) + '\n')
+
+
+def run_stage(script, folder, args):
+    """
+    Runs a stage script on a directory in its own process and measures it.
+
+    Parameters:
+    script - the path of the script, relative to src
+    folder - the directory of the scene
+    args   - more arguments of the script
+
+    Return:
+    A tuple of the wall time in seconds, the peak resident memory of the
+    process in bytes and the bytes it read from and wrote to storage, or
+    None for those where /proc/self/io doesn't exist
+    """
+
+    # atmcorr_specmath.py joins the directory and the names without a
+    # separator
+    folder = os.path.join(folder, '')
+    command = [sys.executable, '-c', PEAK_RSS_RUNNER, os.path.join(SRC_DIR, script),
+               '-ip', folder]
+    if not script.endswith(('atmcorr_regr.py', 'shp.py')):
+        command += ['-op', folder]
+
+    start = time.perf_counter()
+    process = subprocess.run(command + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True)
+    seconds = time.perf_counter() - start
+
+    lines = process.stderr.splitlines()
+    if process.returncode != 0 or 'FAILED' in process.stdout or not lines:
+        raise RuntimeError('{} failed:\n{}{}'.format(script, process.stdout, process.stderr))
+
+    rss, read, written = (int(value) for value in lines[-1].split()[1:])
+    if read < 0:
+        read = written = None
+
+    return seconds, rss, read, written
+
+
+def bench_scene(folder, scene, size, stages, stage_args, repeats=1):
+    """
+    Runs the stages on a scene and measures every timed stage.
+
+    Parameters:
+    folder     - the directory of the scene
+    scene      - the name of the raw image without .tif
+    size       - the edge length of the image in pixels
+    stages     - the names of the stages to time
+    stage_args - more arguments of rad, atmcorr_specmath, refl and class
+    repeats    - the number of timed runs of each stage
+
+    Return:
+    A list of the result dict of every timed stage
+    """
+
+    results = []
+    for name, script, inputs in STAGES:
+        args = stage_args if name in ('rad', 'atmcorr_specmath', 'refl', 'class') else []
+        # The size of the input files, which the stage may read only part
+        # of, e.g. when it skips the tiles without data
+        input_size = sum(os.path.getsize(path) for pattern in inputs
+                         for path in glob.glob(os.path.join(folder,
+                                                            pattern.format(scene=scene))))
+
+        best, peak_rss, read, written = float('inf'), 0, None, None
+        for _ in range(repeats if name in stages else 1):
+            # Without the manifest the stage doesn't skip the outputs of
+            # the run before
+            if os.path.isfile(os.path.join(folder, MANIFEST_NAME)):
+                os.remove(os.path.join(folder, MANIFEST_NAME))
+            seconds, rss, run_read, run_written = run_stage(script, folder, args)
+            # The bytes of the fastest run are kept with its time
+            if seconds < best:
+                best, read, written = seconds, run_read, run_written
+            peak_rss = max(peak_rss, rss)
+            if name not in stages:
+                break
+
+        if name in stages:
+            results.append({'stage': name, 'seconds': round(best, 4),
+                            'mpix_per_s': round(size * size / 1e6 / best, 3),
+                            'peak_rss_mb': round(peak_rss / 2 ** 20, 1),
+                            'bytes_read': read, 'bytes_written': written,
+                            'input_file_bytes': input_size})
+            print('{:<18} {:>9.3f} s {:>10.2f} MPix/s {:>9.1f} MB {:>14} read {:>14} written '
+                  '{:>14} input'.format(name, best, size * size / 1e6 / best,
+                                        peak_rss / 2 ** 20, str(read), str(written),
+                                        input_size))
+
+    return results
+
+
+def compare(results, previous, threshold):
+    """
+    Prints how the time of every stage changed since an earlier run.
+
+    Parameters:
+    results   - the results of this run
+    previous  - the results of the earlier run
+    threshold - the fraction a stage may get slower before it is reported
+
+    Return:
+    A list of the (satid, size, stage) of every regression
+    """
+
+    before = {(r['satid'], r['size'], r['stage']): r for r in previous['results']}
+    regressions = []
+    print('\nCompared with {}:'.format(previous.get('commit') or 'the earlier run'))
+    for r in results['results']:
+        key = (r['satid'], r['size'], r['stage'])
+        if key not in before:
+            continue
+        ratio = r['seconds'] / before[key]['seconds']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        print('{} {:>6} {:<18} {:>9.3f} s -> {:>9.3f} s  x{:.2f}{}'.format(
+            key[0], key[1], key[2], before[key]['seconds'], r['seconds'], ratio, flag))
+
+    return regressions
+
+
+def git_commit():
+    """
+    Finds the commit of the benchmarked code.
+
+    Parameters:
+    None
+
+    Return:
+    The hash of the checked out commit, or None outside of git
+    """
+
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=SRC_DIR,
+                                       stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    """
+    Main function. Writes the scenes, runs the stages on them, saves the
+    results and compares them with an earlier run.
+
+    Parameters:
+    None
+
+    Return:
+    None
+    """
+
+    args = args_parser()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    satids = [satid.strip() for satid in args.satids.split(',')]
+    stages = [stage.strip() for stage in args.stages.split(',')]
+    unknown = [stage for stage in stages if stage not in [name for name, _, _ in STAGES]]
+    if unknown:
+        sys.exit('Unknown stages: ' + ', '.join(unknown))
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='bench_stages_')
+    results = {'commit': git_commit(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python': platform.python_version(), 'machine': platform.node(),
+               'cpus': os.cpu_count(), 'stage_args': args.stage_args, 'results': []}
+
+    try:
+        for satid in satids:
+            for size in sizes:
+                folder = os.path.join(work_dir, '{}_{}'.format(satid, size))
+                if os.path.isdir(folder):
+                    shutil.rmtree(folder)
+                os.makedirs(folder)
+
+                start = time.perf_counter()
+                scene = write_scene(folder, satid, size)
+                print('\n{} {} x {}: written in {:.1f} s'.format(
+                    satid, size, size, time.perf_counter() - start))
+
+                for result in bench_scene(folder, scene, size, stages, args.stage_args.split(),
+                                          args.repeats):
+                    results['results'].append(dict(result, satid=satid, size=size))
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+    print('\nSaved the results to ' + args.output)
+
+    if args.compare:
+        with open(args.compare, 'r') as previous:
+            if compare(results, json.load(previous), args.threshold):
+                sys.exit(1)
+
+
+# If the script was directly called, run the script
+if __name__ == '__main__':
+    main()